@@ -0,0 +1 @@
+default_app_config = 'black_list.apps.BlackListConfig'
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BlackListConfig(AppConfig):
     name = 'black_list'
+
+    def ready(self):
+        import black_list.signals  # noqa: F401
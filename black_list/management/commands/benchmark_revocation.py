@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from black_list.models import TokenBlackList, token_digest
+from server.views import CivilGraphQLView
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a vazão de requisições autenticadas com e sem o filtro de '
+        'revogação compartilhado, com a black list populada. Os dados '
+        'gerados são descartados ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revoked', type=int, default=100000)
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        user = get_user_model().objects.create(username='benchmark-revocation')
+        TokenBlackList.objects.bulk_create(
+            TokenBlackList(token_digest=token_digest(uuid.uuid4().hex))
+            for _ in range(options['revoked'])
+        )
+        view = CivilGraphQLView.as_view()
+        factory = RequestFactory()
+        body = json.dumps({'query': '{ tags { edges { node { id } } } }'})
+
+        def measure():
+            start = time.perf_counter()
+            for _ in range(options['requests']):
+                request = factory.post(
+                    '/graphql/', body,
+                    content_type='application/json',
+                    HTTP_AUTHORIZATION='JWT %s' % uuid.uuid4().hex
+                )
+                request.user = user
+                view(request)
+            return options['requests'] / (time.perf_counter() - start)
+
+        with override_settings(TOKEN_BLACKLIST_FILTER_PATH=None):
+            database = measure()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'token_blacklist.bloom')
+            with override_settings(TOKEN_BLACKLIST_FILTER_PATH=path):
+                start = time.perf_counter()
+                TokenBlackList.objects.is_revoked('JWT warmup')
+                build = time.perf_counter() - start
+                shared = measure()
+
+        self.stdout.write('revoked tokens: %s' % options['revoked'])
+        self.stdout.write('filter build: %.3fs' % build)
+        self.stdout.write('database lookup: %.0f req/s' % database)
+        self.stdout.write('shared filter: %.0f req/s' % shared)
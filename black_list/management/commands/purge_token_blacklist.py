@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from black_list.models import TokenBlackList
+from black_list.revocation import get_revocation_filter
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove da black list os tokens já expirados e reconstrói o filtro '
+        'de revogação compartilhado. '
+        'Deve ser executado periodicamente (ex.: cron diário).'
+    )
+
+    def handle(self, *args, **options):
+        purged = TokenBlackList.objects.purge_expired()
+
+        revocation_filter = get_revocation_filter()
+        if revocation_filter is not None:
+            revocation_filter.rebuild()
+        self.stdout.write('Purged %s expired tokens.' % purged)
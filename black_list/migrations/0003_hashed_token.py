@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# cópias de black_list.models.token_digest e token_expiration no momento
+# desta migration
+def token_digest(token):
+    return hashlib.sha256(token.split()[-1].encode()).hexdigest()
+
+
+def token_expiration(token):
+    try:
+        payload = token.split()[-1].split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload.encode()))['exp']
+        return datetime.fromtimestamp(exp, tz=timezone.utc)
+    except Exception:
+        return None
+
+
+def hash_tokens(apps, schema_editor):
+    TokenBlackList = apps.get_model('black_list', 'TokenBlackList')
+    seen = set()
+    for revoked in TokenBlackList.objects.all():
+        # sem token não há o que revogar
+        if not (revoked.token or '').strip():
+            revoked.delete()
+            continue
+
+        digest = token_digest(revoked.token)
+        # o mesmo token pode ter sido revogado mais de uma vez
+        if digest in seen:
+            revoked.delete()
+            continue
+        seen.add(digest)
+        revoked.token_digest = digest
+        revoked.expires_at = token_expiration(revoked.token)
+        revoked.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('black_list', '0002_auto_20190428_1701'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokenblacklist',
+            name='token_digest',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='tokenblacklist',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.RunPython(hash_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='tokenblacklist',
+            name='token',
+        ),
+        migrations.AlterField(
+            model_name='tokenblacklist',
+            name='token_digest',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
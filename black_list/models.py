@@ -1,8 +1,99 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+
 from django.db import models
+from django.utils import timezone
+
+from black_list.revocation import get_revocation_filter
+
+
+def token_digest(token):
+    '''
+    Retorna o digest SHA-256 de um token JWT.
+    Aceita tanto o token puro quanto o valor do header Authorization
+    ("JWT <token>").
+
+    param token: <str>
+    rtype: <str>
+    '''
+    parts = token.split()
+    token = parts[-1] if parts else ''
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def token_expiration(token):
+    '''
+    Lê o instante de expiração (claim exp) de um token JWT.
+    A assinatura não é verificada aqui: o token já foi autenticado pelo
+    middleware JWT antes de ser revogado.
+
+    param token: <str>
+    rtype: <datetime> ou None se o token não puder ser lido
+    '''
+    try:
+        payload = token.split()[-1].split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload.encode()))['exp']
+        return datetime.fromtimestamp(exp, tz=timezone.utc)
+    except Exception:
+        return None
+
+
+class TokenBlackListManager(models.Manager):
+
+    def revoke(self, token):
+        '''
+        Adiciona o token à black list. O filtro de revogação é marcado
+        pelo post_save (ver black_list.signals).
+
+        param token: <str>
+        rtype: <TokenBlackList>
+        '''
+        revoked, _ = self.get_or_create(
+            token_digest=token_digest(token),
+            defaults={'expires_at': token_expiration(token)}
+        )
+        return revoked
+
+    def is_revoked(self, token):
+        '''
+        Verifica se o token está na black list.
+        O filtro de revogação compartilhado responde sem acessar o banco
+        quando o token certamente não foi revogado.
+
+        param token: <str>
+        rtype: <bool>
+        '''
+        digest = token_digest(token)
+        revocation_filter = get_revocation_filter()
+        if revocation_filter is not None and \
+                not revocation_filter.might_contain(digest):
+            return False
+        return self.filter(token_digest=digest).exists()
+
+    def purge_expired(self):
+        '''
+        Remove os tokens que já expiraram, pois estes não podem mais
+        ser autenticados de qualquer forma.
+
+        rtype: <int> quantidade de tokens removidos
+        '''
+        deleted, _ = self.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
 
 class TokenBlackList(models.Model):
     '''
     Define tokens bloqueados no sistema.
     Tokens listados aqui não poderão ser autenticados.
+
+    O token em si não é armazenado, somente o seu digest, que possui
+    tamanho fixo e é indexado. Após a expiração do JWT o registro
+    pode ser removido (ver comando purge_token_blacklist).
     '''
-    token = models.TextField()
+    token_digest = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(null=True, db_index=True)
+
+    objects = TokenBlackListManager()
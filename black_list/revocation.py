@@ -0,0 +1,198 @@
+'''
+Cache de revogação de tokens compartilhado entre processos.
+
+Um Bloom filter gravado em arquivo e mapeado em memória (mmap) por todos
+os workers do servidor. O filtro nunca responde "não revogado" para um
+token que foi revogado, então no caso comum (token válido) a verificação
+é respondida sem consultar o banco. Quando o filtro indica que o token
+pode ter sido revogado, a resposta exata vem da tabela TokenBlackList.
+
+O arquivo é criado a partir do banco no primeiro uso, com um nome próprio
+para cada banco de dados: um banco novo (ex.: o banco dos testes) nunca
+usa o filtro de outro. Alterações no filtro são feitas sob uma trava de
+arquivo; leituras não precisam de trava. O
+tamanho do filtro vem do próprio arquivo: TOKEN_BLACKLIST_FILTER_BITS só
+vale para os arquivos criados depois da sua alteração. A reconstrução
+grava um novo arquivo, que os workers passam a mapear na verificação
+seguinte.
+'''
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from server.locks import FileLock
+
+
+# quantidade de posições verificadas por token
+HASHES = 7
+
+
+def positions(digest, bits):
+    '''
+    Posições do filtro correspondentes a um digest SHA-256 (hexadecimal),
+    calculadas por hashing duplo sobre o próprio digest.
+
+    param digest: <str>
+    param bits: <int> tamanho do filtro
+    rtype: <list>
+    '''
+    first = int(digest[:16], 16)
+    second = int(digest[16:32], 16) | 1
+    return [(first + i * second) % bits for i in range(HASHES)]
+
+
+class RevocationFilter:
+    '''
+    Bloom filter de digests de tokens revogados.
+
+    param path: <str>
+    param bits: <int> tamanho dos arquivos criados
+    '''
+    def __init__(self, path, bits):
+        self.path = path
+        self.bits = bits
+        # (inode, mmap, tamanho em bits) do arquivo mapeado
+        self.mapping = None
+        self.lock = threading.Lock()
+
+    def _build(self, digests):
+        data = bytearray(self.bits // 8)
+        for digest in digests:
+            for position in positions(digest, self.bits):
+                data[position >> 3] |= 1 << (position & 7)
+        return data
+
+    def _revoked_digests(self):
+        from black_list.models import TokenBlackList
+
+        revoked = TokenBlackList.objects.exclude(expires_at__lte=timezone.now())
+        return revoked.values_list('token_digest', flat=True).iterator()
+
+    def _open(self):
+        '''
+        Mapeia o arquivo do filtro, criando-o a partir do banco caso não
+        exista. Um arquivo substituído (ver `rebuild`) é mapeado novamente.
+
+        rtype: <tuple> (mmap, tamanho do filtro em bits)
+        '''
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+
+        # enquanto mapeado, o inode do arquivo antigo não é reutilizado
+        mapping = self.mapping
+        if mapping is not None and mapping[0] == inode:
+            return mapping[1], mapping[2]
+
+        with self.lock:
+            if inode is None:
+                with FileLock(self.path):
+                    if not os.path.exists(self.path):
+                        self._create()
+
+            with open(self.path, 'r+b') as filter_file:
+                stat = os.fstat(filter_file.fileno())
+                memory = mmap.mmap(filter_file.fileno(), stat.st_size)
+            self.mapping = (stat.st_ino, memory, stat.st_size * 8)
+            return memory, stat.st_size * 8
+
+    def _create(self):
+        # o arquivo só aparece no caminho final depois de populado, assim
+        # nenhum processo enxerga um filtro incompleto
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(descriptor, 'wb') as filter_file:
+            filter_file.write(self._build(self._revoked_digests()))
+        os.replace(temporary, self.path)
+
+    def might_contain(self, digest):
+        '''
+        Indica se o token pode ter sido revogado.
+        Uma resposta negativa é definitiva.
+
+        param digest: <str>
+        rtype: <bool>
+        '''
+        memory, bits = self._open()
+        return all(
+            memory[position >> 3] & (1 << (position & 7))
+            for position in positions(digest, bits)
+        )
+
+    def add(self, digest):
+        '''
+        Marca o token como (possivelmente) revogado para todos os processos.
+
+        param digest: <str>
+        '''
+        self._open()
+        with FileLock(self.path):
+            # o arquivo pode ter sido substituído antes da trava
+            memory, bits = self._open()
+            for position in positions(digest, bits):
+                memory[position >> 3] |= 1 << (position & 7)
+
+    def rebuild(self):
+        '''
+        Reconstrói o filtro a partir do banco em um novo arquivo, com o
+        tamanho atual de TOKEN_BLACKLIST_FILTER_BITS, descartando os tokens
+        que já expiraram. Os workers continuam lendo o arquivo antigo até a
+        sua próxima verificação, então nenhum token revogado deixa de ser
+        reconhecido.
+
+        A reconstrução é feita sob a trava das revogações. Uma revogação
+        ainda não confirmada no banco fica de fora da reconstrução, por isso
+        o post_save (ver black_list.signals) marca o filtro novamente após o
+        commit.
+        '''
+        with FileLock(self.path):
+            self._create()
+
+
+_filters = {}
+_filters_lock = threading.Lock()
+
+
+def filter_path(path):
+    '''
+    Caminho do arquivo do filtro para o banco de dados em uso.
+
+    param path: <str> TOKEN_BLACKLIST_FILTER_PATH
+    rtype: <str>
+    '''
+    connection = connections[DEFAULT_DB_ALIAS]
+    database = json.dumps([
+        connection.vendor,
+        connection.settings_dict['NAME'],
+        connection.settings_dict['HOST'],
+        connection.settings_dict['PORT'],
+    ])
+    return '%s.%s' % (path, hashlib.sha256(database.encode()).hexdigest()[:16])
+
+
+def get_revocation_filter():
+    '''
+    Retorna o filtro de revogação configurado em
+    TOKEN_BLACKLIST_FILTER_PATH, ou None caso esteja desabilitado.
+
+    rtype: <RevocationFilter>
+    '''
+    path = getattr(settings, 'TOKEN_BLACKLIST_FILTER_PATH', None)
+    if not path:
+        return None
+
+    path = filter_path(path)
+
+    bits = settings.TOKEN_BLACKLIST_FILTER_BITS
+    with _filters_lock:
+        if (path, bits) not in _filters:
+            _filters[(path, bits)] = RevocationFilter(path, bits)
+        return _filters[(path, bits)]
@@ -0,0 +1,32 @@
+'''
+Signals da black list.
+Marca no filtro de revogação compartilhado os tokens gravados por qualquer
+caminho: TokenBlackListManager.revoke, o admin, objects.create, fixtures e
+migrations.
+'''
+import os
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from black_list.revocation import get_revocation_filter
+
+
+@receiver(post_save)
+def mark_revoked_token(sender, instance, **kwargs):
+    # o label também identifica o model histórico usado nas migrations
+    if sender._meta.label_lower != 'black_list.tokenblacklist':
+        return
+
+    revocation_filter = get_revocation_filter()
+    if revocation_filter is None:
+        return
+
+    digest = instance.token_digest
+    # um filtro ainda não criado é construído a partir do banco, e durante
+    # uma migration o banco ainda não tem a forma final
+    if os.path.exists(revocation_filter.path):
+        revocation_filter.add(digest)
+    # uma reconstrução do filtro antes do commit não enxerga o token
+    transaction.on_commit(lambda: revocation_filter.add(digest))
@@ -1,3 +1,212 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.core.management import call_command
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from black_list.models import TokenBlackList, token_digest
+from black_list.revocation import RevocationFilter, get_revocation_filter
+from server.views import CivilGraphQLView
+
+
+@override_settings(TOKEN_BLACKLIST_FILTER_PATH=None)
+class AccessRequiredTestCase(TestCase):
+    """
+    A black list é consultada uma única vez por requisição.
+    """
+    query = '''
+    query {
+        portals { edges { node { name } } }
+        topics { edges { node { name } } }
+        news { edges { node { title } } }
+        rules { edges { node { description } } }
+        tags { edges { node { reference } } }
+    }
+    '''
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = get_user_model().objects.create(username='mage')
+
+    def post(self, query, token='JWT token'):
+        request = self.factory.post(
+            '/graphql/',
+            json.dumps({'query': query}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=token
+        )
+        request.user = self.user
+        response = CivilGraphQLView.as_view()(request)
+        return json.loads(response.content.decode())
+
+    def blacklist_queries(self, query, token='JWT token'):
+        with CaptureQueriesContext(connection) as context:
+            content = self.post(query, token)
+        queries = [
+            q for q in context.captured_queries
+            if TokenBlackList._meta.db_table in q['sql']
+        ]
+        return content, len(queries)
+
+    def test_single_lookup_per_request(self):
+        content, lookups = self.blacklist_queries(self.query)
+        self.assertNotIn('errors', content)
+        self.assertEqual(lookups, 1)
+
+    def test_revoked_token(self):
+        TokenBlackList.objects.revoke('JWT revoked')
+        content, lookups = self.blacklist_queries(self.query, 'JWT revoked')
+        self.assertEqual(lookups, 1)
+        self.assertEqual(len(content['errors']), 5)
+        self.assertEqual(
+            content['errors'][0]['message'], 'Session Expired, please log in again!'
+        )
+
+    def test_logout_revokes_for_the_rest_of_the_request(self):
+        content = self.post('''
+            mutation {
+                logOut(input: {}) { response }
+                createTag(input: {reference: "late"}) { tag { reference } }
+            }
+        ''')
+        self.assertEqual(content['data']['logOut']['response'], 'Bye Bye')
+        self.assertIsNone(content['data']['createTag'])
+        self.assertTrue(TokenBlackList.objects.is_revoked('token'))
+
+
+def make_token(expires_at):
+    def encode(data):
+        return base64.urlsafe_b64encode(
+            json.dumps(data).encode()
+        ).decode().rstrip('=')
+
+    payload = {'username': 'mage', 'exp': int(expires_at.timestamp())}
+    return '%s.%s.signature' % (encode({'alg': 'HS256'}), encode(payload))
+
+
+@override_settings(TOKEN_BLACKLIST_FILTER_PATH=None)
+class TokenBlackListTestCase(TestCase):
+    """
+    Tokens revogados são guardados pelo digest e expiram junto com o JWT.
+    """
+    def test_revoke_stores_digest_and_expiration(self):
+        expires_at = timezone.now().replace(microsecond=0) + timedelta(minutes=5)
+        token = make_token(expires_at)
+
+        revoked = TokenBlackList.objects.revoke('JWT ' + token)
+        self.assertNotIn(token, revoked.token_digest)
+        self.assertEqual(len(revoked.token_digest), 64)
+        self.assertEqual(revoked.expires_at, expires_at)
+        self.assertTrue(TokenBlackList.objects.is_revoked(token))
+
+        # revogar novamente não duplica o registro
+        TokenBlackList.objects.revoke('JWT ' + token)
+        self.assertEqual(TokenBlackList.objects.count(), 1)
+
+    def test_purge_expired(self):
+        now = timezone.now()
+        TokenBlackList.objects.revoke(make_token(now - timedelta(minutes=1)))
+        TokenBlackList.objects.revoke(make_token(now + timedelta(minutes=1)))
+
+        self.assertEqual(TokenBlackList.objects.purge_expired(), 1)
+        self.assertEqual(TokenBlackList.objects.count(), 1)
+
+
+class RevocationFilterTestCase(TestCase):
+    """
+    O filtro compartilhado evita consultas ao banco para tokens válidos.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        filter_settings = self.settings(
+            TOKEN_BLACKLIST_FILTER_PATH=os.path.join(directory.name, 'bloom'),
+            TOKEN_BLACKLIST_FILTER_BITS=2 ** 16
+        )
+        filter_settings.enable()
+        self.addCleanup(filter_settings.disable)
+
+    def test_valid_token_skips_database(self):
+        # revogado antes do filtro existir: entra na construção do filtro
+        old = make_token(timezone.now() + timedelta(minutes=5))
+        TokenBlackList.objects.create(
+            token_digest=token_digest(old),
+            expires_at=timezone.now() + timedelta(minutes=5)
+        )
+        self.assertTrue(TokenBlackList.objects.is_revoked(old))
+
+        valid = make_token(timezone.now() + timedelta(minutes=10))
+        with self.assertNumQueries(0):
+            self.assertFalse(TokenBlackList.objects.is_revoked(valid))
+
+        TokenBlackList.objects.revoke(valid)
+        self.assertTrue(TokenBlackList.objects.is_revoked(valid))
+
+    def test_rebuild_keeps_revoked_tokens(self):
+        expired = make_token(timezone.now() - timedelta(minutes=1))
+        valid = make_token(timezone.now() + timedelta(minutes=1))
+        TokenBlackList.objects.revoke(expired)
+        TokenBlackList.objects.revoke(valid)
+
+        call_command('purge_token_blacklist', stdout=open(os.devnull, 'w'))
+
+        self.assertTrue(TokenBlackList.objects.is_revoked(valid))
+        with self.assertNumQueries(0):
+            self.assertFalse(TokenBlackList.objects.is_revoked(expired))
+
+    def test_size_comes_from_the_file(self):
+        revoked = make_token(timezone.now() + timedelta(minutes=5))
+        valid = make_token(timezone.now() + timedelta(minutes=10))
+        # o filtro é criado no primeiro uso
+        self.assertFalse(TokenBlackList.objects.is_revoked(valid))
+        TokenBlackList.objects.revoke(revoked)
+
+        # o arquivo gravado mantém o tamanho anterior à alteração da setting
+        with self.settings(TOKEN_BLACKLIST_FILTER_BITS=2 ** 17):
+            with self.assertNumQueries(1):
+                self.assertTrue(TokenBlackList.objects.is_revoked(revoked))
+            with self.assertNumQueries(0):
+                self.assertFalse(TokenBlackList.objects.is_revoked(valid))
+
+            get_revocation_filter().rebuild()
+            path = get_revocation_filter().path
+            self.assertEqual(os.path.getsize(path), 2 ** 17 // 8)
+            self.assertTrue(TokenBlackList.objects.is_revoked(revoked))
+
+    def test_workers_map_the_rebuilt_file(self):
+        path = get_revocation_filter().path
+        # filtro de outro worker, que mapeou o arquivo antes da reconstrução
+        other_worker = RevocationFilter(path, 2 ** 16)
+        self.assertFalse(other_worker.might_contain(token_digest('a.b.c')))
+
+        get_revocation_filter().rebuild()
+        token = make_token(timezone.now() + timedelta(minutes=5))
+        TokenBlackList.objects.revoke(token)
+        self.assertTrue(other_worker.might_contain(token_digest(token)))
+
+    def test_every_saved_token_is_marked(self):
+        revocation_filter = get_revocation_filter()
+        self.assertFalse(revocation_filter.might_contain(token_digest('a.b.c')))
+
+        # gravado sem TokenBlackListManager.revoke (ex.: pelo admin)
+        token = make_token(timezone.now() + timedelta(minutes=5))
+        TokenBlackList.objects.create(token_digest=token_digest(token))
+        self.assertTrue(revocation_filter.might_contain(token_digest(token)))
+
+    def test_one_filter_per_database(self):
+        path = get_revocation_filter().path
+        self.assertTrue(path.startswith(settings.TOKEN_BLACKLIST_FILTER_PATH))
+
+        with mock.patch.dict(connection.settings_dict, NAME='other'):
+            other = get_revocation_filter()
+        self.assertNotEqual(other.path, path)
+        self.assertFalse(os.path.exists(other.path))
@@ -1,17 +1,33 @@
 # -*- coding: utf-8 -*-
 '''
 Chatbot simples que aprende de uma lista.
+O bot é criado e treinado somente no primeiro uso.
 '''
+import threading
 
-from chatterbot import ChatBot
-from chatterbot.trainers import ListTrainer
 
-cid = ChatBot('Cid')
-
-trainer = ListTrainer(cid)
-trainer.train([
+TRAINING = [
     "Hello",
     "Oh hello there.",
     "Who are you?",
     "I am Cid, a Chatbot built for helping human interaction."
-])
+]
+
+_bot = {}
+_bot_lock = threading.Lock()
+
+
+def get_list_bot():
+    '''
+    Retorna o bot Cid, treinando-o na primeira chamada.
+    rtype: <chatterbot.ChatBot>
+    '''
+    with _bot_lock:
+        if 'cid' not in _bot:
+            from chatterbot import ChatBot
+            from chatterbot.trainers import ListTrainer
+
+            cid = ChatBot('Cid')
+            ListTrainer(cid).train(TRAINING)
+            _bot['cid'] = cid
+        return _bot['cid']
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+'''
+Motor de respostas do bot de processamento de linguagem natural.
+
+O motor é imutável: o vocabulário, os pesos IDF e a matriz TF-IDF das
+sentenças são calculados na construção e nunca mais alterados. Responder
+uma pergunta não modifica nenhum estado, então a mesma instância pode ser
+usada por várias threads ao mesmo tempo. Para alterar o corpus, um novo
+motor é construído e substitui o anterior.
+
+O motor pode ser gravado em um diretório (ver NlpEngine.save): os vetores
+são arquivos .npy abertos com mmap, então os workers carregam o índice
+quase instantaneamente e compartilham as mesmas páginas de memória.
+'''
+import json
+import multiprocessing
+import os
+import tempfile
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from chatbot.bots.index import MANIFEST
+from chatbot.bots.small_talk import GOODBYE_INPUT, GOODBYE_RESPONSE, greeting
+
+
+ARRAYS = ('idf', 'data', 'indices', 'indptr')
+
+# tentativas de NlpEngine.load quando os arquivos de uma versão são
+# removidos durante a leitura
+LOAD_ATTEMPTS = 3
+
+# sentenças por tarefa na tokenização paralela do corpus
+CHUNK_SIZE = 2000
+
+UNKNOWN_RESPONSE = "I can't undesteand you"
+
+
+def remove_stop_words(tokens):
+    return [token for token in tokens if token not in ENGLISH_STOP_WORDS]
+
+
+_worker = {}
+
+
+def _set_tokenizer(tokenizer):
+    _worker['tokenizer'] = tokenizer
+
+
+def _tokenize_chunk(sentences):
+    tokenizer = _worker['tokenizer']
+    return [tokenizer(sentence.lower()) for sentence in sentences]
+
+
+def tokenize_all(sentences, tokenizer, workers=1):
+    '''
+    Tokeniza as sentenças do corpus, dividindo-as em blocos entre
+    `workers` processos quando o corpus é grande.
+
+    Os processos são criados por fork e herdam o tokenizer (e os recursos
+    já carregados por ele), que não precisa ser serializável.
+
+    param sentences: <list>
+    param tokenizer: <function>
+    param workers: <int>
+    rtype: <list> de listas de termos
+    '''
+    parallel = (
+        workers > 1 and len(sentences) > CHUNK_SIZE and
+        'fork' in multiprocessing.get_all_start_methods()
+    )
+    if not parallel:
+        _set_tokenizer(tokenizer)
+        return _tokenize_chunk(sentences)
+
+    chunks = [
+        sentences[start:start + CHUNK_SIZE]
+        for start in range(0, len(sentences), CHUNK_SIZE)
+    ]
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_set_tokenizer,
+            initargs=(tokenizer,)) as executor:
+        return [
+            tokens
+            for chunk in executor.map(_tokenize_chunk, chunks)
+            for tokens in chunk
+        ]
+
+
+class NlpEngine:
+    '''
+    Responde perguntas com a sentença do corpus mais semelhante (cosseno
+    entre os vetores TF-IDF).
+
+    sentences: <tuple> sentenças do corpus
+    keys: <tuple> documento de origem de cada sentença
+    vocabulary: <dict> termo -> coluna da matriz
+    idf: <numpy.ndarray> peso IDF de cada coluna
+    matrix: <scipy.sparse.csr_matrix> vetores TF-IDF (l2) das sentenças
+    tokenizer: <function> texto -> lista de termos
+    stale: <int> sentenças vetorizadas após o último ajuste do vocabulário
+    '''
+    def __init__(self, sentences, vocabulary, idf, matrix, tokenizer,
+                 keys=None, stale=0):
+        self.sentences = tuple(sentences)
+        self.keys = tuple(keys) if keys is not None else (None,) * len(sentences)
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.matrix = matrix
+        self.tokenizer = tokenizer
+        self.stale = stale
+
+        for array in (idf, matrix.data, matrix.indices, matrix.indptr):
+            array.flags.writeable = False
+
+    @classmethod
+    def fit(cls, sentences, tokenizer, keys=None, workers=1):
+        '''
+        Aprende o vocabulário e os pesos IDF das sentenças.
+        O tokenizer é executado sobre todo o corpus aqui, o que também
+        carrega os recursos que ele usa antes do motor ser compartilhado.
+
+        param sentences: <list>
+        param tokenizer: <function>
+        param keys: <list> documento de origem de cada sentença
+        param workers: <int> processos usados para tokenizar o corpus
+        rtype: <NlpEngine>
+        '''
+        vectorizer = TfidfVectorizer(analyzer=remove_stop_words)
+        try:
+            matrix = vectorizer.fit_transform(
+                tokenize_all(sentences, tokenizer, workers)
+            ).tocsr()
+        except ValueError:
+            # corpus vazio ou formado somente por stop words
+            return cls(
+                sentences, {}, np.zeros(0), csr_matrix((len(sentences), 0)),
+                tokenizer, keys
+            )
+
+        vocabulary = {
+            term: int(column) for term, column in vectorizer.vocabulary_.items()
+        }
+        return cls(
+            sentences, vocabulary, vectorizer.idf_, matrix, tokenizer, keys
+        )
+
+    def update(self, removed_keys, sentences, keys):
+        '''
+        Retorna um novo motor sem as sentenças dos documentos removidos e
+        com as novas sentenças, que são vetorizadas com o vocabulário e os
+        pesos IDF atuais, sem reprocessar o restante do corpus. Termos
+        novos só passam a contar após um novo ajuste (ver `refit`).
+
+        param removed_keys: <set> documentos removidos ou alterados
+        param sentences: <list> novas sentenças
+        param keys: <list> documento de origem de cada nova sentença
+        rtype: <NlpEngine>
+        '''
+        kept = [
+            row for row, key in enumerate(self.keys) if key not in removed_keys
+        ]
+        matrix = vstack([
+            self.matrix[kept], self.vectorize(sentences)
+        ], format='csr')
+        return NlpEngine(
+            [self.sentences[row] for row in kept] + list(sentences),
+            self.vocabulary,
+            self.idf,
+            matrix,
+            self.tokenizer,
+            [self.keys[row] for row in kept] + list(keys),
+            self.stale + len(sentences)
+        )
+
+    def refit(self, workers=1):
+        '''
+        Ajusta novamente o vocabulário e os pesos IDF a todo o corpus.
+
+        param workers: <int> processos usados para tokenizar o corpus
+        rtype: <NlpEngine>
+        '''
+        return NlpEngine.fit(self.sentences, self.tokenizer, self.keys, workers)
+
+    def save(self, path):
+        '''
+        Grava o motor no diretório informado.
+
+        Cada gravação gera arquivos novos, identificados por uma versão, e
+        o manifesto que aponta para eles é substituído atomicamente por
+        último. Os arquivos da versão anterior são mantidos até a próxima
+        gravação, pois outros processos podem ter acabado de ler o
+        manifesto antigo; os que já mapearam os vetores continuam lendo os
+        arquivos removidos até recarregarem o índice.
+        Deve ser chamada com a trava do diretório adquirida.
+
+        param path: <str>
+        rtype: <str> versão gravada
+        '''
+        os.makedirs(path, exist_ok=True)
+        version = uuid.uuid4().hex
+        arrays = {
+            'idf': self.idf,
+            'data': self.matrix.data,
+            'indices': self.matrix.indices,
+            'indptr': self.matrix.indptr,
+        }
+        files = {}
+        for name, array in arrays.items():
+            files[name] = '%s-%s.npy' % (name, version)
+            np.save(os.path.join(path, files[name]), array)
+
+        files['corpus'] = 'corpus-%s.json' % version
+        with open(os.path.join(path, files['corpus']), 'w') as corpus_file:
+            json.dump({
+                'sentences': self.sentences,
+                'keys': self.keys,
+                'vocabulary': self.vocabulary,
+                'stale': self.stale,
+            }, corpus_file)
+
+        try:
+            with open(os.path.join(path, MANIFEST)) as manifest_file:
+                previous = json.load(manifest_file)['files']
+        except FileNotFoundError:
+            previous = {}
+
+        manifest = {'version': version, 'files': files, 'previous': previous}
+        descriptor, temporary = tempfile.mkstemp(dir=path)
+        with os.fdopen(descriptor, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temporary, os.path.join(path, MANIFEST))
+
+        # arquivos das versões anteriores à última
+        kept = set(files.values()) | set(previous.values())
+        for name in os.listdir(path):
+            if name != MANIFEST and name not in kept:
+                os.remove(os.path.join(path, name))
+        return version
+
+    @classmethod
+    def load(cls, path, tokenizer):
+        '''
+        Carrega o motor gravado em `path`, mapeando os vetores em memória.
+        Se os arquivos lidos forem removidos por gravações seguidas de
+        outro processo, o manifesto é lido novamente.
+
+        param path: <str>
+        param tokenizer: <function>
+        rtype: <NlpEngine>
+        '''
+        for attempt in range(LOAD_ATTEMPTS):
+            try:
+                return cls._load(path, tokenizer)
+            except FileNotFoundError:
+                if attempt == LOAD_ATTEMPTS - 1:
+                    raise
+
+    @classmethod
+    def _load(cls, path, tokenizer):
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            files = json.load(manifest_file)['files']
+
+        with open(os.path.join(path, files['corpus'])) as corpus_file:
+            corpus = json.load(corpus_file)
+
+        idf, data, indices, indptr = [
+            np.load(os.path.join(path, files[name]), mmap_mode='r')
+            for name in ARRAYS
+        ]
+        matrix = csr_matrix(
+            (data, indices, indptr),
+            shape=(len(indptr) - 1, len(idf)),
+            copy=False
+        )
+        return cls(
+            corpus['sentences'], corpus['vocabulary'], idf, matrix, tokenizer,
+            corpus['keys'], corpus['stale']
+        )
+
+    def vectorize(self, questions):
+        '''
+        Converte perguntas em vetores TF-IDF com o vocabulário aprendido.
+        Termos fora do vocabulário (incluindo as stop words) são ignorados.
+
+        param questions: <list>
+        rtype: <scipy.sparse.csr_matrix>
+        '''
+        rows, columns, values = [], [], []
+        for row, question in enumerate(questions):
+            counts = Counter(self.tokenizer(question.lower()))
+            for term, count in counts.items():
+                column = self.vocabulary.get(term)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+                    values.append(count * self.idf[column])
+
+        vectors = csr_matrix(
+            (values, (rows, columns)),
+            shape=(len(questions), len(self.vocabulary)),
+            dtype=np.float64
+        )
+        return normalize(vectors) if questions else vectors
+
+    def top_answers(self, questions, k):
+        '''
+        Retorna, para cada pergunta, as k sentenças mais semelhantes e as
+        suas pontuações, em ordem decrescente (empates pela ordem do
+        corpus). Todas as perguntas são vetorizadas e pontuadas em uma
+        única multiplicação de matrizes esparsas, e somente as sentenças
+        com pontuação positiva são consideradas, escolhidas por seleção
+        parcial (argpartition) em vez de ordenação completa.
+
+        param questions: <list>
+        param k: <int>
+        rtype: <list> de listas de tuplas (sentença, pontuação)
+        '''
+        if not questions:
+            return []
+
+        scores = (self.vectorize(questions) @ self.matrix.T).tocsr()
+        results = []
+        for row in range(len(questions)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            values = scores.data[start:end]
+            rows = scores.indices[start:end]
+
+            positive = values > 0
+            values, rows = values[positive], rows[positive]
+            if 0 < k < len(values):
+                kth = values[np.argpartition(-values, k - 1)[k - 1]]
+                selected = values >= kth
+                values, rows = values[selected], rows[selected]
+
+            order = np.lexsort((rows, -values))[:k]
+            results.append([
+                (self.sentences[rows[i]], float(values[i])) for i in order
+            ])
+        return results
+
+    def reply(self, question):
+        '''
+        Retorna a sentença do corpus mais semelhante à pergunta.
+
+        param question: <str>
+        rtype: <str>
+        '''
+        answers = self.top_answers([question], 1)[0]
+        if not answers:
+            return UNKNOWN_RESPONSE
+        return answers[0][0]
+
+    def answer(self, question):
+        '''
+        Responde a uma pergunta: despedidas, cumprimentos ou a sentença
+        mais semelhante do corpus.
+
+        param question: <str>
+        rtype: <str>
+        '''
+        if question == GOODBYE_INPUT:
+            return GOODBYE_RESPONSE
+
+        return greeting(question) or self.reply(question)
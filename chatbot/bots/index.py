@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+'''
+Localização e versão dos índices gravados do bot.
+
+Este módulo não depende do NLTK nem do numpy, então os web workers podem
+consultar a versão de um índice sem carregar os bots.
+'''
+import json
+import os
+import threading
+
+from django.conf import settings
+
+
+MANIFEST = 'manifest.json'
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def index_path(portal_id=None):
+    '''
+    Diretório do índice do corpus geral ou de um portal.
+    param portal_id: <int>
+    rtype: <str>
+    '''
+    name = 'corpus' if portal_id is None else 'portal-%s' % portal_id
+    return os.path.join(settings.CHATBOT_INDEX_PATH, name)
+
+
+def manifest_mtime(path):
+    '''
+    Data de alteração do manifesto do índice, ou None caso não exista.
+    param path: <str>
+    rtype: <int>
+    '''
+    try:
+        return os.stat(os.path.join(path, MANIFEST)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def index_version(portal_id=None):
+    '''
+    Versão do índice gravado, ou None caso ainda não exista.
+    param portal_id: <int>
+    rtype: <str>
+    '''
+    path = index_path(portal_id)
+    mtime = manifest_mtime(path)
+    if mtime is None:
+        return None
+
+    with _versions_lock:
+        cached = _versions.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            version = json.load(manifest_file)['version']
+    except FileNotFoundError:
+        return None
+    with _versions_lock:
+        _versions[path] = (mtime, version)
+    return version
@@ -1,14 +1,58 @@
 # -*- coding: utf-8 -*-
-import nltk
-import numpy as np
-import random
-import string
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+'''
+Bot de processamento de linguagem natural.
+
+O bot responde a partir do corpus geral (copus.txt) ou das publicações
+de um portal (ver chatbot.corpus), cada um com o seu índice.
+
+Nada é baixado ou calculado na importação deste módulo. Os índices são
+gerados pelo comando build_chatbot_index, que também baixa os dados do
+NLTK para CHATBOT_NLTK_DATA, e cada worker apenas mapeia os arquivos
+gravados em CHATBOT_INDEX_PATH. Caso um índice ainda não exista, ele é
+construído no primeiro uso. Os índices dos portais são mantidos pelo
+indexador em segundo plano (ver chatbot.indexer).
+'''
 import os
+import shutil
+import string
+import threading
+from functools import lru_cache
+
+import nltk
+from django.conf import settings
+
+from chatbot.bots.engine import NlpEngine
+from chatbot.bots.index import index_path, manifest_mtime
+from chatbot.corpus import document_key, document_texts, portal_documents
+from server.locks import FileLock
+
 
-# debug TODO remove this later
-print("*"*100,os.getcwd(),"*"*100,)
+# Corpus geral, usado quando a pergunta não é feita a um portal
+CORPUS_FILES = (
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'copus.txt'),
+)
+
+# Recursos do NLTK usados pelo tokenizer (punkt_tab nas versões recentes)
+NLTK_RESOURCES = ('punkt', 'punkt_tab', 'wordnet')
+
+nltk.data.path.insert(0, settings.CHATBOT_NLTK_DATA)
+
+# Quantidade de palavras distintas com o lema guardado em memória
+LEMMA_CACHE_SIZE = 100000
+
+lemmer = nltk.stem.WordNetLemmatizer()
+remove_punct_dict = str.maketrans('', '', string.punctuation)
+
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(token):
+    '''
+    Lema de uma palavra. O vocabulário se repete muito entre as sentenças,
+    então cada palavra é consultada no WordNet uma única vez.
+    param token: <str>
+    rtype: <str>
+    '''
+    return lemmer.lemmatize(token)
 
 def lem_tokens(tokens):
     '''
@@ -16,84 +60,157 @@ def lem_tokens(tokens):
     :param tokens: <str>
     rtype: <list>
     '''
-    return [lemmer.lemmatize(token) for token in tokens]
+    return [lemmatize(token) for token in tokens]
 
 def lem_normalize(text):
     '''
     Normaliza uma cadeia de caracteres.
+    Sem a pontuação o texto não tem fronteiras de sentença, então o
+    tokenizer de palavras é aplicado direto, sem passar pelo punkt.
     param text: <str>
     rtype: <list>
     '''
-    return lem_tokens(nltk.word_tokenize(text.lower().translate(remove_punct_dict)))
+    return lem_tokens(nltk.word_tokenize(
+        text.lower().translate(remove_punct_dict), preserve_line=True
+    ))
 
-def greeting(sentence):
+def download_nltk_data():
+    '''
+    Baixa os dados do NLTK para o diretório local CHATBOT_NLTK_DATA.
     '''
-    Retorna um cumprimento aleatório.
+    for resource in NLTK_RESOURCES:
+        nltk.download(resource, download_dir=settings.CHATBOT_NLTK_DATA)
 
-    param sentence: <str>
-    rtype: <str>
+def split_sentences(text):
     '''
+    Quebra um texto em sentenças minúsculas.
+    param text: <str>
+    rtype: <list>
+    '''
+    return nltk.sent_tokenize(text.lower()) if text else []
 
-    GREETINGS_INPUTS = (
-        "hello", "hi", "grettings", "sup", "what's up", "hey",
-    )
-    GREETINGS_RESPONSES =[
-        "hi", "hey", "*nods*", "hi there","hello", "i'm so glad"
-    ]
+def read_corpus():
+    '''
+    Lê as sentenças dos arquivos do corpus geral.
+    rtype: <list>
+    '''
+    raw = ''
+    for path in CORPUS_FILES:
+        with open(path, 'r', errors='ignore') as f:
+            raw += f.read()
 
-    for word in sentence.split():
-        if word.lower() in GREETINGS_INPUTS:
-            return random.choice(GREETINGS_RESPONSES)
+    return split_sentences(raw)
 
-def response(user_input):
+def document_sentences(instance):
     '''
-    Retorna uma resposta com base no conteúdo aprendido pelo bot.
-    param user_input: <str>
-    rtype: <str>
+    Sentenças de uma publicação do corpus de um portal.
+    param instance: <Article>, <News> ou <Answer>
+    rtype: <list>
     '''
-    bot_response = ''
-    sent_tokens.append(user_input)
+    return [
+        sentence
+        for text in document_texts(instance)
+        for sentence in split_sentences(text)
+    ]
 
-    # TODO melhorar o nome destas variáveis
+def build_engine(portal_id=None, workers=1):
+    '''
+    Aprende o vocabulário e a matriz TF-IDF do corpus geral ou das
+    publicações de um portal.
+    param portal_id: <int>
+    param workers: <int> processos usados para tokenizar o corpus
+    rtype: <NlpEngine>
+    '''
+    if portal_id is None:
+        return NlpEngine.fit(read_corpus(), lem_normalize, workers=workers)
 
-    # Converte uma coleção de textos brutos para uma matriz de atributos TF-IDF.
-    tf_id_matrix = TfidfVectorizer(tokenizer=lem_normalize, stop_words='english')
+    sentences, keys = [], []
+    for document in portal_documents(portal_id):
+        document_sents = document_sentences(document)
+        sentences.extend(document_sents)
+        keys.extend([document_key(document)] * len(document_sents))
+    return NlpEngine.fit(sentences, lem_normalize, keys, workers)
 
-    # Aprende o vocabulário
-    learned_set = tf_id_matrix.fit_transform(sent_tokens)
 
-    # computa a semelhança do cosseno
-    values_array = cosine_similarity(learned_set[-1], learned_set)
+##########################################################################
+# Motor do processo
+##########################################################################
+_engines = {}
+_engines_lock = threading.Lock()
 
-    idx = values_array.argsort()[0][-2]
-    flat = values_array.flatten()
-    flat.sort()
-    threshold = flat[-2]
 
-    if(threshold == 0):
-        bot_response += "I can't undesteand you"
-    else:
-        bot_response += sent_tokens[idx]
+def index_lock(portal_id=None):
+    '''
+    Trava entre processos para alterações no índice.
+    param portal_id: <int>
+    rtype: <server.locks.FileLock>
+    '''
+    return FileLock(index_path(portal_id))
+
+
+def load_engine(portal_id=None):
+    '''
+    Carrega o motor gravado, ou None caso o índice ainda não exista.
+    param portal_id: <int>
+    rtype: <NlpEngine>
+    '''
+    path = index_path(portal_id)
+    if manifest_mtime(path) is None:
+        return None
+    return NlpEngine.load(path, lem_normalize)
 
-    return bot_response
 
-# Não sei se é uma boa idéia deixar esses downloads aqui :thinking:
-nltk.download('punkt')
-nltk.download('wordnet')
+def save_engine(engine, portal_id=None):
+    '''
+    Grava o motor onde os workers o encontrarão.
+    Deve ser chamada com a trava do índice (index_lock) adquirida.
+    param engine: <NlpEngine>
+    param portal_id: <int>
+    rtype: <str> versão gravada
+    '''
+    return engine.save(index_path(portal_id))
 
-# TODO import this variable from a config file
-files_to_read = ('server/chatbot/bots/copus.txt',)
 
-# TODO Fazer com que esse bot leia de um diretorio de arquivos,
-# ou uma lista de arquivos carregada por uma função, ou ainda
-# ler diretamente do banco de dados
-raw = ''
-for path in files_to_read:
-    with open(path, 'r', errors='ignore') as f:
-        raw += f.read().lower()
+def get_engine(portal_id=None):
+    '''
+    Retorna o motor do processo para o corpus geral ou para um portal,
+    recarregando-o caso o índice gravado em disco tenha sido alterado.
+    Um índice ausente é construído somente sob a sua trava (index_lock),
+    sem impedir as respostas dos demais portais.
+    rtype: <NlpEngine>
+    '''
+    path = index_path(portal_id)
+    mtime = manifest_mtime(path)
+    with _engines_lock:
+        cached = _engines.get(path)
+        if cached and mtime is not None and cached[1] == mtime:
+            return cached[0]
+
+    if mtime is None:
+        with index_lock(portal_id):
+            if manifest_mtime(path) is None:
+                save_engine(build_engine(portal_id), portal_id)
+        mtime = manifest_mtime(path)
+
+    engine = NlpEngine.load(path, lem_normalize)
+    with _engines_lock:
+        _engines[path] = (engine, mtime)
+    return engine
+
+
+def drop_engine(portal_id):
+    '''
+    Remove o índice de um portal.
+    param portal_id: <int>
+    '''
+    with index_lock(portal_id):
+        shutil.rmtree(index_path(portal_id), ignore_errors=True)
 
-sent_tokens = nltk.sent_tokenize(raw)
-word_tokens = nltk.word_tokenize(raw)
 
-lemmer = nltk.stem.WordNetLemmatizer()
-remove_punct_dict = dict((ord(punct), None) for punct in string.punctuation)
\ No newline at end of file
+def response(user_input):
+    '''
+    Retorna uma resposta com base no conteúdo aprendido pelo bot.
+    param user_input: <str>
+    rtype: <str>
+    '''
+    return get_engine().reply(user_input)
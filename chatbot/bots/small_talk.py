@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+'''
+Despedidas e cumprimentos, respondidos sem consultar o índice.
+
+Este módulo não depende do NLTK nem do numpy (ver chatbot.bots.index).
+'''
+import random
+
+
+GOODBYE_INPUT = 'Bye'
+GOODBYE_RESPONSE = 'BYE...TAKE CARE......'
+
+GREETINGS_INPUTS = (
+    "hello", "hi", "grettings", "sup", "what's up", "hey",
+)
+GREETINGS_RESPONSES = (
+    "hi", "hey", "*nods*", "hi there", "hello", "i'm so glad"
+)
+
+
+def greeting(sentence):
+    '''
+    Retorna um cumprimento aleatório caso a sentença seja um cumprimento.
+
+    param sentence: <str>
+    rtype: <str> ou None
+    '''
+    for word in sentence.split():
+        if word.lower() in GREETINGS_INPUTS:
+            return random.choice(GREETINGS_RESPONSES)
@@ -0,0 +1,117 @@
+'''
+Cache de respostas do chatbot.
+
+As perguntas são identificadas por uma normalização simples (minúsculas,
+sem pontuação e com os espaços colapsados), então variações como
+"Who is Cid?" e "who is  cid" são a mesma entrada. A normalização não usa
+o NLTK, que só é carregado pelos processos que respondem às perguntas.
+Cada resposta guarda a versão do índice que a produziu e deixa de valer
+quando o índice muda, além de expirar após o TTL.
+'''
+import re
+import string
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+remove_punct_dict = str.maketrans('', '', string.punctuation)
+SPACES_RE = re.compile(r'\s+')
+
+
+def question_key(question):
+    '''
+    Forma normalizada de uma pergunta, usada como chave no cache.
+
+    param question: <str>
+    rtype: <str>
+    '''
+    text = question.lower().translate(remove_punct_dict)
+    return SPACES_RE.sub(' ', text).strip()
+
+
+class AnswerCache:
+    '''
+    Cache LRU com expiração, seguro para uso por várias threads.
+
+    param max_size: <int> quantidade máxima de respostas
+    param ttl: <float> segundos de validade de uma resposta
+    '''
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        '''
+        Retorna a resposta guardada para a chave, ou None caso não exista,
+        tenha expirado ou seja de outra versão do índice.
+
+        param key: <tuple>
+        param version: <str> versão atual do índice
+        rtype: <str>
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_version, expires_at, answer = entry
+            if entry_version != version or expires_at <= time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return answer
+
+    def set(self, key, version, answer):
+        '''
+        Guarda a resposta, descartando a menos usada se o cache estiver
+        cheio.
+
+        param key: <tuple>
+        param version: <str>
+        param answer: <str>
+        '''
+        with self.lock:
+            self.entries[key] = (version, time.monotonic() + self.ttl, answer)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        '''
+        rtype: <dict> acertos, faltas e tamanho atual
+        '''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+            }
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    '''
+    Retorna o cache de respostas do processo, configurado pelas settings
+    CHATBOT_CACHE_SIZE e CHATBOT_CACHE_TTL.
+
+    rtype: <AnswerCache>
+    '''
+    with _cache_lock:
+        if 'cache' not in _cache:
+            _cache['cache'] = AnswerCache(
+                settings.CHATBOT_CACHE_SIZE, settings.CHATBOT_CACHE_TTL
+            )
+        return _cache['cache']
@@ -0,0 +1,107 @@
+'''
+Corpus do chatbot formado pelas publicações de cada portal: Artigos,
+Notícias e Respostas aceitas (com mais votos a favor do que contra).
+
+Cada publicação é um documento identificado por uma chave
+("<modelo>:<id>"), e cada sentença do índice guarda o documento de onde
+veio, permitindo substituir as sentenças de um documento alterado sem
+reconstruir o índice.
+'''
+from django.db.models import F
+
+from civil_cultural.models import Answer, Article, News, Topic
+
+
+CORPUS_MODELS = {
+    'article': Article,
+    'news': News,
+    'answer': Answer,
+}
+
+
+def document_key(instance):
+    '''
+    Chave de uma publicação no corpus.
+
+    param instance: <Article>, <News> ou <Answer>
+    rtype: <str>
+    '''
+    return '%s:%s' % (instance._meta.model_name, instance.pk)
+
+
+def document_reference(instance):
+    '''
+    Referência ao objeto de onde vem o portal de uma publicação, lida da
+    própria publicação, sem consultas ao banco.
+
+    param instance: <Article>, <News> ou <Answer>
+    rtype: <tuple> (nome do model, id)
+    '''
+    if isinstance(instance, News):
+        return ('portal', instance.portal_reference_id)
+    if isinstance(instance, Article):
+        return ('topic', instance.published_topic_id)
+    return ('question', instance.question_id)
+
+
+def document_portal(reference):
+    '''
+    Retorna o id do portal de uma publicação, ou None caso a publicação
+    não esteja mais ligada a um portal. Pode consultar o banco, por isso é
+    chamada pelo indexador, fora do ciclo da requisição.
+
+    param reference: <tuple> retorno de document_reference
+    rtype: <int>
+    '''
+    model_name, pk = reference
+    if model_name == 'portal':
+        return pk
+
+    if model_name == 'topic':
+        topics = Topic.objects.filter(pk=pk)
+    else:
+        topics = Topic.objects.filter(article__question__pk=pk)
+    return topics.values_list('topic_portal_id', flat=True).first()
+
+
+def document_texts(instance):
+    '''
+    Textos de uma publicação usados pelo chatbot. Respostas que não foram
+    aceitas não fazem parte do corpus.
+
+    param instance: <Article>, <News> ou <Answer>
+    rtype: <list>
+    '''
+    if isinstance(instance, Article):
+        return [instance.title, instance.abstract, instance.body]
+    if isinstance(instance, News):
+        return [instance.title, instance.body]
+    if instance.pro_votes > instance.cons_votes:
+        return [instance.text]
+    return []
+
+
+def get_document(key):
+    '''
+    Busca no banco a publicação correspondente à chave.
+
+    param key: <str>
+    rtype: <Article>, <News>, <Answer> ou None caso tenha sido removida
+    '''
+    model_name, pk = key.split(':')
+    return CORPUS_MODELS[model_name].objects.filter(pk=pk).first()
+
+
+def portal_documents(portal_id):
+    '''
+    Todas as publicações de um portal que fazem parte do corpus.
+
+    param portal_id: <int>
+    rtype: <generator>
+    '''
+    yield from Article.objects.filter(published_topic__topic_portal=portal_id)
+    yield from News.objects.filter(portal_reference=portal_id)
+    yield from Answer.objects.filter(
+        question__published_article__published_topic__topic_portal=portal_id,
+        pro_votes__gt=F('cons_votes')
+    )
@@ -0,0 +1,138 @@
+'''
+Manutenção dos índices do chatbot em segundo plano.
+
+Os signals apenas enfileiram as publicações alteradas; uma thread do
+próprio worker consome a fila, busca o portal de cada publicação, agrupa
+as alterações por portal e aplica
+todas de uma vez no índice do portal (ver NlpEngine.update), fora do
+ciclo da requisição. Somente as publicações alteradas são reprocessadas;
+o vocabulário é ajustado novamente a todo o corpus quando a quantidade de
+sentenças vetorizadas desde o último ajuste passa de REFIT_RATIO.
+'''
+import logging
+import queue
+import threading
+
+from django.db import connection
+
+from chatbot.corpus import document_portal, get_document
+
+
+logger = logging.getLogger(__name__)
+
+# fração do corpus vetorizada com um vocabulário antigo que dispara o ajuste
+REFIT_RATIO = 0.25
+
+
+class ChatbotIndexer:
+    '''
+    Fila de alterações e a thread que as aplica nos índices.
+    Um item da fila é (referência ao portal, chave da publicação), com a
+    referência de corpus.document_reference; a chave None indica que o
+    portal foi removido.
+    '''
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def enqueue(self, reference, key):
+        '''
+        Agenda a atualização de uma publicação no índice do portal.
+
+        param reference: <tuple> referência ao portal da publicação
+        param key: <str> chave da publicação ou None para remover o portal
+        '''
+        self.queue.put((reference, key))
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='chatbot-indexer', daemon=True
+                )
+                self.thread.start()
+
+    def join(self):
+        '''
+        Aguarda até que todas as alterações enfileiradas sejam aplicadas.
+        '''
+        self.queue.join()
+
+    def run(self):
+        while True:
+            changes = [self.queue.get()]
+            while True:
+                try:
+                    changes.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for portal_id, keys in self.group(changes).items():
+                    try:
+                        self.apply(portal_id, keys)
+                    except Exception:
+                        logger.exception(
+                            'Failed to update chatbot index of portal %s', portal_id
+                        )
+            finally:
+                connection.close()
+                for _ in changes:
+                    self.queue.task_done()
+
+    def group(self, changes):
+        '''
+        Agrupa as alterações pelo portal das publicações. Publicações que
+        não estão mais ligadas a um portal são ignoradas.
+
+        param changes: <list> itens da fila
+        rtype: <dict> id do portal -> chaves das publicações alteradas
+        '''
+        portals, resolved = {}, {}
+        for reference, key in changes:
+            if reference not in resolved:
+                try:
+                    resolved[reference] = document_portal(reference)
+                except Exception:
+                    logger.exception('Failed to find the portal of %s', key)
+                    resolved[reference] = None
+            if resolved[reference] is not None:
+                portals.setdefault(resolved[reference], set()).add(key)
+        return portals
+
+    def apply(self, portal_id, keys):
+        '''
+        Aplica as alterações das publicações no índice de um portal.
+
+        param portal_id: <int>
+        param keys: <set> chaves das publicações alteradas
+        '''
+        from chatbot.bots import nlp_bot
+
+        if None in keys:
+            nlp_bot.drop_engine(portal_id)
+            return
+
+        # sob a trava de get_engine: uma construção em andamento termina
+        # antes, e as alterações são aplicadas sobre o índice construído
+        with nlp_bot.index_lock(portal_id):
+            engine = nlp_bot.load_engine(portal_id)
+            # índice ainda não usado: será construído no primeiro uso
+            if engine is None:
+                return
+
+            sentences, sentence_keys = [], []
+            for key in keys:
+                document = get_document(key)
+                if document is None:
+                    continue
+                document_sentences = nlp_bot.document_sentences(document)
+                sentences.extend(document_sentences)
+                sentence_keys.extend([key] * len(document_sentences))
+
+            engine = engine.update(keys, sentences, sentence_keys)
+            if engine.stale > REFIT_RATIO * len(engine.sentences):
+                engine = engine.refit()
+            nlp_bot.save_engine(engine, portal_id)
+
+
+indexer = ChatbotIndexer()
@@ -0,0 +1,438 @@
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from chatbot.bots import nlp_bot
+from chatbot.bots.engine import NlpEngine, UNKNOWN_RESPONSE, tokenize_all
+from chatbot.pool import InferencePool, percentile
+from civil_cultural.models import News, Portal
+from server.views import CivilGraphQLView
+
+
+WORDS = (
+    'portal', 'mage', 'dragon', 'council', 'election', 'river', 'festival',
+    'library', 'museum', 'theatre', 'music', 'science', 'history', 'school',
+    'market', 'harvest', 'bridge', 'tower', 'garden', 'citizen', 'law',
+    'storm', 'forest', 'castle', 'merchant', 'guild', 'scroll', 'potion',
+)
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text)
+
+
+LEGACY_PUNCTUATION = dict((ord(punct), None) for punct in string.punctuation)
+
+
+def legacy_normalize(text):
+    '''
+    lem_normalize anterior ao cache de lemas: passa pelo punkt e consulta
+    o WordNet a cada palavra.
+    '''
+    return [
+        nlp_bot.lemmer.lemmatize(token)
+        for token in nlp_bot.nltk.word_tokenize(
+            text.lower().translate(LEGACY_PUNCTUATION)
+        )
+    ]
+
+
+def legacy_response(sentences, question, tokenizer):
+    '''
+    response() anterior ao índice persistido: ajusta o TF-IDF ao corpus
+    mais a pergunta a cada chamada e compara a pergunta com todas as
+    sentenças. A original também deixava a pergunta no corpus depois de
+    responder; aqui o corpus não é alterado, para que as perguntas sejam
+    independentes.
+
+    param sentences: <list>
+    param question: <str>
+    param tokenizer: <function>
+    rtype: <str>
+    '''
+    tokens = sentences + [question]
+    matrix = TfidfVectorizer(
+        tokenizer=tokenizer, stop_words='english', token_pattern=None
+    ).fit_transform(tokens)
+    values = cosine_similarity(matrix[-1], matrix)
+
+    idx = values.argsort()[0][-2]
+    flat = values.flatten()
+    flat.sort()
+    if flat[-2] == 0:
+        return UNKNOWN_RESPONSE
+    return tokens[idx]
+
+
+STARTUP_SCRIPT = '''
+import sys
+import django
+django.setup()
+%s
+print(' '.join(
+    name for name in ('nltk', 'numpy', 'scipy', 'sklearn', 'chatterbot')
+    if name in sys.modules
+))
+'''
+
+
+def synthetic_sentences(amount, words=12):
+    return [
+        ' '.join(random.choices(WORDS, k=words)) + '.' for _ in range(amount)
+    ]
+
+
+SYLLABLES = (
+    'ka', 'lo', 'mi', 'ra', 'te', 'su', 'no', 'vi', 'da', 'pe', 'zu', 'ho',
+    'ri', 'ba', 'le', 'go', 'an', 'or', 'is', 'el',
+)
+
+
+def synthetic_corpus(amount, vocabulary=5000, words=12):
+    '''
+    Sentenças com palavras de um vocabulário inventado, sorteadas pela lei
+    de Zipf como em um texto real: poucas palavras muito frequentes e
+    muitas raras.
+
+    param amount: <int> quantidade de sentenças
+    param vocabulary: <int> quantidade de palavras distintas
+    param words: <int> palavras por sentença
+    rtype: <list>
+    '''
+    terms = set()
+    while len(terms) < vocabulary:
+        terms.add(''.join(random.choices(SYLLABLES, k=random.randint(2, 4))))
+    terms = sorted(terms)
+    random.shuffle(terms)
+    weights = [1 / rank for rank in range(1, vocabulary + 1)]
+
+    return [
+        ' '.join(random.choices(terms, weights, k=words)) + '.'
+        for _ in range(amount)
+    ]
+
+
+def synthetic_questions(sentences, amount):
+    '''
+    Perguntas formadas por parte das palavras de sentenças do corpus.
+    '''
+    questions = []
+    for sentence in random.sample(sentences, min(amount, len(sentences))):
+        words = sentence.rstrip('.').split()
+        questions.append(
+            ' '.join(random.sample(words, random.randint(3, 6))) + '?'
+        )
+    return questions
+
+
+_engines = {}
+
+
+def synthetic_answer(path, question):
+    '''
+    Responde com o motor sintético gravado em `path`, carregado uma vez
+    por processo. Usa um tokenizer simples no lugar do lem_normalize, que
+    depende dos dados do NLTK; o cálculo da similaridade é o mesmo.
+    '''
+    if path not in _engines:
+        _engines[path] = NlpEngine.load(path, tokenize)
+    return _engines[path].answer(question)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks do chatbot. Suítes:\n'
+        '  load: latência das consultas CRUD em /graphql/ enquanto o chatbot '
+        'responde perguntas na thread da requisição ou no pool de processos.\n'
+        '  preprocess: sentenças por segundo do lem_normalize original, da '
+        'versão com lemas em cache e da tokenização em vários processos. '
+        'Requer os dados do NLTK (ver build_chatbot_index).\n'
+        '  corpus: para corpus sintéticos de tamanhos crescentes, tempo de '
+        'construção e de carga do índice, memória, percentis de latência por '
+        'pergunta e concordância da melhor resposta com o response() original.\n'
+        '  startup: tempo de um novo processo para configurar o Django e '
+        'importar os schemas sem o chatbot, com o chatbot carregado sob '
+        'demanda e com os bots importados junto.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=['load', 'preprocess', 'corpus', 'startup'])
+        parser.add_argument('--sentences', type=int, default=20000)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--crud-threads', type=int, default=4)
+        parser.add_argument('--chatbot-threads', type=int, default=4)
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument(
+            '--sizes', type=int, nargs='+',
+            default=[1000, 10000, 100000, 1000000]
+        )
+        parser.add_argument('--questions', type=int, default=200)
+        parser.add_argument('--legacy-questions', type=int, default=20)
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument(
+            '--legacy-max', type=int, default=100000,
+            help='Maior corpus comparado com o response() original, que '
+                 'ajusta o TF-IDF a todo o corpus em cada pergunta.'
+        )
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        getattr(self, 'run_%s' % options['suite'])(options)
+
+    ######################################################################
+    # load
+    ######################################################################
+    def run_load(self, options):
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, 'engine')
+        NlpEngine.fit(synthetic_sentences(options['sentences']), tokenize).save(path)
+
+        # as threads usam conexões próprias, então os dados precisam estar
+        # gravados; são removidos ao final
+        user = get_user_model().objects.create(username='benchmark-chatbot')
+        portal = Portal.objects.create(name='benchmark-chatbot', owner=user)
+        News.objects.bulk_create(
+            News(
+                title=' '.join(random.choices(WORDS, k=5)),
+                body=' '.join(random.choices(WORDS, k=50)),
+                author=user,
+                portal_reference=portal,
+            )
+            for _ in range(50)
+        )
+
+        try:
+            with override_settings(TOKEN_BLACKLIST_FILTER_PATH=None):
+                self.stdout.write('sentences: %s' % options['sentences'])
+                self.report('crud only', self.mixed_load(options, user, path, None))
+
+                inline = InferencePool(0, options['chatbot_threads'], None)
+                self.report('chatbot inline', self.mixed_load(options, user, path, inline))
+
+                pool = InferencePool(
+                    options['workers'], options['chatbot_threads'], 30
+                )
+                pool.warm_up()
+                # carrega o motor sintético em todos os processos
+                warm = [
+                    threading.Thread(
+                        target=pool.run, args=(synthetic_answer, path, 'mage')
+                    )
+                    for _ in range(options['chatbot_threads'])
+                ]
+                for thread in warm:
+                    thread.start()
+                for thread in warm:
+                    thread.join()
+                try:
+                    self.report(
+                        'chatbot pool (%s processes)' % options['workers'],
+                        self.mixed_load(options, user, path, pool)
+                    )
+                finally:
+                    pool.shutdown()
+        finally:
+            portal.delete()
+            user.delete()
+            directory.cleanup()
+
+    def mixed_load(self, options, user, path, pool):
+        view = CivilGraphQLView.as_view()
+        factory = RequestFactory()
+        body = json.dumps({'query': '{ news(first: 10) { edges { node { title } } } }'})
+        deadline = time.perf_counter() + options['seconds']
+        crud_latencies = []
+        answered = []
+
+        def crud():
+            while time.perf_counter() < deadline:
+                request = factory.post(
+                    '/graphql/', body,
+                    content_type='application/json',
+                    HTTP_AUTHORIZATION='JWT token'
+                )
+                request.user = user
+                start = time.perf_counter()
+                view(request)
+                crud_latencies.append(time.perf_counter() - start)
+            connection.close()
+
+        def chatbot():
+            while time.perf_counter() < deadline:
+                question = ' '.join(random.choices(WORDS, k=6))
+                pool.run(synthetic_answer, path, question)
+                answered.append(question)
+
+        threads = [
+            threading.Thread(target=crud) for _ in range(options['crud_threads'])
+        ]
+        if pool is not None:
+            threads += [
+                threading.Thread(target=chatbot)
+                for _ in range(options['chatbot_threads'])
+            ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return {
+            'crud requests': len(crud_latencies),
+            'crud p50': percentile(crud_latencies, 0.50),
+            'crud p99': percentile(crud_latencies, 0.99),
+            'chatbot answers': len(answered),
+        }
+
+    def report(self, name, results):
+        self.stdout.write(
+            '%-28s crud %5s req  p50 %6.1fms  p99 %6.1fms  chatbot %5s answers' % (
+                name, results['crud requests'], results['crud p50'] * 1000,
+                results['crud p99'] * 1000, results['chatbot answers']
+            )
+        )
+
+    ######################################################################
+    # preprocess
+    ######################################################################
+    def run_preprocess(self, options):
+        try:
+            corpus = nlp_bot.read_corpus()
+            nlp_bot.lem_normalize('warming up wordnet')
+        except LookupError:
+            raise CommandError(
+                'NLTK data not found in CHATBOT_NLTK_DATA, '
+                'run build_chatbot_index first.'
+            )
+
+        # o corpus geral repetido até a quantidade pedida, mantendo a
+        # distribuição real das palavras
+        sentences = [
+            corpus[index % len(corpus)] for index in range(options['sentences'])
+        ]
+        self.stdout.write('sentences: %s' % len(sentences))
+
+        self.measure('legacy', lambda: [legacy_normalize(s) for s in sentences])
+
+        nlp_bot.lemmatize.cache_clear()
+        self.measure('cached (cold)', lambda: [nlp_bot.lem_normalize(s) for s in sentences])
+        info = nlp_bot.lemmatize.cache_info()
+        self.stdout.write('  lemma cache: %s hits, %s misses, %s words' % (
+            info.hits, info.misses, info.currsize
+        ))
+        self.measure('cached (warm)', lambda: [nlp_bot.lem_normalize(s) for s in sentences])
+
+        nlp_bot.lemmatize.cache_clear()
+        self.measure(
+            'cached, %s processes' % options['workers'],
+            lambda: tokenize_all(sentences, nlp_bot.lem_normalize, options['workers'])
+        )
+
+    def measure(self, name, function):
+        start = time.perf_counter()
+        amount = len(function())
+        elapsed = time.perf_counter() - start
+        self.stdout.write('%-28s %8.2fs  %10.0f sentences/s' % (
+            name, elapsed, amount / elapsed
+        ))
+
+    ######################################################################
+    # corpus
+    ######################################################################
+    def run_corpus(self, options):
+        self.stdout.write(
+            '%9s %8s %8s %8s %8s %8s %8s %8s %8s %9s %8s' % (
+                'sentences', 'terms', 'build', 'load', 'index', 'maxrss',
+                'p50', 'p95', 'p99', 'agreement', 'legacy'
+            )
+        )
+        for size in options['sizes']:
+            with tempfile.TemporaryDirectory() as directory:
+                self.stdout.write(self.measure_corpus(
+                    options, size, os.path.join(directory, 'engine')
+                ))
+
+    def measure_corpus(self, options, size, path):
+        sentences = synthetic_corpus(size)
+        questions = synthetic_questions(sentences, options['questions'])
+
+        start = time.perf_counter()
+        engine = NlpEngine.fit(sentences, tokenize, workers=options['workers'])
+        build = time.perf_counter() - start
+        engine.save(path)
+        del engine
+
+        start = time.perf_counter()
+        engine = NlpEngine.load(path, tokenize)
+        load = time.perf_counter() - start
+        index = sum(
+            os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+        )
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        latencies = []
+        for question in questions:
+            start = time.perf_counter()
+            engine.reply(question)
+            latencies.append(time.perf_counter() - start)
+
+        agreement = legacy = '-'
+        if size <= options['legacy_max']:
+            agreed, legacy_latencies = 0, []
+            for question in questions[:options['legacy_questions']]:
+                start = time.perf_counter()
+                expected = legacy_response(sentences, question, tokenize)
+                legacy_latencies.append(time.perf_counter() - start)
+                agreed += engine.reply(question) == expected
+            agreement = '%.0f%%' % (100 * agreed / len(legacy_latencies))
+            legacy = '%.0fms' % (percentile(legacy_latencies, 0.50) * 1000)
+
+        return '%9s %8s %7.2fs %7.3fs %7.0fM %7.0fM %6.2fms %6.2fms %6.2fms %9s %8s' % (
+            size, len(engine.vocabulary), build, load, index / 2 ** 20,
+            maxrss / 2 ** 10, percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.95) * 1000,
+            percentile(latencies, 0.99) * 1000, agreement, legacy
+        )
+
+    ######################################################################
+    # startup
+    ######################################################################
+    def run_startup(self, options):
+        environment = dict(
+            os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE
+        )
+        for name, imports in (
+                ('without chatbot', 'import users.schema, civil_cultural.schema'),
+                ('lazy chatbot', 'import server.schema'),
+                ('eager chatbot', 'import server.schema, chatbot.bots.nlp_bot')):
+            durations = []
+            for _ in range(options['runs']):
+                start = time.perf_counter()
+                modules = subprocess.run(
+                    [sys.executable, '-c', STARTUP_SCRIPT % imports],
+                    env=environment, check=True, stdout=subprocess.PIPE,
+                    universal_newlines=True
+                ).stdout.split('\n')[-2]
+                durations.append(time.perf_counter() - start)
+
+            self.stdout.write('%-16s median %6.0fms  min %6.0fms  modules: %s' % (
+                name, statistics.median(durations) * 1000,
+                min(durations) * 1000, modules or '-'
+            ))
@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from civil_cultural.models import Portal
+from chatbot.bots.nlp_bot import (
+    build_engine, download_nltk_data, index_lock, index_path, save_engine
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Baixa os dados do NLTK para CHATBOT_NLTK_DATA e grava os índices do '
+        'chatbot (vocabulário, pesos IDF e matriz TF-IDF) do corpus geral e '
+        'de cada portal em CHATBOT_INDEX_PATH. Deve ser executado no deploy, '
+        'antes de iniciar os workers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-download',
+            action='store_true',
+            help='Usa os dados do NLTK já presentes em CHATBOT_NLTK_DATA.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['skip_download']:
+            download_nltk_data()
+
+        self.build(None)
+        for portal_id in Portal.objects.values_list('id', flat=True):
+            self.build(portal_id)
+
+    def build(self, portal_id):
+        start = time.perf_counter()
+        with index_lock(portal_id):
+            engine = build_engine(
+                portal_id, settings.CHATBOT_PREPROCESS_WORKERS
+            )
+            version = save_engine(engine, portal_id)
+        self.stdout.write(
+            'Indexed %s sentences (%s terms) into %s, version %s, in %.2fs' % (
+                len(engine.sentences), len(engine.vocabulary),
+                index_path(portal_id), version, time.perf_counter() - start
+            )
+        )
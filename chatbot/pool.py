@@ -0,0 +1,307 @@
+'''
+Pool de processos para a inferência do chatbot.
+
+O cálculo das respostas é trabalho de CPU (numpy/scipy) e, executado na
+thread da requisição, disputa o processador e o GIL com as demais
+requisições do worker. Aqui as perguntas são enviadas a processos
+dedicados, que mapeiam os mesmos índices gravados em disco.
+
+A fila é limitada: com CHATBOT_POOL_MAX_PENDING perguntas pendentes as
+novas são recusadas imediatamente, e cada pergunta aguarda no máximo
+CHATBOT_TIMEOUT segundos. Com CHATBOT_POOL_WORKERS = 0 (padrão) as
+perguntas são respondidas na própria thread da requisição.
+
+Nada disso é iniciado na importação: o pool é criado na primeira pergunta
+ou por start_warm_up, chamada na inicialização do servidor (wsgi).
+'''
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# quantidade de latências recentes usadas nos percentis
+LATENCY_WINDOW = 1000
+
+# configurações repassadas aos processos, que podem ter sido alteradas
+# em tempo de execução (ex.: testes)
+FORWARDED_SETTINGS = ('CHATBOT_INDEX_PATH', 'CHATBOT_NLTK_DATA')
+
+
+def _initialize(overrides):
+    django.setup()
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+
+def load_engine(portal_id):
+    '''
+    Carrega o motor do corpus geral ou do portal no processo, sem
+    responder nenhuma pergunta.
+
+    param portal_id: <int>
+    '''
+    from chatbot.bots.nlp_bot import get_engine
+
+    get_engine(portal_id)
+
+
+def answer_question(portal_id, question):
+    '''
+    Responde a uma pergunta com o motor do corpus geral ou do portal.
+
+    param portal_id: <int>
+    param question: <str>
+    rtype: <str>
+    '''
+    from chatbot.bots.nlp_bot import get_engine
+
+    return get_engine(portal_id).answer(question)
+
+
+def answer_questions(portal_id, questions, k):
+    '''
+    Retorna as k sentenças mais semelhantes a cada pergunta.
+
+    param portal_id: <int>
+    param questions: <list>
+    param k: <int>
+    rtype: <list> de listas de tuplas (sentença, pontuação)
+    '''
+    from chatbot.bots.nlp_bot import get_engine
+
+    return get_engine(portal_id).top_answers(questions, k)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class InferencePool:
+    '''
+    Executa funções em processos separados com fila limitada, tempo
+    máximo de espera e métricas.
+
+    param workers: <int> quantidade de processos, 0 executa na thread atual
+    param max_pending: <int> perguntas pendentes (na fila ou em execução)
+    param timeout: <float> segundos de espera por uma resposta
+    '''
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = None
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {
+            'pending': 0,
+            'completed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'failures': 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                overrides = {
+                    name: getattr(settings, name) for name in FORWARDED_SETTINGS
+                }
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context('spawn'),
+                    initializer=_initialize,
+                    initargs=(overrides,)
+                )
+            return self.executor
+
+    def _release(self, *args):
+        self._count('pending', -1)
+        self.slots.release()
+
+    def _reset(self):
+        # um processo morreu: o pool é recriado na próxima pergunta
+        with self.lock:
+            self.executor = None
+        self._count('failures')
+        return Exception('Chatbot is unavailable, please try again later.')
+
+    def run(self, function, *args):
+        '''
+        Executa `function(*args)` no pool e retorna o resultado.
+
+        rtype: resultado da função
+        '''
+        if not self.slots.acquire(blocking=False):
+            self._count('rejected')
+            raise Exception('Chatbot is busy, please try again later.')
+        self._count('pending')
+
+        start = time.perf_counter()
+        try:
+            if self.workers:
+                result = self._submit(function, args)
+            else:
+                try:
+                    result = function(*args)
+                except Exception:
+                    self._count('failures')
+                    raise
+                finally:
+                    self._release()
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+        self._count('completed')
+        return result
+
+    def _submit(self, function, args):
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BrokenProcessPool:
+            self._release()
+            raise self._reset()
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            self._count('timeouts')
+            raise Exception('Chatbot took too long to answer.')
+        except BrokenProcessPool:
+            raise self._reset()
+        except Exception:
+            self._count('failures')
+            raise
+
+    def warm_up(self, function=int, *args):
+        '''
+        Inicia os processos do pool, que de outra forma só seriam criados
+        (e configurados) ao receber as primeiras perguntas, e executa
+        `function(*args)` uma vez para cada processo.
+        '''
+        if not self.workers:
+            function(*args)
+            return
+
+        executor = self._get_executor()
+        futures = [
+            executor.submit(function, *args) for _ in range(self.workers)
+        ]
+        for future in futures:
+            future.result()
+
+    def stats(self):
+        '''
+        Métricas do pool: contadores e percentis de latência (segundos).
+
+        rtype: <dict>
+        '''
+        with self.lock:
+            stats = dict(self.counters)
+        latencies = list(self.latencies)
+        stats.update(
+            workers=self.workers,
+            max_pending=self.max_pending,
+            p50=percentile(latencies, 0.50),
+            p95=percentile(latencies, 0.95),
+            p99=percentile(latencies, 0.99),
+        )
+        return stats
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    '''
+    Retorna o pool de inferência do processo, configurado pelas settings
+    CHATBOT_POOL_WORKERS, CHATBOT_POOL_MAX_PENDING e CHATBOT_TIMEOUT.
+
+    rtype: <InferencePool>
+    '''
+    with _pool_lock:
+        if 'pool' not in _pool:
+            _pool['pool'] = InferencePool(
+                settings.CHATBOT_POOL_WORKERS,
+                settings.CHATBOT_POOL_MAX_PENDING,
+                settings.CHATBOT_TIMEOUT
+            )
+        return _pool['pool']
+
+
+def ask(question, portal_id=None):
+    '''
+    Responde a uma pergunta através do pool de inferência.
+
+    param question: <str>
+    param portal_id: <int>
+    rtype: <str>
+    '''
+    return get_pool().run(answer_question, portal_id, question)
+
+
+def ask_batch(questions, k, portal_id=None):
+    '''
+    Busca as k melhores respostas de várias perguntas através do pool.
+
+    param questions: <list>
+    param k: <int>
+    param portal_id: <int>
+    rtype: <list> de listas de tuplas (sentença, pontuação)
+    '''
+    return get_pool().run(answer_questions, portal_id, questions, k)
+
+
+def start_warm_up():
+    '''
+    Inicia em segundo plano o pool de inferência e carrega o motor do
+    corpus geral nos seus processos, para que a primeira pergunta não
+    pague esse custo. Desativado com CHATBOT_WARM_UP = False.
+
+    rtype: <threading.Thread> ou None
+    '''
+    if not settings.CHATBOT_WARM_UP:
+        return None
+
+    def warm_up():
+        start = time.perf_counter()
+        try:
+            get_pool().warm_up(load_engine, None)
+        except Exception:
+            logger.exception('Failed to warm up the chatbot')
+            return
+        logger.info(
+            'Chatbot warmed up in %.2fs', time.perf_counter() - start
+        )
+
+    thread = threading.Thread(target=warm_up, name='chatbot-warm-up', daemon=True)
+    thread.start()
+    return thread
@@ -1,10 +1,65 @@
+'''
+Schema do chatbot.
+
+Este módulo é importado pelo server.schema e por isso não importa os
+bots (nltk, numpy, scikit-learn): eles são carregados no primeiro uso ou
+pelo aquecimento em segundo plano (ver chatbot.pool.start_warm_up).
+'''
 import graphene
-from chatbot.bots.bot import cid
-from chatbot.bots.nlp_bot import response, greeting, sent_tokens
+from graphql_relay import from_global_id
+from chatbot.bots.bot import get_list_bot
+from chatbot.bots.index import index_version
+from chatbot.bots.small_talk import GOODBYE_INPUT, GOODBYE_RESPONSE, greeting
+from chatbot.cache import get_answer_cache, question_key
+from chatbot.pool import ask, ask_batch, get_pool
 from users.utils import access_required
 
+
+# limites de uma requisição ao askNlpBotBatch
+MAX_BATCH_QUESTIONS = 50
+MAX_BATCH_ANSWERS = 20
+DEFAULT_BATCH_ANSWERS = 3
+
+
+def get_portal_id(portal):
+    '''
+    Converte o ID global de um portal no seu id, ou None.
+
+    param portal: <str>
+    rtype: <int>
+    '''
+    if not portal:
+        return None
+    _, portal_id = from_global_id(portal)
+    return int(portal_id)
+
+
+class ChatbotStatsType(graphene.ObjectType):
+    '''
+    Métricas do pool de inferência do chatbot deste worker.
+    '''
+    workers = graphene.Int(description='Inference processes.')
+    max_pending = graphene.Int(description='Pending questions accepted.')
+    pending = graphene.Int(description='Questions queued or running.')
+    completed = graphene.Int()
+    rejected = graphene.Int(description='Questions refused by a full queue.')
+    timeouts = graphene.Int()
+    failures = graphene.Int()
+    p50 = graphene.Float(description='Median latency in seconds.')
+    p95 = graphene.Float(description='95th percentile latency in seconds.')
+    p99 = graphene.Float(description='99th percentile latency in seconds.')
+    cache_hits = graphene.Int(description='Answers served by the cache.')
+    cache_misses = graphene.Int()
+    cache_size = graphene.Int(description='Answers currently cached.')
+
+
 class Query(object):
     
+    chatbot_stats = graphene.Field(
+        ChatbotStatsType,
+        description='Chatbot inference queue and latency metrics.'
+    )
+
     show_me_the_sight_beyond_sight = graphene.List(
         graphene.String,
         description='This is an easter egg.'
@@ -31,6 +86,61 @@ class Query(object):
     ]
         return the_eye_of_thundera
 
+    @access_required
+    def resolve_chatbot_stats(self, info, **kwargs):
+        cache_stats = get_answer_cache().stats()
+        return ChatbotStatsType(
+            cache_hits=cache_stats['hits'],
+            cache_misses=cache_stats['misses'],
+            cache_size=cache_stats['size'],
+            **get_pool().stats()
+        )
+
+
+def reply_to(question, portal_id=None):
+    '''
+    Responde a uma pergunta ao bot de processamento de linguagem natural.
+    Despedidas e cumprimentos são respondidos aqui mesmo; as demais
+    perguntas passam pelo cache de respostas antes de irem ao pool.
+
+    param question: <str>
+    param portal_id: <int>
+    rtype: <str>
+    '''
+    if question == GOODBYE_INPUT:
+        return GOODBYE_RESPONSE
+
+    bot_greeting = greeting(question)
+    if bot_greeting:
+        return bot_greeting
+
+    cache = get_answer_cache()
+    key = (portal_id, question_key(question))
+    # versão lida antes da resposta: se o índice mudar no meio tempo, a
+    # resposta é guardada como da versão antiga e descartada em seguida
+    version = index_version(portal_id)
+    answer = cache.get(key, version)
+    if answer is None:
+        answer = ask(question, portal_id)
+        cache.set(key, version, answer)
+    return answer
+
+
+class ScoredAnswerType(graphene.ObjectType):
+    '''
+    Sentença do corpus e a sua semelhança com a pergunta.
+    '''
+    sentence = graphene.String()
+    score = graphene.Float(description='Cosine similarity.')
+
+
+class QuestionAnswersType(graphene.ObjectType):
+    '''
+    Melhores respostas de uma pergunta.
+    '''
+    question = graphene.String()
+    answers = graphene.List(ScoredAnswerType)
+
 
 class AskListBot(graphene.relay.ClientIDMutation):
     '''
@@ -51,7 +161,7 @@ class AskListBot(graphene.relay.ClientIDMutation):
 
         question = _input.get('question')
         if question:
-            return AskListBot(cid.get_response(question))
+            return AskListBot(get_list_bot().get_response(question))
 
         return AskListBot("Sorry, i don't understand your question")
 
@@ -65,6 +175,9 @@ class AskNlpBot(graphene.relay.ClientIDMutation):
 
     class Input:
         question = graphene.String(description='Input question')
+        portal = graphene.ID(
+            description='Answer from the publications of this portal.'
+        )
 
     @access_required
     def mutate_and_get_payload(self, info, **_input):
@@ -73,24 +186,69 @@ class AskNlpBot(graphene.relay.ClientIDMutation):
         de processamento de linguagem natural.
         '''
 
-        question = _input.get('question')
+        question = _input.get('question') or ''
+        portal_id = get_portal_id(_input.get('portal'))
 
-        # se o input for uma despedida
-        if(question == 'Bye'):
-            bot_response = 'BYE...TAKE CARE......'
+        bot_response = reply_to(question, portal_id)
 
-        else:
-            # se o input for um cumprimento
-            if(greeting(question)):
-                bot_response = greeting(question)
+        return AskNlpBot(bot_response)
 
-            else:
-                bot_response = response(question)
-                sent_tokens.remove(question)
 
-        return AskNlpBot(bot_response)
+class AskNlpBotBatch(graphene.relay.ClientIDMutation):
+    '''
+    Envia várias perguntas ao bot de processamento de linguagem natural
+    em uma única requisição, retornando as k sentenças mais semelhantes
+    a cada uma.
+    '''
+    results = graphene.List(
+        QuestionAnswersType,
+        description='Answers of each question, in the input order.'
+    )
+
+    class Input:
+        questions = graphene.List(
+            graphene.String,
+            required=True,
+            description='Input questions.'
+        )
+        k = graphene.Int(
+            default_value=DEFAULT_BATCH_ANSWERS,
+            description='Answers returned per question.'
+        )
+        portal = graphene.ID(
+            description='Answer from the publications of this portal.'
+        )
+
+    @access_required
+    def mutate_and_get_payload(self, info, **_input):
+        questions = [question or '' for question in _input.get('questions')]
+        k = _input.get('k')
+        if k is None:
+            # `k: null` explícito não recebe o valor padrão do GraphQL
+            k = DEFAULT_BATCH_ANSWERS
+        portal_id = get_portal_id(_input.get('portal'))
+
+        if len(questions) > MAX_BATCH_QUESTIONS:
+            raise Exception(
+                'At most %s questions are allowed per batch.' % MAX_BATCH_QUESTIONS
+            )
+        if not 1 <= k <= MAX_BATCH_ANSWERS:
+            raise Exception('k must be between 1 and %s.' % MAX_BATCH_ANSWERS)
+
+        results = [
+            QuestionAnswersType(
+                question=question,
+                answers=[
+                    ScoredAnswerType(sentence=sentence, score=score)
+                    for sentence, score in answers
+                ]
+            )
+            for question, answers in zip(questions, ask_batch(questions, k, portal_id))
+        ]
+        return AskNlpBotBatch(results=results)
 
 
 class Mutation(object):
     ask_list_bot = AskListBot.Field()
     ask_nlp_bot = AskNlpBot.Field()
+    ask_nlp_bot_batch = AskNlpBotBatch.Field()
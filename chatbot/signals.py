@@ -0,0 +1,34 @@
+'''
+Signals do chatbot.
+Enfileiram as publicações criadas, alteradas ou removidas para que o
+indexador atualize o corpus do portal em segundo plano. Os votos de uma
+Resposta também a alteram, pois decidem se ela faz parte do corpus.
+'''
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from civil_cultural.models import Answer, Article, News, Portal
+from chatbot.corpus import document_key, document_reference
+from chatbot.indexer import indexer
+from civil_cultural.votes import post_voted
+
+
+@receiver(post_voted, sender=Answer)
+@receiver(post_save, sender=Answer)
+@receiver(post_save, sender=News)
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Answer)
+@receiver(post_delete, sender=News)
+@receiver(post_delete, sender=Article)
+def update_chatbot_corpus(sender, instance, **kwargs):
+    # o portal da publicação é consultado pelo indexador, fora da requisição
+    reference = document_reference(instance)
+    key = document_key(instance)
+    transaction.on_commit(lambda: indexer.enqueue(reference, key))
+
+
+@receiver(post_delete, sender=Portal)
+def remove_chatbot_corpus(sender, instance, **kwargs):
+    reference = ('portal', instance.pk)
+    transaction.on_commit(lambda: indexer.enqueue(reference, None))
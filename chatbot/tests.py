@@ -1,3 +1,746 @@
-from django.test import TestCase
+import json
+import mmap
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock, skipIf
 
-# Create your tests here.
+import graphene
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from chatbot.cache import AnswerCache
+from civil_cultural.models import Answer, Article, News, Portal, Question, Topic, Vote
+from civil_cultural.votes import cast_vote
+
+try:
+    from chatbot.bots import nlp_bot
+    from chatbot.indexer import indexer
+    from chatbot.pool import InferencePool, start_warm_up
+    from chatbot import schema as chatbot_schema
+    from server.views import CivilGraphQLView
+    from chatbot.bots import engine as chatbot_engine
+    from chatbot.bots.engine import NlpEngine, UNKNOWN_RESPONSE, tokenize_all
+    from chatbot.management.commands.benchmark_chatbot import (
+        legacy_response, synthetic_corpus, synthetic_questions
+    )
+except ImportError:
+    # dependências do chatbot (nltk, numpy, scipy, scikit-learn) não instaladas
+    NlpEngine = UNKNOWN_RESPONSE = None
+
+
+CORPUS = [
+    'a dragon guards the northern tower.',
+    'mages study the weather to predict magic rain.',
+    'the council meets every full moon at the river bridge.',
+    'the harvest festival fills the market with music.',
+    'citizens vote for the portal owner every year.',
+    'the library keeps the history of every mage.',
+]
+
+QUESTIONS = {
+    'who guards the tower?': CORPUS[0],
+    'how do mages predict rain?': CORPUS[1],
+    'when does the council meet?': CORPUS[2],
+    'what happens at the harvest festival?': CORPUS[3],
+    'who chooses the portal owner?': CORPUS[4],
+    'where is the history kept?': CORPUS[5],
+    'xyzzy': UNKNOWN_RESPONSE,
+}
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text)
+
+
+def is_mapped(array):
+    while array is not None:
+        if isinstance(array, mmap.mmap):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+@skipIf(NlpEngine is None, 'chatbot dependencies are not installed')
+class NlpEngineTestCase(SimpleTestCase):
+    """
+    O motor responde sem alterar estado, inclusive em várias threads.
+    """
+    def setUp(self):
+        self.engine = NlpEngine.fit(CORPUS, tokenize)
+
+    def test_answers(self):
+        for question, expected in QUESTIONS.items():
+            self.assertEqual(self.engine.answer(question), expected)
+
+        self.assertEqual(self.engine.answer('Bye'), 'BYE...TAKE CARE......')
+        self.assertIn(self.engine.answer('hello there'), (
+            'hi', 'hey', '*nods*', 'hi there', 'hello', "i'm so glad"
+        ))
+
+    def test_answer_does_not_change_the_engine(self):
+        matrix = self.engine.matrix.copy()
+        for question in QUESTIONS:
+            self.engine.answer(question)
+            self.engine.answer(question)
+
+        self.assertEqual(self.engine.sentences, tuple(CORPUS))
+        self.assertEqual((self.engine.matrix != matrix).nnz, 0)
+        with self.assertRaises(ValueError):
+            self.engine.idf[0] = 0
+
+    def test_concurrent_answers(self):
+        questions = list(QUESTIONS.items()) * 50
+        barrier = threading.Barrier(16)
+        failures = []
+
+        def ask():
+            barrier.wait()
+            for question, expected in questions:
+                answer = self.engine.answer(question)
+                if answer != expected:
+                    failures.append((question, answer))
+
+        threads = [threading.Thread(target=ask) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(failures, [])
+        self.assertEqual(self.engine.sentences, tuple(CORPUS))
+
+    def test_agrees_with_legacy_response(self):
+        for question, expected in QUESTIONS.items():
+            self.assertEqual(legacy_response(CORPUS, question, tokenize), expected)
+
+        random.seed(0)
+        sentences = synthetic_corpus(300, vocabulary=200)
+        engine = NlpEngine.fit(sentences, tokenize)
+        for question in synthetic_questions(sentences, 20):
+            self.assertEqual(
+                engine.reply(question),
+                legacy_response(sentences, question, tokenize)
+            )
+
+
+@skipIf(NlpEngine is None, 'chatbot dependencies are not installed')
+class PersistedIndexTestCase(SimpleTestCase):
+    """
+    O índice gravado é carregado por mmap, sem treinar o modelo.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'chatbot_index')
+        index_settings = self.settings(CHATBOT_INDEX_PATH=self.path)
+        index_settings.enable()
+        self.addCleanup(index_settings.disable)
+
+    def test_save_and_load(self):
+        engine = NlpEngine.fit(CORPUS, tokenize)
+        engine.save(self.path)
+        loaded = NlpEngine.load(self.path, tokenize)
+
+        for array in (loaded.idf, loaded.matrix.data, loaded.matrix.indices):
+            self.assertTrue(is_mapped(array))
+        self.assertEqual(loaded.sentences, engine.sentences)
+        self.assertEqual(loaded.vocabulary, engine.vocabulary)
+        for question, expected in QUESTIONS.items():
+            self.assertEqual(loaded.answer(question), expected)
+
+    def test_workers_reload_new_versions(self):
+        path = nlp_bot.index_path()
+        NlpEngine.fit(CORPUS[:3], tokenize).save(path)
+        engine = nlp_bot.get_engine()
+        self.assertEqual(engine.sentences, tuple(CORPUS[:3]))
+        self.assertIs(nlp_bot.get_engine(), engine)
+
+        nlp_bot.save_engine(NlpEngine.fit(CORPUS, tokenize))
+        self.assertEqual(nlp_bot.get_engine().sentences, tuple(CORPUS))
+        # os arquivos da versão anterior permanecem até a próxima gravação
+        self.assertEqual(len(os.listdir(path)), 11)
+
+        nlp_bot.save_engine(NlpEngine.fit(CORPUS[:2], tokenize))
+        self.assertEqual(len(os.listdir(path)), 11)
+
+    def test_load_rereads_replaced_manifest(self):
+        manifest = os.path.join(self.path, 'manifest.json')
+        NlpEngine.fit(CORPUS[:2], tokenize).save(self.path)
+        with open(manifest) as manifest_file:
+            stale = manifest_file.read()
+        NlpEngine.fit(CORPUS[:3], tokenize).save(self.path)
+        NlpEngine.fit(CORPUS, tokenize).save(self.path)
+        with open(manifest) as manifest_file:
+            current = manifest_file.read()
+
+        # a primeira leitura usa um manifesto anterior às duas últimas
+        # gravações, cujos arquivos já foram removidos
+        load = NlpEngine._load
+        calls = []
+
+        def stale_once(path, tokenizer):
+            calls.append(path)
+            if len(calls) > 1:
+                return load(path, tokenizer)
+            with open(manifest, 'w') as manifest_file:
+                manifest_file.write(stale)
+            try:
+                return load(path, tokenizer)
+            finally:
+                with open(manifest, 'w') as manifest_file:
+                    manifest_file.write(current)
+
+        with mock.patch.object(NlpEngine, '_load', side_effect=stale_once):
+            engine = NlpEngine.load(self.path, tokenize)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(engine.sentences, tuple(CORPUS))
+
+    def test_update_replaces_document_sentences(self):
+        keys = ['news:1', 'news:1', 'news:2', 'news:3', 'news:3', 'news:3']
+        engine = NlpEngine.fit(CORPUS, tokenize, keys)
+        updated = engine.update(
+            {'news:1', 'news:4'}, ['the dragon sleeps in the tower.'], ['news:4']
+        )
+
+        self.assertEqual(updated.sentences[-1], 'the dragon sleeps in the tower.')
+        self.assertEqual(updated.keys, tuple(keys[2:] + ['news:4']))
+        self.assertEqual(updated.stale, 1)
+        self.assertEqual(updated.vocabulary, engine.vocabulary)
+        self.assertEqual(
+            updated.answer('where does the dragon sleep?'),
+            'the dragon sleeps in the tower.'
+        )
+        # o motor original não é alterado
+        self.assertEqual(engine.sentences, tuple(CORPUS))
+
+
+def split_sentences(text):
+    return [sentence.strip() + '.' for sentence in text.lower().split('.') if sentence.strip()]
+
+
+@skipIf(NlpEngine is None, 'chatbot dependencies are not installed')
+class PortalCorpusTestCase(TransactionTestCase):
+    """
+    O corpus de cada portal vem do banco e é atualizado em segundo plano.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        index_settings = self.settings(
+            CHATBOT_INDEX_PATH=os.path.join(directory.name, 'chatbot_index'),
+            SEARCH_INDEX_PATH=os.path.join(directory.name, 'search_index')
+        )
+        index_settings.enable()
+        self.addCleanup(index_settings.disable)
+
+        for name, function in (
+                ('lem_normalize', tokenize), ('split_sentences', split_sentences)):
+            patcher = mock.patch.object(nlp_bot, name, function)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create(username='mage')
+        self.portal = Portal.objects.create(name='portal', owner=self.user)
+        self.other_portal = Portal.objects.create(name='other', owner=self.user)
+        self.topic = Topic.objects.create(
+            name='topic', scope='scope', topic_portal=self.portal
+        )
+        self.article = Article.objects.create(
+            title='Dragons',
+            abstract='A dragon guards the northern tower.',
+            body='Dragons sleep during the winter.',
+            post_author=self.user,
+            published_topic=self.topic
+        )
+        self.question = Question.objects.create(
+            text='Where do dragons live?',
+            post_author=self.user,
+            published_article=self.article
+        )
+        News.objects.create(
+            title='Festival',
+            body='The harvest festival fills the market with music.',
+            author=self.user,
+            portal_reference=self.other_portal
+        )
+
+    def ask(self, question):
+        return nlp_bot.get_engine(self.portal.id).answer(question)
+
+    def test_corpus_per_portal(self):
+        self.assertEqual(
+            self.ask('who guards the tower?'),
+            'a dragon guards the northern tower.'
+        )
+        self.assertEqual(self.ask('what happens at the festival?'), UNKNOWN_RESPONSE)
+        self.assertEqual(
+            nlp_bot.get_engine(self.other_portal.id).answer('harvest market'),
+            'the harvest festival fills the market with music.'
+        )
+
+    def test_cold_build_does_not_block_other_portals(self):
+        other_engine = nlp_bot.get_engine(self.other_portal.id)
+        build_engine = nlp_bot.build_engine
+        building, release = threading.Event(), threading.Event()
+
+        def slow_build(portal_id=None):
+            building.set()
+            release.wait(10)
+            return build_engine(portal_id)
+
+        with mock.patch.object(nlp_bot, 'build_engine', slow_build):
+            cold = threading.Thread(target=nlp_bot.get_engine, args=(self.portal.id,))
+            cold.start()
+            self.assertTrue(building.wait(10))
+
+            result = []
+            warm = threading.Thread(
+                target=lambda: result.append(nlp_bot.get_engine(self.other_portal.id))
+            )
+            warm.start()
+            warm.join(5)
+            release.set()
+            cold.join(10)
+
+        self.assertEqual(result, [other_engine])
+
+    def test_changes_during_cold_build(self):
+        build_engine = nlp_bot.build_engine
+        building, release = threading.Event(), threading.Event()
+
+        def slow_build(portal_id=None):
+            # o banco é lido antes de a notícia ser gravada
+            engine = build_engine(portal_id)
+            building.set()
+            release.wait(10)
+            return engine
+
+        with mock.patch.object(nlp_bot, 'build_engine', slow_build):
+            cold = threading.Thread(target=nlp_bot.get_engine, args=(self.portal.id,))
+            cold.start()
+            self.assertTrue(building.wait(10))
+            News.objects.create(
+                title='Winter',
+                body='Northern dragons sleep in the tower.',
+                author=self.user,
+                portal_reference=self.portal
+            )
+            release.set()
+            cold.join(10)
+        indexer.join()
+
+        self.assertIn(
+            'northern dragons sleep in the tower.',
+            nlp_bot.get_engine(self.portal.id).sentences
+        )
+
+    def test_portal_looked_up_by_the_indexer(self):
+        nlp_bot.get_engine(self.portal.id)
+        with CaptureQueriesContext(connection) as context:
+            Answer.objects.create(
+                text='Dragons live in the northern mountains.',
+                author=self.user,
+                question=self.question,
+                pro_votes=1
+            )
+        self.assertFalse([
+            q for q in context.captured_queries
+            if 'civil_cultural_topic' in q['sql']
+        ])
+
+        indexer.join()
+        self.assertIn(
+            'dragons live in the northern mountains.',
+            nlp_bot.get_engine(self.portal.id).sentences
+        )
+
+    def test_incremental_updates(self):
+        engine = nlp_bot.get_engine(self.portal.id)
+
+        with mock.patch('chatbot.indexer.REFIT_RATIO', 10):
+            news = News.objects.create(
+                title='Winter',
+                body='Northern dragons sleep in the tower.',
+                author=self.user,
+                portal_reference=self.portal
+            )
+            answer = Answer.objects.create(
+                text='Dragons live in the northern mountains.',
+                author=self.user,
+                question=self.question
+            )
+            indexer.join()
+
+            updated = nlp_bot.get_engine(self.portal.id)
+            self.assertIsNot(updated, engine)
+            self.assertEqual(updated.vocabulary, engine.vocabulary)
+            self.assertEqual(updated.stale, 2)
+            self.assertEqual(
+                updated.answer('where do northern dragons sleep?'),
+                'northern dragons sleep in the tower.'
+            )
+            # respostas só entram no corpus após serem aceitas
+            self.assertNotIn('dragons live in the northern mountains.', updated.sentences)
+
+            answer.pro_votes = 1
+            answer.save()
+            news.delete()
+            indexer.join()
+
+        updated = nlp_bot.get_engine(self.portal.id)
+        self.assertIn('dragons live in the northern mountains.', updated.sentences)
+        self.assertNotIn('northern dragons sleep in the tower.', updated.sentences)
+
+    def test_answer_accepted_by_votes(self):
+        answer = Answer.objects.create(
+            text='Dragons live in the northern mountains.',
+            author=self.user,
+            question=self.question
+        )
+        nlp_bot.get_engine(self.portal.id)
+
+        cast_vote(self.user, answer, Vote.UP)
+        indexer.join()
+        self.assertIn(
+            'dragons live in the northern mountains.',
+            nlp_bot.get_engine(self.portal.id).sentences
+        )
+
+    def test_refit_after_many_changes(self):
+        nlp_bot.get_engine(self.portal.id)
+        News.objects.create(
+            title='Council',
+            body='The council meets at the river bridge.',
+            author=self.user,
+            portal_reference=self.portal
+        )
+        indexer.join()
+
+        engine = nlp_bot.get_engine(self.portal.id)
+        self.assertEqual(engine.stale, 0)
+        self.assertIn('council', engine.vocabulary)
+
+    def test_portal_removal(self):
+        nlp_bot.get_engine(self.portal.id)
+        self.portal.delete()
+        indexer.join()
+        self.assertFalse(os.path.exists(nlp_bot.index_path(self.portal.id)))
+
+
+@skipIf(NlpEngine is None, 'chatbot dependencies are not installed')
+class TokenizationTestCase(SimpleTestCase):
+    """
+    Cada palavra é lematizada uma única vez e corpus grandes são
+    tokenizados em vários processos com o mesmo resultado.
+    """
+    def test_lemmas_are_cached(self):
+        lemmer = mock.Mock()
+        lemmer.lemmatize.side_effect = lambda token: token.rstrip('s')
+        nlp_bot.lemmatize.cache_clear()
+        self.addCleanup(nlp_bot.lemmatize.cache_clear)
+
+        with mock.patch.object(nlp_bot, 'lemmer', lemmer):
+            self.assertEqual(
+                nlp_bot.lem_normalize('Mages, study the MAGES!'),
+                ['mage', 'study', 'the', 'mage']
+            )
+            nlp_bot.lem_normalize('the mages study.')
+
+        self.assertEqual(lemmer.lemmatize.call_count, 3)
+
+    def test_parallel_tokenization(self):
+        sentences = [
+            '%s %s.' % (sentence.upper(), index)
+            for index, sentence in enumerate(CORPUS * 20)
+        ]
+        with mock.patch.object(chatbot_engine, 'CHUNK_SIZE', 7):
+            parallel = tokenize_all(sentences, tokenize, workers=2)
+        self.assertEqual(parallel, tokenize_all(sentences, tokenize))
+        self.assertEqual(parallel[0], ['a', 'dragon', 'guards', 'the', 'northern', 'tower', '0'])
+
+        with mock.patch.object(chatbot_engine, 'CHUNK_SIZE', 7):
+            engine = NlpEngine.fit(sentences, tokenize, workers=2)
+        expected = NlpEngine.fit(sentences, tokenize)
+        self.assertEqual(engine.vocabulary, expected.vocabulary)
+        self.assertEqual((engine.matrix != expected.matrix).nnz, 0)
+        self.assertNotIn('the', engine.vocabulary)
+
+
+@skipIf(NlpEngine is None, 'chatbot dependencies are not installed')
+class InferencePoolTestCase(SimpleTestCase):
+    """
+    A inferência roda em processos separados, com fila limitada e tempo
+    máximo de resposta.
+    """
+    def make_pool(self, workers=1, max_pending=1, timeout=10):
+        pool = InferencePool(workers, max_pending, timeout)
+        self.addCleanup(pool.shutdown)
+        pool.warm_up()
+        return pool
+
+    def test_runs_in_other_process(self):
+        pool = self.make_pool()
+        self.assertNotEqual(pool.run(os.getpid), os.getpid())
+        self.assertEqual(pool.run(pow, 2, 10), 1024)
+
+        stats = pool.stats()
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(stats['pending'], 0)
+        self.assertIsNotNone(stats['p99'])
+
+    def test_full_queue_is_rejected(self):
+        pool = self.make_pool()
+        busy = threading.Thread(target=pool.run, args=(time.sleep, 1))
+        busy.start()
+        while not pool.stats()['pending']:
+            time.sleep(0.01)
+
+        with self.assertRaisesMessage(Exception, 'Chatbot is busy'):
+            pool.run(pow, 2, 2)
+        busy.join()
+
+        self.assertEqual(pool.run(pow, 2, 2), 4)
+        self.assertEqual(pool.stats()['rejected'], 1)
+
+    def test_timeout(self):
+        pool = self.make_pool(max_pending=2, timeout=0.5)
+        with self.assertRaisesMessage(Exception, 'Chatbot took too long'):
+            pool.run(time.sleep, 2)
+
+        stats = pool.stats()
+        self.assertEqual(stats['timeouts'], 1)
+        # a vaga só é liberada quando o processo termina a tarefa
+        self.assertEqual(stats['pending'], 1)
+
+    def test_inline(self):
+        pool = self.make_pool(workers=0)
+        self.assertEqual(pool.run(os.getpid), os.getpid())
+
+
+class LazyLoadingTestCase(SimpleTestCase):
+    """
+    O schema do servidor inclui o chatbot sem importar os bots.
+    """
+    def test_schema_does_not_import_the_bots(self):
+        modules = subprocess.run(
+            [sys.executable, '-c', (
+                'import sys, django; django.setup(); import server.schema; '
+                'print(sorted(set(sys.modules) & {"nltk", "numpy", "sklearn", '
+                '"chatbot.bots.nlp_bot", "chatbot.bots.engine"}))'
+            )],
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='server.settings.development'),
+            check=True, stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout.split('\n')[-2]
+        self.assertEqual(modules, '[]')
+
+    def test_cached_reply_does_not_import_the_bots(self):
+        modules = subprocess.run(
+            [sys.executable, '-c', (
+                'import sys, django; django.setup(); from chatbot import schema; '
+                'schema.ask = lambda question, portal_id: "answer"; '
+                'schema.reply_to("Who guards the tower?"); schema.reply_to("hello"); '
+                'print(sorted(set(sys.modules) & {"nltk", "numpy", "sklearn", '
+                '"chatbot.bots.nlp_bot", "chatbot.bots.engine"}))'
+            )],
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='server.settings.development'),
+            check=True, stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout.split('\n')[-2]
+        self.assertEqual(modules, '[]')
+
+    @skipIf(NlpEngine is None, 'chatbot dependencies are not installed')
+    def test_warm_up(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with self.settings(
+                CHATBOT_INDEX_PATH=directory.name, CHATBOT_WARM_UP=True), \
+                mock.patch(
+                    'chatbot.pool.get_pool', return_value=InferencePool(0, 1, None)):
+            NlpEngine.fit(CORPUS, tokenize).save(nlp_bot.index_path())
+            start_warm_up().join()
+            self.assertIn(nlp_bot.index_path(), nlp_bot._engines)
+
+        with self.settings(CHATBOT_WARM_UP=False):
+            self.assertIsNone(start_warm_up())
+
+
+@skipIf(NlpEngine is None, 'chatbot dependencies are not installed')
+class TopAnswersTestCase(TestCase):
+    """
+    Várias perguntas são respondidas de uma vez, com as k melhores
+    sentenças de cada uma.
+    """
+    def test_top_answers(self):
+        engine = NlpEngine.fit(CORPUS, tokenize)
+        results = engine.top_answers(
+            ['dragon tower mage', 'council river', 'xyzzy'], 2
+        )
+
+        self.assertEqual(len(results), 3)
+        sentences = [sentence for sentence, _ in results[0]]
+        self.assertEqual(sentences, [CORPUS[0], CORPUS[5]])
+        self.assertGreater(results[0][0][1], results[0][1][1])
+        # somente sentenças com alguma semelhança
+        self.assertEqual([sentence for sentence, _ in results[1]], [CORPUS[2]])
+        self.assertEqual(results[2], [])
+
+        # a pontuação é a semelhança do cosseno
+        self.assertAlmostEqual(
+            engine.top_answers([CORPUS[3]], 1)[0][0][1], 1.0
+        )
+
+    def test_ties_follow_corpus_order(self):
+        engine = NlpEngine.fit(
+            ['red dragon.', 'blue dragon.', 'green dragon.', 'old dragon.'],
+            tokenize
+        )
+        answers = engine.top_answers(['dragon'], 2)[0]
+        self.assertEqual(
+            [sentence for sentence, _ in answers], ['red dragon.', 'blue dragon.']
+        )
+
+    def ask_batch(self, questions, k):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        test_settings = self.settings(
+            CHATBOT_INDEX_PATH=os.path.join(directory.name, 'chatbot_index'),
+            TOKEN_BLACKLIST_FILTER_PATH=None
+        )
+        test_settings.enable()
+        self.addCleanup(test_settings.disable)
+        patcher = mock.patch.object(nlp_bot, 'lem_normalize', tokenize)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        NlpEngine.fit(CORPUS, tokenize).save(nlp_bot.index_path())
+
+        class Query(chatbot_schema.Query, graphene.ObjectType):
+            pass
+
+        class Mutation(chatbot_schema.Mutation, graphene.ObjectType):
+            pass
+
+        schema = graphene.Schema(query=Query, mutation=Mutation)
+        request = RequestFactory().post(
+            '/graphql/',
+            json.dumps({'query': '''
+            mutation Ask($questions: [String]!, $k: Int) {
+                askNlpBotBatch(input: {
+                    questions: $questions,
+                    k: $k
+                }) {
+                    results { question answers { sentence score } }
+                }
+            }
+            ''', 'variables': {'questions': questions, 'k': k}}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='JWT token'
+        )
+        request.user = get_user_model().objects.create(username='mage')
+        with mock.patch(
+                'chatbot.pool.get_pool', return_value=InferencePool(0, 1, None)):
+            response = CivilGraphQLView.as_view(schema=schema)(request)
+
+        content = json.loads(response.content.decode())
+        self.assertNotIn('errors', content)
+        return content['data']['askNlpBotBatch']['results']
+
+    def test_batch_mutation(self):
+        results = self.ask_batch(
+            ['who guards the tower?', 'when does the council meet?'], 1
+        )
+        self.assertEqual(
+            [result['answers'][0]['sentence'] for result in results],
+            [CORPUS[0], CORPUS[2]]
+        )
+
+    def test_batch_mutation_null_k(self):
+        with mock.patch.object(
+                chatbot_schema, 'ask_batch', wraps=chatbot_schema.ask_batch) as ask:
+            results = self.ask_batch(['who guards the tower?'], None)
+
+        self.assertEqual(results[0]['answers'][0]['sentence'], CORPUS[0])
+        self.assertEqual(ask.call_args[0][1], chatbot_schema.DEFAULT_BATCH_ANSWERS)
+
+
+class AnswerCacheTestCase(SimpleTestCase):
+    """
+    Cache LRU com expiração e invalidação pela versão do índice.
+    """
+    def test_lru(self):
+        cache = AnswerCache(2, 60)
+        cache.set('a', 'v1', 'A')
+        cache.set('b', 'v1', 'B')
+        self.assertEqual(cache.get('a', 'v1'), 'A')
+        cache.set('c', 'v1', 'C')
+
+        self.assertIsNone(cache.get('b', 'v1'))
+        self.assertEqual(cache.get('a', 'v1'), 'A')
+        self.assertEqual(cache.get('c', 'v1'), 'C')
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 1, 'size': 2})
+
+    def test_ttl(self):
+        cache = AnswerCache(2, 60)
+        with mock.patch('chatbot.cache.time.monotonic', return_value=100):
+            cache.set('a', 'v1', 'A')
+        with mock.patch('chatbot.cache.time.monotonic', return_value=159):
+            self.assertEqual(cache.get('a', 'v1'), 'A')
+        with mock.patch('chatbot.cache.time.monotonic', return_value=160):
+            self.assertIsNone(cache.get('a', 'v1'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_index_version(self):
+        cache = AnswerCache(2, 60)
+        cache.set('a', 'v1', 'A')
+        self.assertIsNone(cache.get('a', 'v2'))
+        self.assertIsNone(cache.get('a', 'v1'))
+
+
+@skipIf(NlpEngine is None, 'chatbot dependencies are not installed')
+class ReplyCacheTestCase(SimpleTestCase):
+    """
+    Perguntas repetidas não voltam ao pool enquanto o índice não muda.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        index_settings = self.settings(
+            CHATBOT_INDEX_PATH=os.path.join(directory.name, 'chatbot_index')
+        )
+        index_settings.enable()
+        self.addCleanup(index_settings.disable)
+
+        cache = AnswerCache(10, 60)
+        self.ask = mock.Mock(side_effect=lambda question, portal_id: question)
+        for target, value in (
+                ('chatbot.schema.get_answer_cache', lambda: cache),
+                ('chatbot.schema.ask', self.ask)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.cache = cache
+
+    def test_cached_replies(self):
+        NlpEngine.fit(CORPUS, tokenize).save(nlp_bot.index_path())
+
+        self.assertEqual(
+            chatbot_schema.reply_to('who guards the tower?'), 'who guards the tower?'
+        )
+        chatbot_schema.reply_to('Who guards the tower')
+        chatbot_schema.reply_to('who guards the tower?', 1)
+        self.assertEqual(self.ask.call_count, 2)
+
+        # despedidas e cumprimentos não passam pelo cache
+        chatbot_schema.reply_to('Bye')
+        chatbot_schema.reply_to('hello')
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'size': 2})
+
+        nlp_bot.save_engine(NlpEngine.fit(CORPUS[:3], tokenize))
+        chatbot_schema.reply_to('who guards the tower?')
+        self.assertEqual(self.ask.call_count, 3)
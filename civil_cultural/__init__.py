@@ -0,0 +1 @@
+default_app_config = 'civil_cultural.apps.CivilCulturalConfig'
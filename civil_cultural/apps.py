@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CivilCulturalConfig(AppConfig):
     name = 'civil_cultural'
+
+    def ready(self):
+        import civil_cultural.signals  # noqa: F401
@@ -0,0 +1,285 @@
+"""
+Cache dos objetos lidos com frequência: Portais, Tópicos, Regras, Tags e
+usuários.
+
+O cache tem dois níveis:
+    - Um LRU em cada worker, com validade curta (ENTITY_CACHE_LOCAL_TTL);
+    - O cache do Django indicado por ENTITY_CACHE_ALIAS, compartilhado
+      pelos workers quando configurado com um memcached ou Redis.
+
+As entradas guardam os valores das colunas de CACHED_FIELDS e os objetos
+são recriados a cada leitura, então nenhuma instância é compartilhada
+entre requisições.
+
+Cada objeto tem uma versão no cache compartilhado, que faz parte da chave
+da sua entrada. A invalidação (ver civil_cultural.signals) troca a versão
+em vez de apagar a entrada: um worker que leu o objeto do banco antes da
+alteração grava a entrada na versão antiga, que não é mais lida.
+
+As entradas locais guardam a chave em que foram lidas e cada leitura
+confere as versões atuais, com um único get_many para todo o lote: uma
+entrada local de uma versão trocada por outro worker nunca é usada (ex.:
+em uma resposta guardada com as versões novas, ver
+civil_cultural.responses).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from civil_cultural.models import Portal, Rule, Tag, Topic
+from civil_cultural.versions import change_version, get_versions
+
+
+# colunas guardadas de cada model: as lidas pelos tipos GraphQL, sem a
+# senha e as colunas de controle de acesso do usuário. As demais colunas
+# são adiadas nos objetos recriados a partir do cache
+CACHED_FIELDS = {
+    Portal: (
+        'id', 'name', 'founding_datetime', 'is_public', 'owner_id',
+        'members_count', 'topics_count', 'news_count'
+    ),
+    Topic: (
+        'id', 'name', 'description', 'scope', 'creation_datetime',
+        'topic_portal_id', 'articles_count'
+    ),
+    Rule: ('id', 'description', 'creation_date', 'portal_reference_id'),
+    Tag: ('id', 'reference'),
+    get_user_model(): (
+        'id', 'username', 'first_name', 'last_name', 'email', 'is_staff',
+        'is_active', 'date_joined'
+    ),
+}
+
+CACHED_MODELS = tuple(CACHED_FIELDS)
+
+# os labels também identificam os models históricos usados nas migrations
+CACHED_LABELS = {model._meta.label_lower for model in CACHED_MODELS}
+
+
+def is_cached(model):
+    """
+    param model: <django.db.models.Model>
+    rtype: <bool> se os objetos do model passam pelo cache
+    """
+    return model._meta.label_lower in CACHED_LABELS
+
+
+def _version_key(label, pk=None):
+    if pk is None:
+        return 'entity-version:%s' % label
+    return 'entity-version:%s:%s' % (label, pk)
+
+
+class EntityCache:
+    """
+    Cache de dois níveis dos objetos de CACHED_MODELS, seguro para uso por
+    várias threads.
+
+    param cache: <django.core.cache.backends.base.BaseCache> nível
+                 compartilhado
+    param local_size: <int> quantidade máxima de objetos no nível local
+    param local_ttl: <float> segundos de validade de um objeto no nível local
+    param ttl: <int> segundos de validade de um objeto no nível compartilhado
+    """
+    def __init__(self, cache, local_size, local_ttl, ttl):
+        self.cache = cache
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_many(self, model, pks):
+        """
+        Retorna os objetos do model pelas chaves primárias. Os que não
+        estão em nenhum dos níveis são lidos do banco em uma única
+        consulta e guardados nos dois.
+
+        param model: <django.db.models.Model>
+        param pks: <list> chaves primárias
+        rtype: <dict> chave primária -> objeto; chaves inexistentes ficam
+               de fora
+        """
+        label = model._meta.label_lower
+        fields = list(CACHED_FIELDS[model])
+        pks = list(dict.fromkeys(pks))
+        rows = {}
+
+        keys = self._entry_keys(label, pks)
+        now = time.monotonic()
+        with self.lock:
+            for pk in pks:
+                entry = self.entries.get((label, pk))
+                if entry is None:
+                    continue
+                expires_at, key, values = entry
+                # entradas vencidas ou lidas em uma versão anterior
+                if expires_at <= now or key != keys[pk]:
+                    del self.entries[(label, pk)]
+                    continue
+                self.entries.move_to_end((label, pk))
+                rows[pk] = values
+            self.local_hits += len(rows)
+
+        missing = [pk for pk in pks if pk not in rows]
+        if missing:
+            shared = self.cache.get_many([keys[pk] for pk in missing])
+            fetched = {}
+            for pk in missing:
+                values = shared.get(keys[pk])
+                # entradas gravadas antes de uma mudança nas colunas
+                if values is not None and len(values) == len(fields):
+                    fetched[pk] = values
+            shared_hits = len(fetched)
+
+            unknown = [pk for pk in missing if pk not in fetched]
+            if unknown:
+                pk_index = fields.index(model._meta.pk.attname)
+                loaded = {
+                    values[pk_index]: values
+                    for values in model._default_manager.filter(
+                        pk__in=unknown
+                    ).values_list(*fields)
+                }
+                self.cache.set_many(
+                    {keys[pk]: values for pk, values in loaded.items()},
+                    self.ttl
+                )
+                fetched.update(loaded)
+
+            expires_at = time.monotonic() + self.local_ttl
+            with self.lock:
+                self.shared_hits += shared_hits
+                self.misses += len(missing) - shared_hits
+                for pk, values in fetched.items():
+                    self.entries[(label, pk)] = (expires_at, keys[pk], values)
+                    self.entries.move_to_end((label, pk))
+                while len(self.entries) > self.local_size:
+                    self.entries.popitem(last=False)
+            rows.update(fetched)
+
+        db = model._default_manager.db
+        return {
+            pk: model.from_db(db, fields, values)
+            for pk, values in rows.items()
+        }
+
+    def _entry_keys(self, label, pks):
+        """
+        Chaves das entradas no nível compartilhado, com as versões atuais
+        do model e de cada objeto. Versões ausentes são criadas.
+
+        param label: <str>
+        param pks: <list>
+        rtype: <dict> chave primária -> chave da entrada
+        """
+        version_keys = [_version_key(label)]
+        version_keys += [_version_key(label, pk) for pk in pks]
+        versions = get_versions(self.cache, version_keys)
+
+        model_version = versions[_version_key(label)]
+        return {
+            pk: 'entity:%s:%s:%s:%s' % (
+                label, pk, model_version, versions[_version_key(label, pk)]
+            )
+            for pk in pks
+        }
+
+    def invalidate(self, model, pk):
+        """
+        Invalida um objeto nos dois níveis.
+
+        param model: <django.db.models.Model>
+        param pk: <int>
+        """
+        label = model._meta.label_lower
+        with self.lock:
+            self.entries.pop((label, pk), None)
+            self.invalidations += 1
+        change_version(self.cache, _version_key(label, pk))
+
+    def invalidate_model(self, model):
+        """
+        Invalida todos os objetos de um model nos dois níveis.
+
+        param model: <django.db.models.Model>
+        """
+        label = model._meta.label_lower
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == label]:
+                del self.entries[key]
+            self.invalidations += 1
+        change_version(self.cache, _version_key(label))
+
+    def clear(self):
+        """
+        Invalida todos os objetos de todos os models em cache.
+        """
+        for model in CACHED_MODELS:
+            self.invalidate_model(model)
+
+    def stats(self):
+        """
+        rtype: <dict> acertos em cada nível, faltas, invalidações, tamanho
+               do nível local e proporção de acertos
+        """
+        with self.lock:
+            hits = self.local_hits + self.shared_hits
+            lookups = hits + self.misses
+            return {
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'local_size': len(self.entries),
+                'hit_ratio': hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_entity_cache():
+    """
+    Retorna o cache de objetos do processo, configurado pelas settings
+    ENTITY_CACHE_ALIAS, ENTITY_CACHE_LOCAL_SIZE, ENTITY_CACHE_LOCAL_TTL e
+    ENTITY_CACHE_TTL.
+
+    rtype: <EntityCache>
+    """
+    with _cache_lock:
+        if 'cache' not in _cache:
+            _cache['cache'] = EntityCache(
+                caches[settings.ENTITY_CACHE_ALIAS],
+                settings.ENTITY_CACHE_LOCAL_SIZE,
+                settings.ENTITY_CACHE_LOCAL_TTL,
+                settings.ENTITY_CACHE_TTL
+            )
+        return _cache['cache']
+
+
+def expire(model, pk=None):
+    """
+    Invalida um objeto (ou, sem `pk`, todos os objetos do model) se o
+    model estiver em cache. A versão é trocada novamente após o commit
+    (ver civil_cultural.versions.change_version).
+
+    param model: <django.db.models.Model>
+    param pk: <int>
+    """
+    if not is_cached(model):
+        return
+
+    if pk is None:
+        get_entity_cache().invalidate_model(model)
+    else:
+        get_entity_cache().invalidate(model, pk)
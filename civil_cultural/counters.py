@@ -0,0 +1,102 @@
+"""
+Contadores agregados dos Portais, Tópicos, Artigos e Perguntas.
+
+Cada contador é uma coluna do objeto pai (ex.: Portal.members_count),
+alterada com expressões F() pelos signals (ver civil_cultural.signals)
+sempre que um filho é criado, removido ou um membro entra ou sai do
+portal. As mutations que alteram os contadores são atômicas, então o
+filho e o contador do pai são gravados na mesma transação.
+
+Alterações feitas fora do ORM (ex.: SQL direto, remoção de usuários em
+cascata) não passam pelos signals; o comando reconcile_counters recalcula
+os contadores e corrige as diferenças.
+
+Como os votos, os contadores só devem ser alterados por UPDATEs com F():
+um save() de um objeto lido antes de outras alterações gravaria valores
+antigos. As mutations de edição usam save_content (ver
+civil_cultural.votes), que não grava esses campos.
+
+Os UPDATEs não enviam signals, então add e reconcile invalidam os objetos
+alterados no cache de objetos (ver civil_cultural.cache) e as respostas
+em cache que os leram (ver civil_cultural.responses).
+"""
+from django.apps import apps
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from civil_cultural.cache import expire
+from civil_cultural.responses import evict
+
+
+# (model pai, contador, model filho, chave estrangeira do filho para o pai)
+COUNTERS = (
+    ('Portal', 'members_count', 'Portal_users', 'portal'),
+    ('Portal', 'topics_count', 'Topic', 'topic_portal'),
+    ('Portal', 'news_count', 'News', 'portal_reference'),
+    ('Topic', 'articles_count', 'Article', 'published_topic'),
+    ('Article', 'questions_count', 'Question', 'published_article'),
+    ('Question', 'answers_count', 'Answer', 'question'),
+)
+
+def _get_model(name):
+    return apps.get_model('civil_cultural', name)
+
+
+def counted_relations(child):
+    """
+    Contadores alterados pela criação ou remoção de um objeto.
+
+    param child: <django.db.models.Model> model do objeto
+    rtype: <list> de tuplas (model pai, contador, chave estrangeira)
+    """
+    return [
+        (_get_model(parent), counter, foreign_key)
+        for parent, counter, child_name, foreign_key in COUNTERS
+        if child._meta.object_name == child_name
+    ]
+
+
+def add(parent, pk, counter, amount):
+    """
+    Soma `amount` ao contador de um objeto pai.
+
+    param parent: <django.db.models.Model>
+    param pk: <int>
+    param counter: <str>
+    param amount: <int>
+    """
+    if amount:
+        parent.objects.filter(pk=pk).update(**{counter: F(counter) + amount})
+        expire(parent, pk)
+        evict(parent)
+
+
+def reconcile():
+    """
+    Recalcula os contadores que divergem das contagens reais.
+
+    rtype: <dict> contador -> quantidade de objetos corrigidos
+    """
+    fixed = {}
+    for parent, counter, child, foreign_key in COUNTERS:
+        child = _get_model(child)
+        count = Coalesce(
+            Subquery(
+                child.objects.filter(**{foreign_key: OuterRef('pk')})
+                .order_by()
+                .values(foreign_key)
+                .annotate(count=Count('pk'))
+                .values('count')
+            ),
+            Value(0)
+        )
+        name = '%s.%s' % (parent, counter)
+        fixed[name] = _get_model(parent).objects.annotate(
+            real_count=count
+        ).exclude(**{counter: F('real_count')}).count()
+        # a correção é uma única instrução sobre todos os objetos
+        if fixed[name]:
+            _get_model(parent).objects.update(**{counter: count})
+            expire(_get_model(parent))
+            evict(_get_model(parent))
+    return fixed
@@ -0,0 +1,392 @@
+"""
+Campos GraphQL customizados da aplicação civil-cultural.
+"""
+import base64
+import json
+
+import graphene
+from django.db import connections as databases
+from django.db.models import F, Prefetch, Q, prefetch_related_objects
+from django.db.models.query import QuerySet
+from graphene.relay import PageInfo
+from graphene.types import NonNull
+from graphene_django.settings import graphene_settings
+from promise import Promise
+
+from civil_cultural.planner import optimize
+
+
+class KeysetList(list):
+    """
+    Lista paginada por chave como os querysets, para resultados calculados
+    fora do banco (ex.: a busca textual).
+
+    param items: <iterable>
+    param ordering: <list> de (atributo, decrescente), que deve identificar
+                    cada item de forma única
+    """
+    def __init__(self, items, ordering):
+        super().__init__(items)
+        self.ordering = ordering
+
+
+def get_ordering(queryset):
+    """
+    Retorna a ordenação do queryset como uma lista de (campo, decrescente),
+    terminando sempre pela chave primária para que a ordem seja total.
+
+    param queryset: <django.db.models.QuerySet>
+    rtype: <list>
+    """
+    model = queryset.model
+    pk_name = model._meta.pk.name
+    ordering = []
+    for name in queryset.query.order_by or model._meta.ordering:
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name == 'pk':
+            name = pk_name
+        ordering.append((name, descending))
+
+    if pk_name not in [name for name, _ in ordering]:
+        descending = ordering[-1][1] if ordering else True
+        ordering.append((pk_name, descending))
+    return ordering
+
+
+def encode_cursor(values):
+    """
+    Codifica os valores da chave de ordenação de um objeto em um cursor.
+
+    param values: <list>
+    rtype: <str>
+    """
+    serialized = [
+        value.isoformat() if hasattr(value, 'isoformat') else value
+        for value in values
+    ]
+    return base64.b64encode(json.dumps(serialized).encode()).decode()
+
+
+def decode_cursor(model, ordering, cursor):
+    """
+    Decodifica um cursor de volta aos valores da chave de ordenação.
+
+    param model: <django.db.models.Model> None para uma KeysetList, cujos
+                 valores são usados como gravados no cursor
+    param ordering: <list> retorno de get_ordering
+    param cursor: <str>
+    rtype: <list>
+    """
+    try:
+        values = json.loads(base64.b64decode(cursor.encode()).decode())
+        assert len(values) == len(ordering)
+        if model is None:
+            return values
+        return [
+            model._meta.get_field(name).to_python(value)
+            for (name, _), value in zip(ordering, values)
+        ]
+    except Exception:
+        raise Exception('Invalid cursor: %s' % cursor)
+
+
+def sort_key(instance, ordering):
+    return [getattr(instance, name) for name, _ in ordering]
+
+
+def seek(ordering, values, backwards=False):
+    """
+    Monta o filtro que seleciona os objetos posteriores (ou anteriores)
+    à chave informada, na ordenação do queryset.
+
+    param ordering: <list> retorno de get_ordering
+    param values: <list> valores da chave do cursor
+    param backwards: <bool> seleciona os objetos anteriores
+    rtype: <django.db.models.Q>
+    """
+    condition = Q()
+    equal = Q()
+    for (name, descending), value in zip(ordering, values):
+        lookup = 'lt' if descending != backwards else 'gt'
+        condition |= equal & Q(**{'%s__%s' % (name, lookup): value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def comes_after(key, values, ordering):
+    """
+    Equivalente em memória ao filtro de `seek`: indica se a chave `key`
+    vem depois de `values` na ordenação.
+
+    rtype: <bool>
+    """
+    for (_, descending), own, other in zip(ordering, key, values):
+        if own == other:
+            continue
+        return own < other if descending else own > other
+    return False
+
+
+def page_size(args):
+    """
+    param args: <dict> argumentos first, last, after e before da conexão
+    rtype: <tuple> (se a página é lida de trás para frente, tamanho da
+           página)
+    """
+    first = args.get('first')
+    last = args.get('last')
+    backwards = last is not None and first is None
+    limit = last if backwards else first
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    if limit is None or limit > max_limit:
+        limit = max_limit
+    return backwards, limit
+
+
+def supports_window(alias):
+    """
+    param alias: <str> banco de dados
+    rtype: <bool> se o banco tem funções de janela (ROW_NUMBER() OVER)
+    """
+    connection = databases[alias]
+    if connection.vendor == 'sqlite':
+        # o Django 2.2 não detecta as funções de janela do SQLite 3.25+
+        return connection.Database.sqlite_version_info >= (3, 25, 0)
+    return connection.features.supports_over_clause
+
+
+def bound_per_parent(queryset, parent, parents, args):
+    """
+    Restringe o queryset, em uma única consulta, à página de cada objeto
+    pai pedida em `args`, mais um objeto que indica se há outra página.
+    Os objetos de cada pai são numerados com ROW_NUMBER() OVER
+    (PARTITION BY <pai>) na ordenação da conexão.
+
+    param queryset: <django.db.models.QuerySet>
+    param parent: <str> caminho do ORM dos objetos até o objeto pai
+    param parents: <list> chaves primárias dos objetos pais
+    param args: <dict> argumentos de paginação da conexão
+    rtype: <django.db.models.QuerySet>
+    """
+    model = queryset.model
+    ordering = get_ordering(queryset)
+    backwards, limit = page_size(args)
+
+    page = queryset.filter(**{'%s__in' % parent: parents})
+    if args.get('after'):
+        after_values = decode_cursor(model, ordering, args['after'])
+        page = page.filter(seek(ordering, after_values))
+    if args.get('before'):
+        before_values = decode_cursor(model, ordering, args['before'])
+        page = page.filter(seek(ordering, before_values, True))
+
+    # a janela é escrita à mão sobre as colunas da página, pois o Django
+    # 2.2 não gera expressões Window para o SQLite
+    keys = ['page_key_%s' % index for index in range(len(ordering))]
+    columns = {key: F(name) for key, (name, _) in zip(keys, ordering)}
+    sql, params = page.order_by().annotate(
+        page_pk=F('pk'), page_parent=F(parent), **columns
+    ).values('page_pk', 'page_parent', *keys).query.sql_with_params()
+
+    quote = databases[queryset.db].ops.quote_name
+    order = ', '.join(
+        '%s %s' % (quote(key), 'DESC' if descending != backwards else 'ASC')
+        for key, (_, descending) in zip(keys, ordering)
+    )
+    rows = (
+        'SELECT {pk} FROM (SELECT {pk}, ROW_NUMBER() OVER (PARTITION BY '
+        '{parent} ORDER BY {order}) AS {row} FROM ({sql}) {page}) {numbered} '
+        'WHERE {row} <= %s'.format(
+            pk=quote('page_pk'), parent=quote('page_parent'), order=order,
+            row=quote('page_row'), sql=sql, page=quote('page'),
+            numbered=quote('numbered')
+        )
+    )
+    # o filtro pelos objetos pais é aplicado pelo prefetch
+    return queryset.extra(
+        where=['%s.%s IN (%s)' % (
+            quote(model._meta.db_table), quote(model._meta.pk.column), rows
+        )],
+        params=list(params) + [limit + 1]
+    )
+
+
+def _follow(rows, path):
+    objects = list(rows)
+    for lookup in path:
+        related = []
+        for instance in objects:
+            value = getattr(instance, lookup)
+            if value is None:
+                continue
+            if hasattr(value, 'all'):
+                related += value.all()
+            else:
+                related.append(value)
+        objects = related
+    return list({id(instance): instance for instance in objects}.values())
+
+
+def prefetch_connections(rows, connections):
+    """
+    Carrega as conexões aninhadas selecionadas para todos os objetos de
+    uma página, com uma consulta por conexão (ver bound_per_parent).
+    A conexão de cada objeto é então paginada em memória.
+
+    Conexões com cursores inválidos, ou em bancos sem funções de janela,
+    ficam para os resolvers, que as paginam no banco para cada objeto pai.
+
+    param rows: <list> objetos da página
+    param connections: <list> civil_cultural.planner.Connection
+    """
+    for connection in connections:
+        parents = _follow(rows, connection.path)
+        queryset = connection.queryset
+        if not parents or not supports_window(queryset.db):
+            continue
+
+        manager = getattr(parents[0], connection.lookup)
+        # many-to-many ou chave estrangeira reversa
+        parent = getattr(manager, 'query_field_name', None)
+        if parent is None:
+            parent = manager.field.name
+        try:
+            queryset = bound_per_parent(
+                queryset, parent, [instance.pk for instance in parents],
+                connection.arguments
+            )
+        except Exception:
+            continue
+
+        prefetch_related_objects(
+            parents, Prefetch(connection.lookup, queryset=queryset)
+        )
+        prefetch_connections(
+            [
+                child for instance in parents
+                for child in getattr(instance, connection.lookup).all()
+            ],
+            connection.connections
+        )
+
+
+class QuerySetConnectionField(graphene.relay.ConnectionField):
+    """
+    Conexão relay que planeja e pagina querysets no banco de dados.
+
+    Antes da paginação, o queryset retornado pelo resolver recebe os
+    select_related/prefetch_related necessários para os campos
+    selecionados. Depois dela, as conexões aninhadas são carregadas para
+    todos os objetos da página (ver prefetch_connections).
+
+    A paginação é feita por chave (keyset): o cursor guarda os valores da
+    ordenação do queryset (ex.: data de publicação e id) e cada página é
+    obtida com um filtro sobre o índice correspondente, sem OFFSET nem
+    COUNT(*). As páginas permanecem estáveis mesmo com inserções
+    concorrentes. Querysets já avaliados (ex.: vindos de um prefetch) e
+    KeysetLists são paginados em memória com os mesmos cursores.
+    """
+    @classmethod
+    def resolve_connection(cls, connection_type, args, resolved,
+                           connections=()):
+        if isinstance(resolved, QuerySet):
+            model = resolved.model
+            ordering = get_ordering(resolved)
+        elif isinstance(resolved, KeysetList):
+            model = None
+            ordering = resolved.ordering
+        else:
+            return super().resolve_connection(connection_type, args, resolved)
+
+        after = args.get('after')
+        before = args.get('before')
+        backwards, limit = page_size(args)
+
+        after_values = after and decode_cursor(model, ordering, after)
+        before_values = before and decode_cursor(model, ordering, before)
+
+        if model is not None and resolved._result_cache is None:
+            queryset = resolved.order_by(*[
+                '-' + name if descending else name
+                for name, descending in ordering
+            ])
+            if after_values:
+                queryset = queryset.filter(seek(ordering, after_values))
+            if before_values:
+                queryset = queryset.filter(seek(ordering, before_values, True))
+            if backwards:
+                queryset = queryset.reverse()
+            rows = list(queryset[:limit + 1])
+
+        else:
+            rows = list(resolved)
+            # ordenações estáveis, da chave menos para a mais significativa
+            for name, descending in reversed(ordering):
+                rows.sort(key=lambda row: getattr(row, name), reverse=descending)
+            if after_values:
+                rows = [
+                    row for row in rows
+                    if comes_after(sort_key(row, ordering), after_values, ordering)
+                ]
+            if before_values:
+                rows = [
+                    row for row in rows
+                    if comes_after(before_values, sort_key(row, ordering), ordering)
+                ]
+            if backwards:
+                rows.reverse()
+            rows = rows[:limit + 1]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        prefetch_connections(rows, connections)
+
+        edges = [
+            connection_type.Edge(
+                node=row, cursor=encode_cursor(sort_key(row, ordering))
+            )
+            for row in rows
+        ]
+        connection = connection_type(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_more if backwards else bool(after),
+                has_next_page=bool(before) if backwards else has_more,
+            )
+        )
+        connection.iterable = resolved
+        return connection
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection_type, root, info, **args):
+        max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        for argument in ('first', 'last'):
+            if args.get(argument) is not None and args[argument] > max_limit:
+                raise Exception(
+                    'Requesting %s records on the `%s` connection exceeds the '
+                    '`%s` limit of %s records.' % (
+                        args[argument], info.field_name, argument, max_limit
+                    )
+                )
+
+        resolved = resolver(root, info, **args)
+
+        if isinstance(connection_type, NonNull):
+            connection_type = connection_type.of_type
+
+        def on_resolve(resolved):
+            connections = ()
+            if isinstance(resolved, QuerySet) and resolved._result_cache is None:
+                resolved, connections = optimize(resolved, info)
+            return cls.resolve_connection(
+                connection_type, args, resolved, connections
+            )
+
+        if Promise.is_thenable(resolved):
+            return Promise.resolve(resolved).then(on_resolve)
+        return on_resolve(resolved)
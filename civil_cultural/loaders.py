@@ -0,0 +1,126 @@
+"""
+DataLoaders da aplicação civil-cultural.
+Este módulo contém:
+    - Loaders que agrupam o carregamento de objetos por chave primária,
+      passando pelo cache de objetos (ver civil_cultural.cache) nos
+      models em cache;
+    - O loader que verifica, em lote, se o usuário é membro de portais;
+    - Utilitários para resolver chaves estrangeiras através dos loaders
+      da requisição.
+
+Os loaders vivem no contexto da requisição (ver server.views), portanto
+cada requisição possui seu próprio cache e nenhum dado é compartilhado
+entre usuários.
+"""
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from civil_cultural.cache import get_entity_cache, is_cached
+from civil_cultural.models import Portal
+
+
+class ModelLoader(DataLoader):
+    """
+    Carrega objetos de um model pela chave primária.
+    Todas as chaves solicitadas no mesmo tick são resolvidas em uma
+    única consulta IN (...).
+    """
+    def __init__(self, model, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+
+    def batch_load_fn(self, keys):
+        if is_cached(self.model):
+            objects = get_entity_cache().get_many(self.model, keys)
+        else:
+            objects = self.model.objects.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+class MembershipLoader(DataLoader):
+    """
+    Verifica se um usuário é membro de portais, pelo id do portal.
+    Todos os portais solicitados no mesmo tick são verificados em uma
+    única consulta ao índice da tabela de membros.
+    """
+    def __init__(self, user, **kwargs):
+        super().__init__(**kwargs)
+        self.user = user
+
+    def batch_load_fn(self, keys):
+        members = set(
+            Portal.users.through.objects.filter(
+                user=self.user, portal_id__in=keys
+            ).values_list('portal_id', flat=True)
+        )
+        return Promise.resolve([key in members for key in keys])
+
+
+class Loaders:
+    """
+    Conjunto de loaders de uma requisição, criados sob demanda.
+    """
+    def __init__(self):
+        self._loaders = {}
+
+    def for_model(self, model):
+        """
+        Retorna o loader do model, criando-o no primeiro uso.
+
+        param model: <django.db.models.Model>
+        rtype: <ModelLoader>
+        """
+        if model not in self._loaders:
+            self._loaders[model] = ModelLoader(model)
+        return self._loaders[model]
+
+    def for_membership(self, user):
+        """
+        Retorna o loader de participação do usuário nos portais.
+
+        param user: <User>
+        rtype: <MembershipLoader>
+        """
+        key = ('membership', user.pk)
+        if key not in self._loaders:
+            self._loaders[key] = MembershipLoader(user)
+        return self._loaders[key]
+
+
+def get_loaders(context):
+    """
+    Retorna os loaders da requisição.
+    Caso o contexto não tenha passado pela view (ex.: schema.execute em
+    testes ou no shell), os loaders são criados no próprio contexto.
+
+    param context: <HttpRequest>
+    rtype: <Loaders>
+    """
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
+
+
+def load_related(info, instance, field_name):
+    """
+    Resolve a chave estrangeira `field_name` de `instance` através do
+    loader da requisição. Se o objeto relacionado já estiver em cache na
+    instância (ex.: select_related) ele é reaproveitado.
+
+    param info: <graphql.execution.base.ResolveInfo>
+    param instance: <django.db.models.Model>
+    param field_name: <str>
+    rtype: <Promise>
+    """
+    field = instance._meta.get_field(field_name)
+    if field.is_cached(instance):
+        return getattr(instance, field_name)
+
+    related_id = getattr(instance, field.attname)
+    if related_id is None:
+        return None
+
+    loader = get_loaders(info.context).for_model(field.related_model)
+    return loader.load(related_id)
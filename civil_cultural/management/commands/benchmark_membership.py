@@ -0,0 +1,105 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from civil_cultural.models import Portal
+from server.views import CivilGraphQLView
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a verificação de participação feita anteriormente por '
+        'JoinPortal/LeavePortal (carregando todos os membros do portal) com '
+        'a consulta de existência no índice da tabela de membros, e mede o '
+        'campo isMember em uma lista de portais. Os dados gerados são '
+        'descartados ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=1000000)
+        parser.add_argument('--portals', type=int, default=50)
+        parser.add_argument('--checks', type=int, default=1000)
+        parser.add_argument('--legacy-checks', type=int, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        start = time.perf_counter()
+        User = get_user_model()
+        User.objects.bulk_create(
+            (
+                User(username='benchmark-member-%s' % i, password='')
+                for i in range(options['members'])
+            )
+        )
+        members = User.objects.filter(username__startswith='benchmark-member-')
+        owner = members.first()
+        portal = Portal.objects.create(name='benchmark-membership', owner=owner)
+        Membership = Portal.users.through
+        Membership.objects.bulk_create(
+            (
+                Membership(portal=portal, user_id=user_id)
+                for user_id in members.values_list('pk', flat=True).iterator()
+            )
+        )
+        last = members.last()
+        outsider = User.objects.create(username='benchmark-outsider')
+
+        # portais pequenos onde o usuário é membro de metade
+        Portal.objects.bulk_create(
+            Portal(name='benchmark-membership-%s' % i, owner=owner)
+            for i in range(options['portals'])
+        )
+        portals = list(Portal.objects.filter(name__startswith='benchmark-membership-'))
+        Membership.objects.bulk_create(
+            Membership(portal=small, user=last) for small in portals[::2]
+        )
+        self.stdout.write('members: %s (setup %.1fs)' % (
+            options['members'], time.perf_counter() - start
+        ))
+
+        start = time.perf_counter()
+        for _ in range(options['legacy_checks']):
+            # verificação como era feita por JoinPortal/LeavePortal
+            last in portal.users.all()
+            outsider in portal.users.all()
+        legacy = (time.perf_counter() - start) / (2 * options['legacy_checks'])
+
+        start = time.perf_counter()
+        for _ in range(options['checks']):
+            portal.users.filter(pk=last.pk).exists()
+            portal.users.filter(pk=outsider.pk).exists()
+        indexed = (time.perf_counter() - start) / (2 * options['checks'])
+
+        self.stdout.write('user in portal.users.all(): %10.2fms/check' % (legacy * 1000))
+        self.stdout.write('indexed exists():           %10.3fms/check' % (indexed * 1000))
+
+        view = CivilGraphQLView.as_view()
+        factory = RequestFactory()
+        body = json.dumps({
+            'query': '{ portals(first: %s) { edges { node { name isMember '
+                     'membersCount } } } }' % (options['portals'] + 1)
+        })
+        with override_settings(TOKEN_BLACKLIST_FILTER_PATH=None):
+            start = time.perf_counter()
+            request = factory.post(
+                '/graphql/', body,
+                content_type='application/json',
+                HTTP_AUTHORIZATION='JWT token'
+            )
+            request.user = last
+            content = json.loads(view(request).content.decode())
+            elapsed = time.perf_counter() - start
+
+        nodes = [edge['node'] for edge in content['data']['portals']['edges']]
+        self.stdout.write('isMember on %s portals:    %10.2fms (%s memberships)' % (
+            len(nodes), elapsed * 1000, sum(node['isMember'] for node in nodes)
+        ))
@@ -0,0 +1,72 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from civil_cultural.models import Portal, News
+from civil_cultural.search import SearchIndex, document_key, document_fields
+
+
+WORDS = (
+    'portal', 'mage', 'dragon', 'council', 'election', 'river', 'festival',
+    'library', 'museum', 'theatre', 'music', 'science', 'history', 'school',
+    'market', 'harvest', 'bridge', 'tower', 'garden', 'citizen', 'law',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a busca pelo índice invertido com a filtragem de notícias '
+        'em Python feita anteriormente por resolve_news. Os dados gerados '
+        'são descartados ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--news', type=int, default=10000)
+        parser.add_argument('--words', type=int, default=200)
+        parser.add_argument('--queries', type=int, default=50)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        user = get_user_model().objects.create(username='benchmark-search')
+        portal = Portal.objects.create(name='benchmark-search', owner=user)
+        News.objects.bulk_create(
+            News(
+                title=' '.join(random.choices(WORDS, k=5)),
+                body=' '.join(random.choices(WORDS, k=options['words'])),
+                author=user,
+                portal_reference=portal,
+            )
+            for _ in range(options['news'])
+        )
+        queries = random.choices(WORDS, k=options['queries'])
+
+        start = time.perf_counter()
+        index = SearchIndex()
+        for news in News.objects.filter(portal_reference=portal):
+            index.add(document_key(news), *document_fields(news))
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for query in queries:
+            # filtragem em memória como era feita por resolve_news
+            news = News.objects.filter(portal_reference=portal)
+            [n for n in news if query.lower() in n.body.lower()]
+        legacy = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, portal.id)
+        indexed = (time.perf_counter() - start) / len(queries)
+
+        self.stdout.write('news: %s' % options['news'])
+        self.stdout.write('index build: %.3fs' % build)
+        self.stdout.write('python filter: %.2fms/query' % (legacy * 1000))
+        self.stdout.write('bm25 index: %.2fms/query' % (indexed * 1000))
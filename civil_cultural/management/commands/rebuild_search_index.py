@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from civil_cultural.search import compact, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice de busca de Notícias e Artigos a partir do banco.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--compact', action='store_true',
+            help='Somente incorpora o log de alterações ao índice, sem ler o banco.'
+        )
+
+    def handle(self, *args, **options):
+        if options['compact']:
+            if not compact():
+                self.stdout.write('Nothing to compact, or a compaction is running')
+                return
+            self.stdout.write('Compacted %s' % settings.SEARCH_INDEX_PATH)
+            return
+
+        index = rebuild()
+        self.stdout.write(
+            'Indexed %s documents into %s' % (len(index), settings.SEARCH_INDEX_PATH)
+        )
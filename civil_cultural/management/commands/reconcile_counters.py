@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from civil_cultural.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula os contadores agregados (membros, tópicos, notícias, '
+        'artigos, perguntas e respostas) e corrige os que divergem das '
+        'contagens reais. Deve ser executado periodicamente (ex.: cron).'
+    )
+
+    def handle(self, *args, **options):
+        for counter, fixed in reconcile().items():
+            self.stdout.write('%-26s %s fixed' % (counter, fixed))
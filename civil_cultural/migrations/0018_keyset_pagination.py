@@ -0,0 +1,105 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('civil_cultural', '0017_auto_20190927_0146'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='answer',
+            options={'ordering': ('-publish_datetime', '-id')},
+        ),
+        migrations.AlterModelOptions(
+            name='article',
+            options={'ordering': ('-publication_date', '-id')},
+        ),
+        migrations.AlterModelOptions(
+            name='news',
+            options={'ordering': ('-publication_date', '-id')},
+        ),
+        migrations.AlterModelOptions(
+            name='portal',
+            options={'ordering': ('-founding_datetime', '-id')},
+        ),
+        migrations.AlterModelOptions(
+            name='question',
+            options={'ordering': ('-publish_datetime', '-id')},
+        ),
+        migrations.AlterModelOptions(
+            name='rule',
+            options={'ordering': ('-creation_date', '-id')},
+        ),
+        migrations.AlterModelOptions(
+            name='similarsuggestion',
+            options={'ordering': ('-publish_datetime', '-id')},
+        ),
+        migrations.AlterModelOptions(
+            name='tag',
+            options={'ordering': ('-id',)},
+        ),
+        migrations.AlterModelOptions(
+            name='topic',
+            options={'ordering': ('-creation_datetime', '-id')},
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['publish_datetime', 'id'], name='civil_cultu_publish_44c606_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', 'publish_datetime', 'id'], name='civil_cultu_questio_5a0c1e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['publication_date', 'id'], name='civil_cultu_publica_3159c6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['published_topic', 'publication_date', 'id'], name='civil_cultu_publish_a51f1a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['publication_date', 'id'], name='civil_cultu_publica_5f04fc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['portal_reference', 'publication_date', 'id'], name='civil_cultu_portal__7c2bb1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='portal',
+            index=models.Index(fields=['founding_datetime', 'id'], name='civil_cultu_foundin_74179c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['publish_datetime', 'id'], name='civil_cultu_publish_bf8751_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['published_article', 'publish_datetime', 'id'], name='civil_cultu_publish_4056ea_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rule',
+            index=models.Index(fields=['creation_date', 'id'], name='civil_cultu_creatio_e28c20_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rule',
+            index=models.Index(fields=['portal_reference', 'creation_date', 'id'], name='civil_cultu_portal__4dab33_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='similarsuggestion',
+            index=models.Index(fields=['publish_datetime', 'id'], name='civil_cultu_publish_3d5054_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['creation_datetime', 'id'], name='civil_cultu_creatio_bbdbf3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['topic_portal', 'creation_datetime', 'id'], name='civil_cultu_topic_p_c0a3d4_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('civil_cultural', '0018_keyset_pagination'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_type', models.CharField(max_length=30)),
+                ('post_id', models.PositiveIntegerField()),
+                ('direction', models.SmallIntegerField(choices=[(1, 'up'), (-1, 'down')])),
+                ('vote_datetime', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('post_type', 'post_id', 'user')},
+            },
+        ),
+    ]
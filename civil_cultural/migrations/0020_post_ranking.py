@@ -0,0 +1,85 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:36
+
+import math
+from datetime import datetime, time, timezone
+
+from django.db import migrations, models
+
+
+# cópia de civil_cultural.ranking.hot_score no momento desta migration
+HOT_EPOCH = datetime(2019, 1, 1, tzinfo=timezone.utc)
+HOT_DECAY = 45000
+
+
+def hot_score(score, published):
+    if not isinstance(published, datetime):
+        published = datetime.combine(published, time.min, tzinfo=timezone.utc)
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    age = (published - HOT_EPOCH).total_seconds()
+    return round(sign * order + age / HOT_DECAY, 7)
+
+
+def rank_posts(apps, schema_editor):
+    for name in ('Article', 'News'):
+        model = apps.get_model('civil_cultural', name)
+        for post in model.objects.only('pro_votes', 'cons_votes', 'publication_date'):
+            score = post.pro_votes - post.cons_votes
+            model.objects.filter(pk=post.pk).update(
+                score=score, hot_score=hot_score(score, post.publication_date)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('civil_cultural', '0019_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['hot_score', 'id'], name='civil_cultu_hot_sco_5d61b5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['score', 'id'], name='civil_cultu_score_fd1d0d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['hot_score', 'id'], name='civil_cultu_hot_sco_3039ac_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['portal_reference', 'hot_score', 'id'], name='civil_cultu_portal__467a98_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['score', 'id'], name='civil_cultu_score_2a3e60_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['portal_reference', 'score', 'id'], name='civil_cultu_portal__00d0cd_idx'),
+        ),
+        migrations.RunPython(rank_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:38
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+# (model pai, contador, model filho, chave estrangeira do filho para o pai)
+COUNTERS = (
+    ('Portal', 'members_count', 'Portal_users', 'portal'),
+    ('Portal', 'topics_count', 'Topic', 'topic_portal'),
+    ('Portal', 'news_count', 'News', 'portal_reference'),
+    ('Topic', 'articles_count', 'Article', 'published_topic'),
+    ('Article', 'questions_count', 'Question', 'published_article'),
+    ('Question', 'answers_count', 'Answer', 'question'),
+)
+
+
+def count_children(apps, schema_editor):
+    for parent, counter, child, foreign_key in COUNTERS:
+        child = apps.get_model('civil_cultural', child)
+        count = Coalesce(
+            Subquery(
+                child.objects.filter(**{foreign_key: OuterRef('pk')})
+                .order_by()
+                .values(foreign_key)
+                .annotate(count=Count('pk'))
+                .values('count')
+            ),
+            Value(0)
+        )
+        apps.get_model('civil_cultural', parent).objects.update(**{counter: count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('civil_cultural', '0020_post_ranking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='questions_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='portal',
+            name='members_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='portal',
+            name='news_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='portal',
+            name='topics_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='articles_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_children, migrations.RunPython.noop),
+    ]
@@ -16,6 +16,10 @@ class Portal(models.Model):
     objetos. O portal conterá noticias, tópicos, regras próprias, assim como
     uma temática específica e membros participantes.
     """
+    class Meta:
+        ordering = ('-founding_datetime', '-id')
+        indexes = [models.Index(fields=['founding_datetime', 'id'])]
+
     name = models.CharField(
         max_length=100,
         blank=False,
@@ -36,6 +40,10 @@ class Portal(models.Model):
         on_delete=models.CASCADE,
         related_name='portal_owner'
     )
+    # contadores mantidos por civil_cultural.counters
+    members_count = models.IntegerField(default=0)
+    topics_count = models.IntegerField(default=0)
+    news_count = models.IntegerField(default=0)
 
 
 class Topic(models.Model):
@@ -44,6 +52,13 @@ class Topic(models.Model):
     Portal. Os Portais poderão ter tópicos diversos para diferentes assuntos
     onde serão publicados artigos relacionados à temática definida pelo Tópico.
     """
+    class Meta:
+        ordering = ('-creation_datetime', '-id')
+        indexes = [
+            models.Index(fields=['creation_datetime', 'id']),
+            models.Index(fields=['topic_portal', 'creation_datetime', 'id']),
+        ]
+
     name = models.CharField(
         max_length=100,
         blank=False,
@@ -65,6 +80,8 @@ class Topic(models.Model):
         'civil_cultural.Portal',
         on_delete=models.CASCADE,
     )
+    # contador mantido por civil_cultural.counters
+    articles_count = models.IntegerField(default=0)
     # TODO - add Tag
 
 
@@ -76,6 +93,15 @@ class Article(models.Model):
     Um artigo pode conter perguntas realizadas por membros do Portal, que
     poderão ser respondidas e classificadas por votos.
     """
+    class Meta:
+        ordering = ('-publication_date', '-id')
+        indexes = [
+            models.Index(fields=['publication_date', 'id']),
+            models.Index(fields=['published_topic', 'publication_date', 'id']),
+            models.Index(fields=['hot_score', 'id']),
+            models.Index(fields=['score', 'id']),
+        ]
+
     title = models.CharField(
         max_length=100,
         blank=False,
@@ -105,6 +131,9 @@ class Article(models.Model):
     references = models.TextField()
     pro_votes = models.IntegerField(default=0)
     cons_votes = models.IntegerField(default=0)
+    # pontuações mantidas por civil_cultural.ranking
+    score = models.IntegerField(default=0)
+    hot_score = models.FloatField(default=0)
     publication_date = models.DateField(
         auto_now_add=True
     )
@@ -118,6 +147,8 @@ class Article(models.Model):
         'civil_cultural.Topic',
         on_delete=models.CASCADE
     )
+    # contador mantido por civil_cultural.counters
+    questions_count = models.IntegerField(default=0)
 
 
 class SimilarSuggestion(models.Model):
@@ -128,6 +159,8 @@ class SimilarSuggestion(models.Model):
     """
     class Meta:
         unique_together = ('link', 'post_key')
+        ordering = ('-publish_datetime', '-id')
+        indexes = [models.Index(fields=['publish_datetime', 'id'])]
 
     post_author = models.ForeignKey(
         get_user_model(),
@@ -154,6 +187,13 @@ class Question(models.Model):
     Uma questão (pergunta) é uma publicação em um artigo para resolução de
     dúvidas que o artigo possa ter levantado.
     """ 
+    class Meta:
+        ordering = ('-publish_datetime', '-id')
+        indexes = [
+            models.Index(fields=['publish_datetime', 'id']),
+            models.Index(fields=['published_article', 'publish_datetime', 'id']),
+        ]
+
     post_author = models.ForeignKey(
         get_user_model(),
         on_delete=models.CASCADE,
@@ -173,6 +213,8 @@ class Question(models.Model):
         'civil_cultural.Article',
         on_delete=models.CASCADE
     )
+    # contador mantido por civil_cultural.counters
+    answers_count = models.IntegerField(default=0)
     # answers = models.ManyToManyField('civil_cultural.Answer')
 
 
@@ -201,6 +243,11 @@ class Rule(models.Model):
     """
     class Meta:
         unique_together = ('description', 'portal_reference')
+        ordering = ('-creation_date', '-id')
+        indexes = [
+            models.Index(fields=['creation_date', 'id']),
+            models.Index(fields=['portal_reference', 'creation_date', 'id']),
+        ]
 
     description = models.CharField(
         max_length=400,
@@ -221,6 +268,9 @@ class Tag(models.Model):
     Uma tag é um marcador que classifica uma publicação de acordo com
     uma temática, é utilizada para filtrar elementos no sistema.
     """
+    class Meta:
+        ordering = ('-id',)
+
     reference = models.CharField(
         max_length=80,
         blank=False,
@@ -233,10 +283,24 @@ class News(models.Model):
     """
     Modelo de dados para publicação de uma notícia.
     """
+    class Meta:
+        ordering = ('-publication_date', '-id')
+        indexes = [
+            models.Index(fields=['publication_date', 'id']),
+            models.Index(fields=['portal_reference', 'publication_date', 'id']),
+            models.Index(fields=['hot_score', 'id']),
+            models.Index(fields=['portal_reference', 'hot_score', 'id']),
+            models.Index(fields=['score', 'id']),
+            models.Index(fields=['portal_reference', 'score', 'id']),
+        ]
+
     title = models.CharField(max_length=100, null=False, blank=False)
     body = models.TextField(null=False, blank=False)
     pro_votes = models.IntegerField(default=0)
     cons_votes = models.IntegerField(default=0)
+    # pontuações mantidas por civil_cultural.ranking
+    score = models.IntegerField(default=0)
+    hot_score = models.FloatField(default=0)
     publication_date = models.DateTimeField(auto_now_add=True)
     similar_suggestions = models.ManyToManyField(SimilarSuggestion)
     author = models.ForeignKey(
@@ -251,6 +315,13 @@ class Answer(models.Model):
     """
     Definição de uma resposta à uma questão que tenha sido publicada.
     """
+    class Meta:
+        ordering = ('-publish_datetime', '-id')
+        indexes = [
+            models.Index(fields=['publish_datetime', 'id']),
+            models.Index(fields=['question', 'publish_datetime', 'id']),
+        ]
+
     question = models.ForeignKey(
         Question,
         on_delete=models.CASCADE
@@ -268,3 +339,29 @@ class Answer(models.Model):
     publish_datetime = models.DateTimeField(
         auto_now_add=True
     )
+
+
+class Vote(models.Model):
+    """
+    Voto de um usuário em uma publicação (Artigo, Notícia, Pergunta,
+    Resposta ou Sugestão similar). Cada usuário tem no máximo um voto por
+    publicação; os totais ficam nos campos pro_votes e cons_votes da
+    própria publicação (ver civil_cultural.votes).
+    """
+    UP = 1
+    DOWN = -1
+    DIRECTIONS = ((UP, 'up'), (DOWN, 'down'))
+
+    class Meta:
+        unique_together = ('post_type', 'post_id', 'user')
+
+    user = models.ForeignKey(
+        get_user_model(),
+        on_delete=models.CASCADE
+    )
+    post_type = models.CharField(max_length=30)
+    post_id = models.PositiveIntegerField()
+    direction = models.SmallIntegerField(choices=DIRECTIONS)
+    vote_datetime = models.DateTimeField(
+        auto_now=True
+    )
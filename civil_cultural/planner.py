@@ -0,0 +1,285 @@
+"""
+Planejador de consultas da aplicação civil-cultural.
+Este módulo contém:
+    - O mapeamento entre campos GraphQL e relações do ORM;
+    - A leitura do conjunto de seleção (selection set) de uma consulta;
+    - A aplicação de select_related/prefetch_related sobre um queryset
+      de acordo com os campos selecionados;
+    - A projeção de colunas, adiando o carregamento de textos grandes e
+      de colunas sensíveis que não foram selecionados;
+    - As conexões aninhadas, carregadas para toda a página de objetos pais
+      depois que ela é lida (ver civil_cultural.fields).
+
+Com o plano aplicado antes da paginação, uma árvore de Portais com seus
+tópicos, artigos, perguntas e respostas é resolvida com um número fixo de
+consultas, independente da quantidade de linhas retornadas. As conexões
+aninhadas não são carregadas por inteiro: cada objeto pai recebe apenas a
+página pedida em first/last.
+"""
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import ast
+
+from civil_cultural.models import (Portal, Topic, Article, Question, Rule,
+                                   SimilarSuggestion, News, Answer)
+
+
+# lookup: caminho da relação no ORM
+# model: model do objeto relacionado
+# many: relação reversa ou many-to-many (prefetch_related)
+# connection: o campo GraphQL é uma conexão relay (edges { node })
+Relation = namedtuple('Relation', 'lookup model many connection')
+
+# path: relações percorridas a partir dos objetos da página até os objetos
+#       pais da conexão
+# lookup: caminho da relação no ORM, a partir do objeto pai
+# queryset: queryset planejado dos objetos da conexão
+# connections: conexões aninhadas nos objetos da conexão
+# arguments: argumentos de paginação do campo (first, last, after, before)
+Connection = namedtuple(
+    'Connection', 'path lookup queryset connections arguments'
+)
+
+PAGINATION_ARGUMENTS = ('first', 'last', 'after', 'before')
+
+RELATIONS = {
+    Portal: {
+        'topics': Relation('topic_set', Topic, True, True),
+        'news': Relation('news_set', News, True, True),
+        'rules': Relation('rule_set', Rule, True, True),
+        'members': Relation('users', get_user_model(), True, True),
+        'owner': Relation('owner', get_user_model(), False, False),
+    },
+    Topic: {
+        'portal': Relation('topic_portal', Portal, False, False),
+        'articles': Relation('article_set', Article, True, False),
+    },
+    Article: {
+        'post_author': Relation('post_author', get_user_model(), False, False),
+        'questions': Relation('question_set', Question, True, True),
+        'similar_suggestions': Relation(
+            'similar_suggestions', SimilarSuggestion, True, True
+        ),
+    },
+    Question: {
+        'post_author': Relation('post_author', get_user_model(), False, False),
+        'article': Relation('published_article', Article, False, False),
+        'answers': Relation('answer_set', Answer, True, True),
+    },
+    Rule: {
+        'portal': Relation('portal_reference', Portal, False, False),
+    },
+    News: {
+        'author': Relation('author', get_user_model(), False, False),
+        'portal': Relation('portal_reference', Portal, False, False),
+        'similar_suggestions': Relation(
+            'similar_suggestions', SimilarSuggestion, True, True
+        ),
+    },
+    SimilarSuggestion: {
+        'post_author': Relation('post_author', get_user_model(), False, False),
+    },
+    Answer: {
+        'post_author': Relation('author', get_user_model(), False, False),
+        'question': Relation('question', Question, False, False),
+    },
+}
+
+# Colunas de texto grandes, e as colunas de usuário que não precisam sair
+# do banco, que só são carregadas quando selecionadas.
+# O nome do campo GraphQL é o mesmo do campo no model.
+DEFERRABLE = {
+    Article: ('abstract', 'body', 'references'),
+    News: ('body',),
+    get_user_model(): (
+        'password', 'last_login', 'is_superuser', 'first_name', 'last_name',
+        'email', 'is_staff', 'is_active', 'date_joined'
+    ),
+}
+
+
+def _collect(info, selection_set, fields):
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            name = to_snake_case(selection.name.value)
+            fields.setdefault(name, []).append(selection)
+
+        elif isinstance(selection, ast.FragmentSpread):
+            fragment = info.fragments[selection.name.value]
+            _collect(info, fragment.selection_set, fields)
+
+        elif isinstance(selection, ast.InlineFragment):
+            _collect(info, selection.selection_set, fields)
+
+
+def collect_fields(info, field_nodes):
+    """
+    Agrupa pelo nome (snake_case) os campos selecionados abaixo dos nós
+    informados, expandindo fragmentos.
+
+    param info: <graphql.execution.base.ResolveInfo>
+    param field_nodes: <list> nós ast.Field
+    rtype: <dict> nome do campo -> lista de nós ast.Field
+    """
+    fields = {}
+    for node in field_nodes:
+        if node.selection_set:
+            _collect(info, node.selection_set, fields)
+    return fields
+
+
+def node_fields(info, field_nodes):
+    """
+    Retorna os campos selecionados em `edges { node { ... } }` de uma
+    conexão relay.
+
+    param info: <graphql.execution.base.ResolveInfo>
+    param field_nodes: <list> nós ast.Field da conexão
+    rtype: <dict>
+    """
+    edges = collect_fields(info, field_nodes).get('edges', [])
+    return collect_fields(info, collect_fields(info, edges).get('node', []))
+
+
+def _value(info, value):
+    if isinstance(value, ast.Variable):
+        return info.variable_values.get(value.name.value)
+    if isinstance(value, ast.IntValue):
+        return int(value.value)
+    return getattr(value, 'value', None)
+
+
+def connection_arguments(info, field_nodes):
+    """
+    Retorna os argumentos de paginação de uma conexão aninhada.
+    Uma conexão com outros argumentos (ex.: orderBy), ou selecionada mais
+    de uma vez com argumentos diferentes, não é carregada pelo plano: o
+    seu resolver a pagina no banco para cada objeto pai.
+
+    param info: <graphql.execution.base.ResolveInfo>
+    param field_nodes: <list> nós ast.Field da conexão
+    rtype: <dict> ou None
+    """
+    found = []
+    for node in field_nodes:
+        arguments = {}
+        for argument in node.arguments:
+            name = argument.name.value
+            if name not in PAGINATION_ARGUMENTS:
+                return None
+            arguments[name] = _value(info, argument.value)
+        found.append(arguments)
+
+    if any(arguments != found[0] for arguments in found):
+        return None
+    return found[0]
+
+
+def plan(model, info, fields):
+    """
+    Calcula as relações a serem carregadas para os campos selecionados.
+
+    param model: <django.db.models.Model>
+    param info: <graphql.execution.base.ResolveInfo>
+    param fields: <dict> retorno de collect_fields/node_fields
+    rtype: <tuple> (lookups select_related, lista de Prefetch, campos
+           adiados, lista de Connection)
+    """
+    select_related, prefetch_related, connections = [], [], []
+    deferred = [
+        name for name in DEFERRABLE.get(model, ()) if name not in fields
+    ]
+
+    for name, relation in RELATIONS.get(model, {}).items():
+        if name not in fields:
+            continue
+
+        if relation.connection:
+            child_fields = node_fields(info, fields[name])
+        else:
+            child_fields = collect_fields(info, fields[name])
+
+        if relation.many and relation.connection:
+            # carregada depois da página de objetos pais, limitada a
+            # first/last objetos por pai
+            arguments = connection_arguments(info, fields[name])
+            if arguments is not None:
+                queryset, child_connections = optimize(
+                    relation.model.objects.all(), info, child_fields
+                )
+                connections.append(Connection(
+                    (), relation.lookup, queryset, child_connections, arguments
+                ))
+            continue
+
+        if relation.many:
+            queryset, child_connections = optimize(
+                relation.model.objects.all(), info, child_fields
+            )
+            prefetch_related.append(
+                Prefetch(relation.lookup, queryset=queryset)
+            )
+            connections += [
+                connection._replace(path=(relation.lookup,) + connection.path)
+                for connection in child_connections
+            ]
+            continue
+
+        # relações diretas entram no JOIN, e o que for selecionado abaixo
+        # delas é planejado a partir do mesmo queryset
+        select_related.append(relation.lookup)
+        child_select, child_prefetch, child_deferred, child_connections = (
+            plan(relation.model, info, child_fields)
+        )
+        select_related += [
+            '%s__%s' % (relation.lookup, lookup) for lookup in child_select
+        ]
+        deferred += [
+            '%s__%s' % (relation.lookup, name) for name in child_deferred
+        ]
+        prefetch_related += [
+            Prefetch(
+                '%s__%s' % (relation.lookup, prefetch.prefetch_through),
+                queryset=prefetch.queryset
+            )
+            for prefetch in child_prefetch
+        ]
+        connections += [
+            connection._replace(path=(relation.lookup,) + connection.path)
+            for connection in child_connections
+        ]
+
+    return select_related, prefetch_related, deferred, connections
+
+
+def optimize(queryset, info, fields=None):
+    """
+    Aplica select_related/prefetch_related e adia as colunas grandes não
+    selecionadas de acordo com os campos da consulta.
+    Se `fields` não for informado, considera-se que o campo em resolução
+    é uma conexão relay do model do queryset.
+
+    As conexões aninhadas são retornadas à parte, para serem carregadas
+    com civil_cultural.fields.prefetch_connections sobre os objetos lidos.
+
+    param queryset: <django.db.models.QuerySet>
+    param info: <graphql.execution.base.ResolveInfo>
+    param fields: <dict>
+    rtype: <tuple> (<django.db.models.QuerySet>, lista de Connection)
+    """
+    if fields is None:
+        fields = node_fields(info, info.field_asts)
+
+    select_related, prefetch_related, deferred, connections = plan(
+        queryset.model, info, fields
+    )
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    if deferred:
+        queryset = queryset.defer(*deferred)
+    return queryset, connections
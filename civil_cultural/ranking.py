@@ -0,0 +1,83 @@
+"""
+Classificação das Notícias e Artigos.
+
+Cada publicação guarda a sua pontuação (votos a favor menos votos contra,
+campo score) e a pontuação "hot", que combina a pontuação com a data de
+publicação. As duas colunas são indexadas e atualizadas a cada voto e a
+cada save(), então as ordenações HOT e TOP são leituras de um intervalo
+do índice, sem calcular nada no momento da consulta.
+
+A pontuação hot não precisa ser recalculada com o passar do tempo: a
+idade entra como um deslocamento fixo da data de publicação, e cada
+HOT_DECAY segundos mais nova vale tanto quanto 10 vezes mais votos.
+"""
+import math
+from datetime import datetime, time, timezone
+
+from civil_cultural.models import Article, News
+
+
+# data de referência das pontuações hot
+HOT_EPOCH = datetime(2019, 1, 1, tzinfo=timezone.utc)
+# segundos de idade equivalentes a um fator 10 nos votos (12,5 horas)
+HOT_DECAY = 45000
+
+RANKED_MODELS = (Article, News)
+
+
+ORDERINGS = {
+    'hot': ('-hot_score', '-id'),
+    'top': ('-score', '-id'),
+}
+
+
+def hot_score(score, published):
+    """
+    Pontuação hot de uma publicação.
+
+    param score: <int> votos a favor menos votos contra
+    param published: <datetime> ou <date> data de publicação
+    rtype: <float>
+    """
+    if not isinstance(published, datetime):
+        published = datetime.combine(published, time.min, tzinfo=timezone.utc)
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    age = (published - HOT_EPOCH).total_seconds()
+    return round(sign * order + age / HOT_DECAY, 7)
+
+
+def rank(instance):
+    """
+    Atualiza as pontuações de uma Notícia ou Artigo a partir dos votos.
+    Publicações ainda não gravadas são pontuadas pela data que o
+    auto_now_add vai gravar (um Artigo guarda somente o dia), então as
+    pontuações recalculadas depois partem da mesma data.
+
+    param instance: <Article> ou <News>
+    """
+    if instance.publication_date is None:
+        instance._meta.get_field('publication_date').pre_save(instance, add=True)
+    published = instance.publication_date
+    instance.score = instance.pro_votes - instance.cons_votes
+    instance.hot_score = hot_score(instance.score, published)
+
+
+def order_posts(queryset, order):
+    """
+    Ordena Notícias ou Artigos. Um queryset já carregado (ex.: vindo de um
+    prefetch) mantém as linhas carregadas e é ordenado em memória pela
+    conexão.
+
+    param queryset: <django.db.models.QuerySet>
+    param order: <str> 'hot', 'top' ou 'new' (ordem padrão)
+    rtype: <django.db.models.QuerySet>
+    """
+    if order not in ORDERINGS:
+        return queryset
+
+    ordered = queryset.order_by(*ORDERINGS[order])
+    if queryset._result_cache is not None:
+        ordered._result_cache = queryset._result_cache
+        ordered._prefetch_done = queryset._prefetch_done
+    return ordered
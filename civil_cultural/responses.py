@@ -0,0 +1,221 @@
+"""
+Cache de respostas inteiras das consultas GraphQL.
+
+Ativado pela setting GRAPHQL_RESPONSE_CACHE, guarda no cache do Django
+(GRAPHQL_RESPONSE_CACHE_ALIAS) o resultado das consultas (query) que
+terminam sem erros. A chave da resposta é formada por:
+    - A consulta normalizada: espaços, comentários e a formatação não
+      fazem diferença;
+    - O nome da operação e as variáveis;
+    - O escopo de visibilidade do usuário: usuários com acesso veem os
+      mesmos dados, exceto nos campos que dependem do usuário (ex.:
+      isMember), quando a resposta é guardada por usuário.
+
+Cada resposta é marcada com os models dos tipos GraphQL da consulta
+(tags) e guarda a versão de cada tag lida antes da execução. As alterações
+nos models (ver civil_cultural.signals e civil_cultural.counters) trocam a
+versão das suas tags, então uma mutation só descarta as respostas que
+leram os models alterados por ela.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from graphql import parse, print_ast
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult
+from graphql.language import ast
+from graphql.language.visitor import TypeInfoVisitor, Visitor, visit
+from graphql.type import GraphQLInterfaceType, GraphQLUnionType, get_named_type
+from graphql.utils.type_info import TypeInfo
+
+from civil_cultural.versions import change_version, get_versions
+from users.utils import get_access_error
+
+
+# tipo GraphQL -> labels dos models lidos pelos seus campos
+TYPE_TAGS = {
+    'PortalType': ('civil_cultural.portal',),
+    'TopicType': ('civil_cultural.topic',),
+    'ArticleType': ('civil_cultural.article',),
+    'QuestionType': ('civil_cultural.question',),
+    'AnswerType': ('civil_cultural.answer',),
+    'TagType': ('civil_cultural.tag',),
+    'RuleType': ('civil_cultural.rule',),
+    'NewsType': ('civil_cultural.news',),
+    'SimilarSuggestionType': ('civil_cultural.similarsuggestion',),
+    'SearchHitType': ('civil_cultural.article', 'civil_cultural.news'),
+    'UserType': (get_user_model()._meta.label_lower,),
+}
+
+TAGGED_LABELS = {label for labels in TYPE_TAGS.values() for label in labels}
+
+# campos da Query com métricas do worker, que nunca são guardados
+UNCACHED_FIELDS = {'chatbotStats', 'entityCacheStats'}
+
+# campos cujo valor depende do usuário da requisição
+VIEWER_FIELDS = {('PortalType', 'isMember')}
+
+
+class _QueryVisitor(Visitor):
+    """
+    Coleta as tags e as características dos campos de um documento.
+    """
+    def __init__(self, schema, type_info):
+        self.schema = schema
+        self.type_info = type_info
+        self.tags = set()
+        self.viewer = False
+        self.cacheable = True
+
+    def enter_Field(self, node, *args):
+        parent = self.type_info.get_parent_type()
+        name = node.name.value
+        if parent is self.schema.get_query_type() and name in UNCACHED_FIELDS:
+            self.cacheable = False
+        if parent is not None and (parent.name, name) in VIEWER_FIELDS:
+            self.viewer = True
+
+        field_type = self.type_info.get_type()
+        if field_type is None:
+            return
+        named_type = get_named_type(field_type)
+        types = [named_type]
+        if isinstance(named_type, (GraphQLInterfaceType, GraphQLUnionType)):
+            types = self.schema.get_possible_types(named_type)
+        for graphql_type in types:
+            self.tags.update(TYPE_TAGS.get(graphql_type.name, ()))
+
+
+def analyze(schema, document):
+    """
+    Analisa os campos de um documento GraphQL.
+
+    param schema: <graphql.type.GraphQLSchema>
+    param document: <graphql.language.ast.Document>
+    rtype: <tuple> (tags, se algum campo depende do usuário, se a resposta
+           pode ser guardada)
+    """
+    type_info = TypeInfo(schema)
+    visitor = _QueryVisitor(schema, type_info)
+    visit(document, TypeInfoVisitor(type_info, visitor))
+    return visitor.tags, visitor.viewer, visitor.cacheable
+
+
+def get_operation(document, operation_name):
+    """
+    param document: <graphql.language.ast.Document>
+    param operation_name: <str>
+    rtype: <graphql.language.ast.OperationDefinition> operação executada,
+           ou None se não houver uma única operação com esse nome
+    """
+    operations = [
+        definition for definition in document.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    ]
+    if operation_name is None:
+        return operations[0] if len(operations) == 1 else None
+    for operation in operations:
+        if operation.name and operation.name.value == operation_name:
+            return operation
+    return None
+
+
+def _get_cache():
+    return caches[settings.GRAPHQL_RESPONSE_CACHE_ALIAS]
+
+
+def _tag_key(label):
+    return 'response-tag:%s' % label
+
+
+def response_key(document, operation_name, variables, scope):
+    """
+    param document: <graphql.language.ast.Document>
+    param operation_name: <str>
+    param variables: <dict>
+    param scope: <str> escopo de visibilidade do usuário
+    rtype: <str>
+    """
+    payload = json.dumps(
+        [print_ast(document), operation_name, variables or {}, scope],
+        sort_keys=True,
+        default=str
+    )
+    return 'response:%s' % hashlib.sha256(payload.encode()).hexdigest()
+
+
+def tag_versions(tags):
+    """
+    Versões atuais das tags. Versões ausentes são criadas.
+
+    param tags: <set> labels de models
+    rtype: <dict> chave da tag -> versão
+    """
+    keys = [_tag_key(label) for label in sorted(tags)]
+    return get_versions(_get_cache(), keys)
+
+
+def execute_cached(schema, request, query, variables, operation_name, execute):
+    """
+    Executa uma operação GraphQL através do cache de respostas. Mutations,
+    consultas com campos que não podem ser guardados e documentos
+    inválidos são executados sem o cache.
+
+    param schema: <graphql.type.GraphQLSchema>
+    param request: <HttpRequest>
+    param query: <str>
+    param variables: <dict>
+    param operation_name: <str>
+    param execute: <function> executa a operação sem o cache
+    rtype: <graphql.execution.ExecutionResult>
+    """
+    try:
+        document = parse(query)
+    except GraphQLError:
+        # o erro de sintaxe é informado pela execução sem o cache
+        return execute()
+
+    operation = get_operation(document, operation_name)
+    if operation is None or operation.operation != 'query':
+        return execute()
+
+    tags, viewer, cacheable = analyze(schema, document)
+    if not cacheable:
+        return execute()
+
+    scope = get_access_error(request) or 'authenticated'
+    if viewer and scope == 'authenticated':
+        scope = 'user:%s' % request.user.pk
+
+    cache = _get_cache()
+    key = response_key(document, operation_name, variables, scope)
+    entry = cache.get(key)
+    if entry is not None:
+        versions, data = entry
+        if cache.get_many(list(versions)) == versions:
+            return ExecutionResult(data=data)
+
+    # versões lidas antes da execução: uma alteração feita durante a
+    # execução invalida a resposta guardada em seguida
+    versions = tag_versions(tags)
+    result = execute()
+    if not result.errors and not result.invalid:
+        cache.set(key, (versions, result.data), settings.GRAPHQL_RESPONSE_CACHE_TTL)
+    return result
+
+
+def evict(model):
+    """
+    Descarta as respostas que leram o model, trocando a versão da sua tag
+    (ver civil_cultural.versions.change_version).
+
+    param model: <django.db.models.Model>
+    """
+    label = model._meta.label_lower
+    if not settings.GRAPHQL_RESPONSE_CACHE or label not in TAGGED_LABELS:
+        return
+
+    change_version(_get_cache(), _tag_key(label))
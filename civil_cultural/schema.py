@@ -11,19 +11,44 @@ Este módulo contém:
 By: BeelzeBruno <brunolcarli@gmail.com>
 """
 import graphene
+from django.db import transaction
+from django.db.models import Q
 from graphql_relay import from_global_id
 
 from users.schema import UserType, UserConnection
 from civil_cultural.models import (Portal, Topic, Article, Question, Tag, Rule,
-                                    SimilarSuggestion, News, Answer)
+                                    SimilarSuggestion, News, Answer, Vote)
 
 from users.utils import access_required
+from civil_cultural.cache import get_entity_cache
+from civil_cultural.loaders import load_related, get_loaders
+from civil_cultural.search import HIT_ORDERING, search
+from civil_cultural.fields import KeysetList, QuerySetConnectionField
+from civil_cultural.ranking import order_posts
+from civil_cultural.votes import cast_vote, save_content
 
 
 
 ##########################################################################
 # GraphQl Objects
 ##########################################################################
+class PostOrder(graphene.Enum):
+    """
+    Ordering of news and articles.
+    """
+    HOT = 'hot'
+    TOP = 'top'
+    NEW = 'new'
+
+    @property
+    def description(self):
+        if self == PostOrder.HOT:
+            return 'Most voted recent posts first.'
+        if self == PostOrder.TOP:
+            return 'Most voted posts first.'
+        return 'Most recent posts first.'
+
+
 class PortalType(graphene.ObjectType):
     """
     Defines a GraphQl Portal object.
@@ -33,10 +58,19 @@ class PortalType(graphene.ObjectType):
 
     name = graphene.String()
     founding_datetime = graphene.DateTime()
-    topics = graphene.ConnectionField('civil_cultural.schema.TopicConnection')
-    news = graphene.ConnectionField('civil_cultural.schema.NewsConnection')
-    rules = graphene.ConnectionField('civil_cultural.schema.RuleConnection')
-    members = graphene.ConnectionField(UserConnection)
+    topics = QuerySetConnectionField('civil_cultural.schema.TopicConnection')
+    news = QuerySetConnectionField(
+        'civil_cultural.schema.NewsConnection',
+        order_by=PostOrder(description='Defaults to NEW.')
+    )
+    rules = QuerySetConnectionField('civil_cultural.schema.RuleConnection')
+    members = QuerySetConnectionField(UserConnection)
+    members_count = graphene.Int(description='Number of members.')
+    is_member = graphene.Boolean(
+        description='Whether the current user is a member of the portal.'
+    )
+    topics_count = graphene.Int(description='Number of topics.')
+    news_count = graphene.Int(description='Number of news.')
     is_public = graphene.Boolean()
     # TODO - add Chat
     # TODO - add Tags
@@ -49,11 +83,20 @@ class PortalType(graphene.ObjectType):
         return self.rule_set.all()
 
     def resolve_news(self, info, **kwargs):
-        return self.news_set.all()
+        return order_posts(self.news_set.all(), kwargs.get('order_by'))
 
     def resolve_members(self, info, **kwargs):
         return self.users.all()
 
+    def resolve_is_member(self, info, **kwargs):
+        user = info.context.user
+        if user.is_anonymous:
+            return False
+        return get_loaders(info.context).for_membership(user).load(self.pk)
+
+    def resolve_owner(self, info, **kwargs):
+        return load_related(info, self, 'owner')
+
 
 class PortalConnection(graphene.relay.Connection):
     class Meta:
@@ -78,9 +121,10 @@ class TopicType(graphene.ObjectType):
     articles = graphene.List(
         'civil_cultural.schema.ArticleType'
     )
+    articles_count = graphene.Int(description='Number of articles.')
 
     def resolve_portal(self, info, **kwargs):
-        return self.topic_portal
+        return load_related(info, self, 'topic_portal')
 
     def resolve_articles(self, info, **kwargs):
         return self.article_set.all()
@@ -111,16 +155,21 @@ class ArticleType(graphene.ObjectType):
     body = graphene.String()
     pro_votes = graphene.Int()
     cons_votes = graphene.Int()
+    score = graphene.Int(description='Positive minus negative votes.')
     references = graphene.String()
-    questions = graphene.ConnectionField(
+    questions = QuerySetConnectionField(
         'civil_cultural.schema.QuestionConnection'
     )
+    questions_count = graphene.Int(description='Number of questions.')
     # TODO add tags
     # TODO reports
-    similar_suggestions = graphene.ConnectionField(
+    similar_suggestions = QuerySetConnectionField(
         'civil_cultural.schema.SimilarSuggestionConnection'
     )
 
+    def resolve_post_author(self, info, **kwargs):
+        return load_related(info, self, 'post_author')
+
     def resolve_article_authors(self, info, **kwargs):
         return [author for author in self.article_authors.split(';')]
 
@@ -153,12 +202,16 @@ class QuestionType(graphene.ObjectType):
     cons_votes = graphene.Int()
     publish_datetime = graphene.DateTime()
     article = graphene.Field('civil_cultural.schema.ArticleType')
-    answers = graphene.relay.ConnectionField(
+    answers = QuerySetConnectionField(
         'civil_cultural.schema.AnswerConnection'
     )
+    answers_count = graphene.Int(description='Number of answers.')
+
+    def resolve_post_author(self, info, **kwargs):
+        return load_related(info, self, 'post_author')
 
     def resolve_article(self, info, **kwargs):
-        return self.published_article
+        return load_related(info, self, 'published_article')
 
     def resolve_answers(self, info, **kwargs):
         return self.answer_set.all()
@@ -198,7 +251,7 @@ class RuleType(graphene.ObjectType):
     portal = graphene.Field(PortalType)
 
     def resolve_portal(self, info, **kwargs):
-        return self.portal_reference
+        return load_related(info, self, 'portal_reference')
 
 
 class RuleConnection(graphene.relay.Connection):
@@ -226,6 +279,9 @@ class NewsType(graphene.ObjectType):
     cons_votes = graphene.Int(
         description='Negative otes this news has received.'
     )
+    score = graphene.Int(
+        description='Positive minus negative votes.'
+    )
     publication_date = graphene.DateTime(
         description='Publish datetime.'
     )
@@ -236,13 +292,16 @@ class NewsType(graphene.ObjectType):
     portal = graphene.Field(
         PortalType
     )
-    similar_suggestions = graphene.ConnectionField(
+    similar_suggestions = QuerySetConnectionField(
         'civil_cultural.schema.SimilarSuggestionConnection'
     )
     # TODO question
 
+    def resolve_author(self, info, **kwargs):
+        return load_related(info, self, 'author')
+
     def resolve_portal(self, info, **Kwargs):
-        return self.portal_reference
+        return load_related(info, self, 'portal_reference')
 
     def resolve_similar_suggestions(self, info, **kwargs):
         return self.similar_suggestions.all()
@@ -273,6 +332,9 @@ class SimilarSuggestionType(graphene.ObjectType):
     cons_votes = graphene.Int()
     publish_datetime = graphene.DateTime()
 
+    def resolve_post_author(self, info, **kwargs):
+        return load_related(info, self, 'post_author')
+
 
 class SimilarSuggestionConnection(graphene.relay.Connection):
     class Meta:
@@ -298,10 +360,10 @@ class AnswerType(graphene.ObjectType):
     )
 
     def resolve_question(self, info, **kwargs):
-        return self.question
+        return load_related(info, self, 'question')
 
     def resolve_post_author(self, info, **kwargs):
-        return self.author
+        return load_related(info, self, 'author')
 
 
 class AnswerConnection(graphene.relay.Connection):
@@ -309,6 +371,79 @@ class AnswerConnection(graphene.relay.Connection):
         node = AnswerType
 
 
+class SearchResult(graphene.Union):
+    """
+    Publicação encontrada pela busca textual.
+    """
+    class Meta:
+        types = (NewsType, ArticleType)
+
+    @classmethod
+    def resolve_type(cls, instance, info):
+        if isinstance(instance, News):
+            return NewsType
+        return ArticleType
+
+
+class SearchHitType(graphene.ObjectType):
+    """
+    Defines a search result GraphQl object.
+    """
+    score = graphene.Float(description='BM25 relevance score.')
+    post = graphene.Field(SearchResult)
+
+    def resolve_post(self, info, **kwargs):
+        return get_loaders(info.context).for_model(self.model).load(self.pk)
+
+
+class SearchHitConnection(graphene.relay.Connection):
+    class Meta:
+        node = SearchHitType
+
+
+class EntityCacheStatsType(graphene.ObjectType):
+    """
+    Métricas do cache de objetos deste worker.
+    """
+    local_hits = graphene.Int(description='Objects served by the worker cache.')
+    shared_hits = graphene.Int(description='Objects served by the shared cache.')
+    misses = graphene.Int(description='Objects read from the database.')
+    invalidations = graphene.Int()
+    local_size = graphene.Int(description='Objects currently in the worker cache.')
+    hit_ratio = graphene.Float(description='Hits over all lookups.')
+
+
+class VotedPost(graphene.Union):
+    """
+    Publicação que pode receber votos.
+    """
+    class Meta:
+        types = (ArticleType, NewsType, QuestionType, AnswerType,
+                 SimilarSuggestionType)
+
+    @classmethod
+    def resolve_type(cls, instance, info):
+        return VOTABLE_TYPES[type(instance)]
+
+
+class VoteDirection(graphene.Enum):
+    """
+    Direção de um voto; NONE remove o voto do usuário.
+    """
+    UP = Vote.UP
+    DOWN = Vote.DOWN
+    NONE = 0
+
+
+VOTABLE_TYPES = {
+    Article: ArticleType,
+    News: NewsType,
+    Question: QuestionType,
+    Answer: AnswerType,
+    SimilarSuggestion: SimilarSuggestionType,
+}
+
+
 ##########################################################################
 # Schema QUERY
 ##########################################################################
@@ -318,7 +453,7 @@ class Query(object):
     """
     node = graphene.relay.Node.Field()
 
-    portals = graphene.relay.ConnectionField(
+    portals = QuerySetConnectionField(
         PortalConnection
     )
 
@@ -329,7 +464,7 @@ class Query(object):
         """
         return Portal.objects.all()
 
-    topics = graphene.relay.ConnectionField(
+    topics = QuerySetConnectionField(
         TopicConnection
     )
 
@@ -340,15 +475,16 @@ class Query(object):
         """
         return Topic.objects.all()
 
-    articles = graphene.relay.ConnectionField(
-        ArticleConnection
+    articles = QuerySetConnectionField(
+        ArticleConnection,
+        order_by=PostOrder(description='Defaults to NEW.')
     )
 
     @access_required
     def resolve_articles(self, info, **kwargs):
-        return Article.objects.all()
+        return order_posts(Article.objects.all(), kwargs.get('order_by'))
 
-    questions = graphene.relay.ConnectionField(
+    questions = QuerySetConnectionField(
         QuestionConnection
     )
 
@@ -356,19 +492,19 @@ class Query(object):
     def resolve_questions(self, info, **kwargs):
         return Question.objects.all()
 
-    tags = graphene.relay.ConnectionField(TagConnection) 
+    tags = QuerySetConnectionField(TagConnection) 
 
     @access_required
     def resolve_tags(self, info, **kwargs):
         return Tag.objects.all()
 
-    rules = graphene.relay.ConnectionField(RuleConnection)
+    rules = QuerySetConnectionField(RuleConnection)
 
     @access_required
     def resolve_rules(self, info, **kwargs):
         return Rule.objects.all()
 
-    similar_suggestions = graphene.relay.ConnectionField(
+    similar_suggestions = QuerySetConnectionField(
         SimilarSuggestionConnection
     )
 
@@ -376,7 +512,7 @@ class Query(object):
     def resolve_similar_suggestions(self, info, **kwargs):
         return SimilarSuggestion.objects.all()
 
-    news = graphene.relay.ConnectionField(
+    news = QuerySetConnectionField(
         NewsConnection,
         author=graphene.Int(
             description="Author's integer ID."
@@ -386,7 +522,8 @@ class Query(object):
         ),
         body_contains=graphene.String(
             description='Body text must contain...'
-        )
+        ),
+        order_by=PostOrder(description='Defaults to NEW.')
     )
 
     @access_required
@@ -400,35 +537,23 @@ class Query(object):
         title_contains = kwargs.get('title_contains')
         body_contains = kwargs.get('body_contains')
 
+        news = News.objects.all()
+
         # se fornecer filtro por autor, traz somente as noticias do autor
         if author:
-            news = News.objects.filter(author=author)
+            news = news.filter(author=author)
 
-        else:
-            news = News.objects.all()
-
-            if title_contains and body_contains:
-                filtered_news = [
-                    n for n in news if title_contains.lower() in n.title.lower()
-                ]
-                filtered_news += [
-                    n for n in news if body_contains.lower() in n.body.lower()
-                ]
-                return filtered_news
-
-            else:
-                if title_contains and not body_contains:
-                    news = [
-                        n for n in news if title_contains.lower() in n.title.lower()
-                    ]
-
-                if body_contains and not title_contains:
-                    news = [
-                        n for n in news if body_contains.lower() in n.body.lower()
-                    ]
-        return news
-
-    answers = graphene.relay.ConnectionField(
+        # os filtros de texto são combinados com OU: a notícia é retornada
+        # se o título ou o corpo contiverem o texto informado
+        text_filter = Q()
+        if title_contains:
+            text_filter |= Q(title__icontains=title_contains)
+        if body_contains:
+            text_filter |= Q(body__icontains=body_contains)
+
+        return order_posts(news.filter(text_filter), kwargs.get('order_by'))
+
+    answers = QuerySetConnectionField(
         AnswerConnection
     )
 
@@ -436,6 +561,46 @@ class Query(object):
     def resolve_answers(self, info, **kwargs):
         return Answer.objects.all()
 
+    search = QuerySetConnectionField(
+        SearchHitConnection,
+        query=graphene.String(
+            required=True,
+            description='Text to search for in news and articles.'
+        ),
+        portal=graphene.ID(
+            description='Restricts the search to a portal.'
+        )
+    )
+
+    @access_required
+    def resolve_search(self, info, **kwargs):
+        """
+        Busca notícias e artigos ordenados por relevância.
+        """
+        query = kwargs.get('query')
+        portal = kwargs.get('portal')
+
+        portal_id = None
+        if portal:
+            try:
+                object_type, portal_id = from_global_id(portal)
+                portal_id = int(portal_id)
+            except Exception:
+                object_type = None
+            if object_type != 'PortalType':
+                raise Exception('Invalid ID: The given ID is not a Portal ID!')
+
+        return KeysetList(search(query, portal_id), HIT_ORDERING)
+
+    entity_cache_stats = graphene.Field(
+        EntityCacheStatsType,
+        description='Hit ratio of the portal, topic, rule, tag and user cache.'
+    )
+
+    @access_required
+    def resolve_entity_cache_stats(self, info, **kwargs):
+        return EntityCacheStatsType(**get_entity_cache().stats())
+
 
 ##########################################################################
 # MUTATION - Create
@@ -457,6 +622,7 @@ class CreatePortal(graphene.relay.ClientIDMutation):
         is_public = graphene.Boolean()
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         # captura dos inputs
         name = _input.get('name')
@@ -471,7 +637,6 @@ class CreatePortal(graphene.relay.ClientIDMutation):
                 is_public=is_public
             )
             portal.users.add(user)
-            portal.save()
 
             return CreatePortal(portal)
 
@@ -505,6 +670,7 @@ class CreateTopic(graphene.relay.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         # captura dos inputs
         name = _input.get('name')
@@ -565,6 +731,7 @@ class CreateArticle(graphene.relay.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         # captura dos inputs
         title = _input.get('title')
@@ -624,6 +791,7 @@ class CreateQuestion(graphene.relay.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         # captura dos inputs
         text = _input.get('text')
@@ -745,6 +913,7 @@ class CreateNews(graphene.relay.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         # captura dos inputs
         title = _input.get('title')
@@ -828,7 +997,6 @@ class CreateSimilarSuggestion(graphene.relay.ClientIDMutation):
         try:
             similar_suggestion.save()
             post.similar_suggestions.add(similar_suggestion)
-            post.save()
             return CreateSimilarSuggestion(similar_suggestion)
         except Exception as ex:
             raise ex
@@ -849,6 +1017,7 @@ class CreateAnswer(graphene.relay.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         text = _input.get('text')
         _id = _input.get('question')
@@ -920,7 +1089,7 @@ class UpdateNews(graphene.relay.ClientIDMutation):
             news.title = title
         if body:
             news.body = body
-        news.save()
+        save_content(news)
 
         return UpdateNews(news)
 
@@ -956,7 +1125,7 @@ class UpdatePortal(graphene.relay.ClientIDMutation):
             raise Exception('Given Portal ID does not exist!')
         else:
             portal.name = name
-            portal.save()
+            save_content(portal)
         return UpdatePortal(portal)
 
 
@@ -1004,7 +1173,7 @@ class UpdateTopic(graphene.ClientIDMutation):
                 topic.description = description
             if scope:
                 topic.scope = scope
-            topic.save()
+            save_content(topic)
             return UpdateTopic(topic)
 
 
@@ -1089,7 +1258,7 @@ class UpdateArticle(graphene.ClientIDMutation):
             if article_authors:
                 authors = ';'.join(author for author in article_authors)
                 article.article_authors = authors
-            article.save()
+            save_content(article)
             return UpdateArticle(article)
 
 
@@ -1124,7 +1293,7 @@ class UpdateQuestion(graphene.ClientIDMutation):
 
         else:
             question.text = text
-            question.save()
+            save_content(question)
             return UpdateQuestion(question)
 
 
@@ -1192,7 +1361,7 @@ class UpdateSuggestion(graphene.ClientIDMutation):
                 suggestion.description = description
             if link:
                 suggestion.link = link
-            suggestion.save()
+            save_content(suggestion)
             return UpdateSuggestion(suggestion)
 
 
@@ -1241,7 +1410,7 @@ class UpdateAnswer(graphene.relay.ClientIDMutation):
 
         try:
             answer.text = text
-            answer.save()
+            save_content(answer)
 
         except Exception as exception:
             raise(exception)
@@ -1265,6 +1434,7 @@ class DeleteNews(graphene.relay.ClientIDMutation):
         id = graphene.ID(description='ID da notícia', required=True)
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         _, id = from_global_id(_input.get('id'))
         # identifica o usuario
@@ -1301,6 +1471,7 @@ class DeletePortal(graphene.relay.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         portal_id = _input.get('id')
         _, portal_id = from_global_id(portal_id)
@@ -1333,6 +1504,7 @@ class DeleteTopic(graphene.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         _id = _input.get('id')
         _, topic_id = from_global_id(_id)
@@ -1390,6 +1562,7 @@ class DeleteArticle(graphene.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         _id = _input.get('id')
         _, article_id = from_global_id(_id)
@@ -1418,6 +1591,7 @@ class DeleteQuestion(graphene.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         _id = _input.get('id')
         _, question_id = from_global_id(_id)
@@ -1501,6 +1675,7 @@ class DeleteAnswer(graphene.relay.ClientIDMutation):
         )
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         _id = _input.get('id')
         object_type, answer_id = from_global_id(_id)
@@ -1541,6 +1716,7 @@ class JoinPortal(graphene.relay.ClientIDMutation):
         portal_id = graphene.ID(required=True)
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         _id = _input.get('portal_id')
         object_type, portal_id = from_global_id(_id)
@@ -1555,11 +1731,10 @@ class JoinPortal(graphene.relay.ClientIDMutation):
 
         # identifica o usuario
         user = info.context.user
-        if user in portal.users.all():
+        if portal.users.filter(pk=user.pk).exists():
             raise Exception('This user is already a member of this portal!')
         else:
             portal.users.add(user)
-            portal.save()
 
         return JoinPortal(portal)
 
@@ -1574,6 +1749,7 @@ class LeavePortal(graphene.relay.ClientIDMutation):
         portal_id = graphene.ID(required=True)
 
     @access_required
+    @transaction.atomic
     def mutate_and_get_payload(self, info, **_input):
         _id = _input.get('portal_id')
         object_type, portal_id = from_global_id(_id)
@@ -1588,7 +1764,7 @@ class LeavePortal(graphene.relay.ClientIDMutation):
 
         # identifica o usuario
         user = info.context.user
-        if user in portal.users.all():
+        if portal.users.filter(pk=user.pk).exists():
             portal.users.remove(user)
         else:
             raise Exception('Your not a member of this Portal!')
@@ -1596,6 +1772,45 @@ class LeavePortal(graphene.relay.ClientIDMutation):
         return LeavePortal(portal)
 
 
+class VotePost(graphene.relay.ClientIDMutation):
+    """
+    Votes for or against a post. Each user has a single vote per post;
+    voting again replaces it and the NONE direction removes it.
+    """
+    post = graphene.Field(VotedPost, description='Voted post with updated totals.')
+    direction = VoteDirection(description='Current user vote.')
+
+    class Input:
+        post_id = graphene.ID(
+            required=True,
+            description='Article, News, Question, Answer or Similar Suggestion ID.'
+        )
+        direction = VoteDirection(required=True)
+
+    @access_required
+    def mutate_and_get_payload(self, info, **_input):
+        post_type, post_id = from_global_id(_input.get('post_id'))
+        direction = _input.get('direction') or None
+
+        models = {
+            object_type._meta.name: model
+            for model, object_type in VOTABLE_TYPES.items()
+        }
+        if post_type not in models:
+            raise Exception('Invalid ID: The given ID is not a post ID!')
+
+        try:
+            post = models[post_type].objects.get(id=post_id)
+        except models[post_type].DoesNotExist:
+            raise Exception('Given post does not exist.')
+
+        # identifica o usuario
+        user = info.context.user
+        cast_vote(user, post, direction)
+
+        return VotePost(post=post, direction=direction or 0)
+
+
 ##########################################################################
 # Schema Mutation
 ##########################################################################
@@ -1636,3 +1851,4 @@ class Mutation:
     # Other stuff
     join_portal = JoinPortal.Field()
     leave_portal = LeavePortal.Field()
+    vote = VotePost.Field()
@@ -0,0 +1,541 @@
+"""
+Busca textual da aplicação civil-cultural.
+Este módulo contém:
+    - Um índice invertido em memória sobre Notícias e Artigos;
+    - O ranqueamento dos resultados por BM25;
+    - A persistência do índice em arquivo local;
+    - As funções usadas pelos signals para manter o índice atualizado.
+
+O índice roda no próprio processo, sem serviços externos. Como o servidor
+pode rodar com vários workers, ele é persistido em dois arquivos:
+    - Um snapshot com o índice completo (SEARCH_INDEX_PATH);
+    - Um log com as alterações posteriores ao snapshot, ao qual cada
+      alteração acrescenta um registro sob uma trava de arquivo, sem ler
+      o índice.
+Nas buscas, cada worker aplica ao seu índice apenas os registros novos do
+log. Quando o log passa de SEARCH_INDEX_LOG_SIZE bytes, ele é incorporado
+a um novo snapshot em uma thread separada (ver `compact`).
+"""
+import math
+import os
+import pickle
+import re
+import struct
+import tempfile
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+
+from django.conf import settings
+
+from civil_cultural.models import Article, News
+from server.locks import FileLock
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Parâmetros do BM25
+K1 = 1.2
+B = 0.75
+
+SearchHit = namedtuple('SearchHit', 'model pk score key')
+
+# ordenação dos resultados, como lista de (campo, decrescente): pontuação
+# decrescente e, no empate, a chave no índice
+HIT_ORDERING = [('score', True), ('key', False)]
+
+INDEXED_MODELS = {
+    'news': News,
+    'article': Article,
+}
+
+
+def tokenize(text):
+    """
+    Quebra o texto em termos minúsculos e sem acentos.
+
+    param text: <str>
+    rtype: <list>
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return TOKEN_RE.findall(text)
+
+
+def count_terms(texts):
+    """
+    param texts: <list>
+    rtype: <collections.Counter> termo -> frequência nos textos
+    """
+    terms = Counter()
+    for text in texts:
+        terms.update(tokenize(text))
+    return terms
+
+
+def document_key(instance):
+    """
+    Chave de um objeto no índice.
+
+    param instance: <News> ou <Article>
+    rtype: <str>
+    """
+    return '%s:%s' % (instance._meta.model_name, instance.pk)
+
+
+def document_fields(instance):
+    """
+    Retorna o portal e os textos indexados de uma Notícia ou Artigo.
+
+    param instance: <News> ou <Article>
+    rtype: <tuple> (id do portal, lista de textos)
+    """
+    if isinstance(instance, News):
+        return instance.portal_reference_id, [instance.title, instance.body]
+
+    tags = instance.tags.values_list('reference', flat=True)
+    portal_id = instance.published_topic.topic_portal_id
+    texts = [instance.title, instance.abstract, instance.body] + list(tags)
+    return portal_id, texts
+
+
+class SearchIndex:
+    """
+    Índice invertido com ranqueamento BM25.
+
+    documents: chave -> (id do portal, tamanho do documento, termos)
+    postings: termo -> {chave: frequência do termo no documento}
+    """
+    def __init__(self):
+        self.documents = {}
+        self.postings = {}
+        self.total_length = 0
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, key, portal_id, texts):
+        """
+        Indexa (ou reindexa) um documento.
+
+        param key: <str>
+        param portal_id: <int>
+        param texts: <list> textos do documento
+        """
+        self.add_terms(key, portal_id, count_terms(texts))
+
+    def add_terms(self, key, portal_id, terms):
+        """
+        Indexa (ou reindexa) um documento a partir dos seus termos.
+
+        param key: <str>
+        param portal_id: <int>
+        param terms: <dict> termo -> frequência no documento
+        """
+        with self.lock:
+            self.remove(key)
+            length = sum(terms.values())
+            self.documents[key] = (portal_id, length, tuple(terms))
+            self.total_length += length
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[key] = frequency
+
+    def remove(self, key):
+        """
+        Remove um documento do índice, caso exista.
+
+        param key: <str>
+        """
+        with self.lock:
+            document = self.documents.pop(key, None)
+            if document is None:
+                return
+
+            _, length, terms = document
+            self.total_length -= length
+            for term in terms:
+                posting = self.postings[term]
+                del posting[key]
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query, portal_id=None):
+        """
+        Retorna os documentos que contém algum termo da consulta,
+        ordenados pela pontuação BM25.
+
+        param query: <str>
+        param portal_id: <int> restringe a busca a um portal
+        rtype: <list> de tuplas (chave, pontuação)
+        """
+        with self.lock:
+            total = len(self.documents)
+            if not total:
+                return []
+
+            average_length = self.total_length / total
+            scores = Counter()
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+
+                df = len(posting)
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                for key, frequency in posting.items():
+                    document_portal, length, _ = self.documents[key]
+                    if portal_id is not None and document_portal != portal_id:
+                        continue
+                    norm = K1 * (1 - B + B * length / average_length)
+                    scores[key] += idf * frequency * (K1 + 1) / (frequency + norm)
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def apply(self, record):
+        """
+        Aplica um registro do log de alterações (ver `_append`).
+
+        param record: <tuple> ('add', chave, id do portal, termos) ou
+                      ('remove', chave)
+        """
+        if record[0] == 'add':
+            _, key, portal_id, terms = record
+            self.add_terms(key, portal_id, terms)
+        else:
+            self.remove(record[1])
+
+    def save(self, path):
+        """
+        Grava o índice no disco de forma atômica, sem o log.
+
+        param path: <str>
+        """
+        with self.lock:
+            temporary = _write_temporary(
+                path,
+                lambda index_file: pickle.dump(self, index_file, pickle.HIGHEST_PROTOCOL)
+            )
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Lê o índice gravado no disco, com as alterações do log.
+
+        param path: <str>
+        rtype: <SearchIndex>
+        """
+        with open(path, 'rb') as index_file:
+            index = pickle.load(index_file)
+        try:
+            with open(_log_path(path), 'rb') as log_file:
+                records, _ = _read_log(log_file, 0)
+        except FileNotFoundError:
+            records = []
+        for record in records:
+            index.apply(record)
+        return index
+
+    @classmethod
+    def build(cls):
+        """
+        Constrói o índice a partir de todas as Notícias e Artigos do banco.
+
+        rtype: <SearchIndex>
+        """
+        index = cls()
+        for news in News.objects.all():
+            index.add(document_key(news), *document_fields(news))
+
+        articles = Article.objects.select_related(
+            'published_topic'
+        ).prefetch_related('tags')
+        for article in articles:
+            index.add(document_key(article), *document_fields(article))
+        return index
+
+
+##########################################################################
+# Persistência
+##########################################################################
+# cada registro do log é precedido pelo seu tamanho
+LOG_HEADER = struct.Struct('>I')
+
+
+def _log_path(path):
+    return path + '.log'
+
+
+def _read_log(log_file, offset):
+    """
+    Lê os registros completos do log a partir de `offset`. Um registro
+    incompleto no fim do arquivo (ainda sendo gravado) fica para a próxima
+    leitura.
+
+    param log_file: <file> log aberto em modo binário
+    param offset: <int>
+    rtype: <tuple> (lista de registros, posição após o último registro lido)
+    """
+    log_file.seek(offset)
+    data = log_file.read()
+    records = []
+    position = 0
+    while position + LOG_HEADER.size <= len(data):
+        size, = LOG_HEADER.unpack_from(data, position)
+        start = position + LOG_HEADER.size
+        if start + size > len(data):
+            break
+        records.append(pickle.loads(data[start:start + size]))
+        position = start + size
+    return records, offset + position
+
+
+def _write_temporary(path, write):
+    """
+    Grava um arquivo temporário no diretório de `path`, para ser movido
+    sobre ele com os.replace.
+
+    param path: <str>
+    param write: <function> recebe o arquivo temporário aberto
+    rtype: <str> caminho do arquivo temporário
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as temporary_file:
+            write(temporary_file)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return temporary
+
+
+def _snapshot_id(snapshot_file):
+    # o snapshot só é substituído, nunca alterado; o tamanho e a data
+    # distinguem um arquivo novo que reaproveite o inode de um antigo
+    stat = os.fstat(snapshot_file.fileno())
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _open(path):
+    """
+    Abre o snapshot e o log sob a trava compartilhada. Como ambos só são
+    substituídos sob a trava exclusiva, os arquivos abertos formam um par
+    consistente mesmo que sejam substituídos em seguida.
+
+    param path: <str>
+    rtype: <tuple> (snapshot, log ou None), ou None se o índice ainda não
+           foi construído
+    """
+    with FileLock(path, shared=True):
+        try:
+            snapshot_file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            log_file = open(_log_path(path), 'rb')
+        except FileNotFoundError:
+            log_file = None
+    return snapshot_file, log_file
+
+
+def _reset(path, index):
+    """
+    Grava o índice como snapshot e esvazia o log. Deve ser chamada com a
+    trava exclusiva adquirida.
+    """
+    index.save(path)
+    os.replace(_write_temporary(path, lambda log_file: None), _log_path(path))
+
+
+def rebuild(path=None):
+    """
+    Reconstrói o índice a partir do banco e descarta o log. As escritas
+    esperam a reconstrução, para que nenhuma alteração se perca.
+
+    param path: <str> por padrão, a setting SEARCH_INDEX_PATH
+    rtype: <SearchIndex>
+    """
+    path = path or settings.SEARCH_INDEX_PATH
+    with FileLock(path, '.compact.lock'), FileLock(path):
+        index = SearchIndex.build()
+        _reset(path, index)
+    return index
+
+
+def compact(path=None):
+    """
+    Incorpora o log ao snapshot. O novo snapshot é montado e gravado sem
+    travar as escritas; somente a troca dos arquivos, com a cópia dos
+    registros gravados nesse meio tempo para o novo log, é feita sob a
+    trava exclusiva. Não faz nada se outra compactação estiver em
+    andamento.
+
+    param path: <str> por padrão, a setting SEARCH_INDEX_PATH
+    rtype: <bool> se a compactação foi feita
+    """
+    path = path or settings.SEARCH_INDEX_PATH
+    with FileLock(path, '.compact.lock', blocking=False) as compaction:
+        files = compaction.acquired and _open(path)
+        if not files:
+            return False
+
+        snapshot_file, log_file = files
+        if log_file is None:
+            snapshot_file.close()
+            return False
+
+        with snapshot_file, log_file:
+            index = pickle.load(snapshot_file)
+            records, offset = _read_log(log_file, 0)
+            for record in records:
+                index.apply(record)
+            temporary = _write_temporary(
+                path,
+                lambda index_file: pickle.dump(index, index_file, pickle.HIGHEST_PROTOCOL)
+            )
+
+            with FileLock(path):
+                log_file.seek(offset)
+                tail = log_file.read()
+                log = _write_temporary(path, lambda new_log: new_log.write(tail))
+                os.replace(temporary, path)
+                os.replace(log, _log_path(path))
+    return True
+
+
+_compaction_lock = threading.Lock()
+
+
+def _compact_in_background(path):
+    # no máximo uma compactação por processo
+    if not _compaction_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            compact(path)
+        finally:
+            _compaction_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+##########################################################################
+# Índice do processo
+##########################################################################
+_state = {'index': None, 'path': None, 'snapshot': None, 'offset': 0}
+_state_lock = threading.Lock()
+
+
+def _refresh(path):
+    """
+    Atualiza o índice do processo com o disco: o snapshot só é relido
+    quando substituído, e do log são lidos apenas os registros novos. O
+    índice é construído a partir do banco caso ainda não exista.
+    Deve ser chamada com _state_lock adquirida.
+    """
+    files = _open(path)
+    if files is None:
+        with FileLock(path):
+            if not os.path.exists(path):
+                _reset(path, SearchIndex.build())
+        files = _open(path)
+
+    snapshot_file, log_file = files
+    with snapshot_file:
+        snapshot = _snapshot_id(snapshot_file)
+        if _state['path'] != path or _state['snapshot'] != snapshot:
+            _state.update(
+                index=pickle.load(snapshot_file), path=path,
+                snapshot=snapshot, offset=0
+            )
+
+    index = _state['index']
+    if log_file is not None:
+        with log_file:
+            records, _state['offset'] = _read_log(log_file, _state['offset'])
+        for record in records:
+            index.apply(record)
+    return index
+
+
+def get_index():
+    """
+    Retorna o índice de busca do processo, atualizado com o disco.
+
+    rtype: <SearchIndex>
+    """
+    with _state_lock:
+        return _refresh(settings.SEARCH_INDEX_PATH)
+
+
+def _append(record):
+    """
+    Acrescenta uma alteração ao log. Cada registro define o estado
+    completo de um documento, então reaplicá-lo não muda o índice.
+
+    param record: <tuple> ver SearchIndex.apply
+    """
+    path = settings.SEARCH_INDEX_PATH
+    payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    # a construção do índice (ver `_refresh` e `rebuild`) segura a mesma
+    # trava, então uma alteração gravada durante a construção espera o
+    # snapshot e entra no log. Sem snapshot e sem construção em andamento,
+    # o índice será construído a partir do banco no primeiro uso, já com
+    # a alteração
+    with FileLock(path):
+        if not os.path.exists(path):
+            return
+        with open(_log_path(path), 'ab') as log_file:
+            log_file.write(LOG_HEADER.pack(len(payload)) + payload)
+            size = log_file.tell()
+
+    if size > settings.SEARCH_INDEX_LOG_SIZE:
+        _compact_in_background(path)
+
+
+def index_document(instance):
+    """
+    Indexa ou reindexa uma Notícia ou Artigo.
+
+    param instance: <News> ou <Article>
+    """
+    portal_id, texts = document_fields(instance)
+    _append(('add', document_key(instance), portal_id, dict(count_terms(texts))))
+
+
+def unindex_document(instance):
+    """
+    Remove uma Notícia ou Artigo do índice.
+
+    param instance: <News> ou <Article>
+    """
+    _append(('remove', document_key(instance)))
+
+
+def search(query, portal_id=None):
+    """
+    Busca Notícias e Artigos ranqueados por relevância.
+
+    param query: <str>
+    param portal_id: <int>
+    rtype: <list> de SearchHit, na ordem de HIT_ORDERING
+    """
+    hits = []
+    for key, score in get_index().search(query, portal_id):
+        model_name, pk = key.split(':')
+        hits.append(SearchHit(INDEXED_MODELS[model_name], int(pk), score, key))
+    return hits
@@ -0,0 +1,170 @@
+"""
+Signals da aplicação civil-cultural.
+Mantém o índice de busca atualizado conforme Notícias e Artigos são
+criados, alterados ou removidos, mantém as pontuações de classificação
+das Notícias e Artigos e os contadores agregados, remove os votos das
+publicações removidas e invalida os objetos alterados no cache de objetos
+e as respostas em cache que os leram.
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from civil_cultural.cache import CACHED_MODELS, expire, is_cached
+from civil_cultural.counters import add, counted_relations
+from civil_cultural.models import (Answer, Article, News, Portal, Question, Tag,
+                                   Topic, Vote)
+from civil_cultural.ranking import rank
+from civil_cultural.responses import TAGGED_LABELS, evict
+from civil_cultural.search import index_document, unindex_document
+from civil_cultural.votes import VOTABLE_MODELS, post_voted
+
+
+@receiver(post_save, sender=News)
+@receiver(post_save, sender=Article)
+def update_search_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: index_document(instance))
+
+
+@receiver(post_delete, sender=News)
+@receiver(post_delete, sender=Article)
+def remove_from_search_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: unindex_document(instance))
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def update_article_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        transaction.on_commit(lambda: index_document(instance))
+    elif pk_set:
+        for article in Article.objects.filter(pk__in=pk_set):
+            transaction.on_commit(lambda article=article: index_document(article))
+
+
+@receiver(post_save, sender=Tag)
+def update_tagged_articles(sender, instance, created, **kwargs):
+    if created:
+        return
+    for article in instance.article_set.all():
+        transaction.on_commit(lambda article=article: index_document(article))
+
+
+def remove_votes(sender, instance, **kwargs):
+    Vote.objects.filter(
+        post_type=sender._meta.model_name, post_id=instance.pk
+    ).delete()
+
+
+for votable_model in VOTABLE_MODELS.values():
+    post_delete.connect(remove_votes, sender=votable_model)
+
+
+@receiver(pre_save, sender=News)
+@receiver(pre_save, sender=Article)
+def update_ranking(sender, instance, **kwargs):
+    rank(instance)
+
+
+@receiver(post_voted, sender=News)
+@receiver(post_voted, sender=Article)
+def update_voted_ranking(sender, instance, **kwargs):
+    # executado na transação do voto, com a linha da publicação travada
+    rank(instance)
+    sender.objects.filter(pk=instance.pk).update(
+        score=instance.score, hot_score=instance.hot_score
+    )
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=News)
+@receiver(post_save, sender=Topic)
+def count_created(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    for parent, counter, foreign_key in counted_relations(sender):
+        add(parent, getattr(instance, foreign_key + '_id'), counter, 1)
+
+
+@receiver(post_delete, sender=Answer)
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Article)
+@receiver(post_delete, sender=News)
+@receiver(post_delete, sender=Topic)
+def count_deleted(sender, instance, **kwargs):
+    for parent, counter, foreign_key in counted_relations(sender):
+        add(parent, getattr(instance, foreign_key + '_id'), counter, -1)
+
+
+@receiver(m2m_changed, sender=Portal.users.through)
+def count_members(sender, instance, action, reverse, pk_set, **kwargs):
+    # as remoções são contadas antes de acontecerem, pois pk_set pode
+    # conter usuários (ou portais) que não estão na relação
+    if action == 'post_add':
+        changed, amount = pk_set, 1
+    elif action in ('pre_remove', 'pre_clear'):
+        memberships = sender.objects.filter(
+            **{'user' if reverse else 'portal': instance}
+        )
+        if action == 'pre_remove':
+            memberships = memberships.filter(
+                **{'portal__in' if reverse else 'user__in': pk_set}
+            )
+        changed, amount = memberships.values_list(
+            'portal_id' if reverse else 'user_id', flat=True
+        ), -1
+    else:
+        return
+
+    if reverse:
+        for portal_id in list(changed):
+            add(Portal, portal_id, 'members_count', amount)
+    else:
+        add(Portal, instance.pk, 'members_count', amount * len(changed))
+        instance.refresh_from_db(fields=['members_count'])
+
+
+def expire_cached_object(sender, instance, **kwargs):
+    expire(sender, instance.pk)
+
+
+for cached_model in CACHED_MODELS:
+    post_save.connect(expire_cached_object, sender=cached_model)
+    post_delete.connect(expire_cached_object, sender=cached_model)
+
+
+@receiver(m2m_changed)
+def expire_related_objects(sender, instance, action, model, pk_set, **kwargs):
+    # as relações não fazem parte das entradas, mas os receivers das
+    # relações podem alterar colunas dos objetos (ex.: members_count)
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    expire(type(instance), instance.pk)
+    if pk_set and is_cached(model):
+        for pk in pk_set:
+            expire(model, pk)
+
+
+def evict_cached_responses(sender, **kwargs):
+    evict(sender)
+
+
+for tagged_model in map(apps.get_model, TAGGED_LABELS):
+    post_save.connect(evict_cached_responses, sender=tagged_model)
+    post_delete.connect(evict_cached_responses, sender=tagged_model)
+
+for votable_model in VOTABLE_MODELS.values():
+    post_voted.connect(evict_cached_responses, sender=votable_model)
+
+
+@receiver(m2m_changed)
+def evict_related_responses(sender, instance, action, model, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        evict(type(instance))
+        evict(model)
@@ -1,3 +1,1103 @@
-from django.test import TestCase
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from graphql_relay import to_global_id
+
+from civil_cultural.models import (Portal, Topic, Article, Question, Answer,
+                                   News, Tag, Vote)
+from civil_cultural.search import (SearchIndex, compact, document_key,
+                                   index_document, search)
+from civil_cultural.cache import EntityCache, get_entity_cache
+from civil_cultural.responses import analyze, response_key
+from civil_cultural.counters import reconcile
+from civil_cultural.ranking import HOT_DECAY, hot_score
+from civil_cultural.votes import cast_vote, save_content
+from server.views import CivilGraphQLView
+
+
+class GraphQLTestMixin:
+    """
+    Utilitários para testes que executam consultas através da view GraphQL.
+    """
+    def setUp(self):
+        # cada teste usa índices de busca e do chatbot próprios, fora do
+        # diretório do projeto, e as revogações de token são sempre
+        # verificadas no banco
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        test_settings = self.settings(
+            SEARCH_INDEX_PATH=os.path.join(directory.name, 'search_index'),
+            CHATBOT_INDEX_PATH=os.path.join(directory.name, 'chatbot_index'),
+            TOKEN_BLACKLIST_FILTER_PATH=None
+        )
+        test_settings.enable()
+        self.addCleanup(test_settings.disable)
+
+        # as chaves primárias se repetem entre testes, pois cada teste é
+        # desfeito sem enviar signals
+        get_entity_cache().clear()
+        self.addCleanup(get_entity_cache().clear)
+
+        self.factory = RequestFactory()
+        self.user = get_user_model().objects.create(username='mage')
+        self.sequence = itertools.count()
+
+    def post(self, query, user=None):
+        request = self.factory.post(
+            '/graphql/',
+            json.dumps({'query': query}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='JWT token'
+        )
+        request.user = user or self.user
+        response = CivilGraphQLView.as_view()(request)
+        return json.loads(response.content.decode())
+
+    def execute(self, query, user=None):
+        content = self.post(query, user)
+        self.assertNotIn('errors', content)
+        return content['data']
+
+    def populate(self, amount):
+        """
+        Cria `amount` árvores completas de portal, tópico, artigo, pergunta,
+        resposta e notícia.
+        """
+        for _ in range(amount):
+            i = next(self.sequence)
+            author = get_user_model().objects.create(username='user-%s' % i)
+            portal = Portal.objects.create(name='portal-%s' % i, owner=author)
+            topic = Topic.objects.create(
+                name='topic-%s' % i,
+                scope='scope-%s' % i,
+                topic_portal=portal
+            )
+            article = Article.objects.create(
+                title='article-%s' % i,
+                abstract='abstract-%s' % i,
+                body='body-%s' % i,
+                post_author=author,
+                published_topic=topic
+            )
+            question = Question.objects.create(
+                text='question', post_author=author, published_article=article
+            )
+            Answer.objects.create(text='answer', author=author, question=question)
+            News.objects.create(
+                title='news', body='body', author=author, portal_reference=portal
+            )
+
+
+class GraphQLTestCase(GraphQLTestMixin, TestCase):
+    pass
+
+
+class ForeignKeyBatchingTestCase(GraphQLTestCase):
+    """
+    Chaves estrangeiras de listas devem ser resolvidas com um número
+    constante de consultas, independente da quantidade de objetos.
+    """
+    def assertConstantQueries(self, query, key, num):
+        self.populate(2)
+        with self.assertNumQueries(num):
+            data = self.execute(query)
+        self.assertEqual(len(data[key]['edges']), 2)
+
+        self.populate(10)
+        with self.assertNumQueries(num):
+            data = self.execute(query)
+        self.assertEqual(len(data[key]['edges']), 12)
+        return data
+
+    def test_news_author_and_portal(self):
+        query = '''
+        query {
+            news {
+                edges { node { title author { username } portal { name } } }
+            }
+        }
+        '''
+        self.assertConstantQueries(query, 'news', 2)
+
+    def test_answer_author_and_question(self):
+        query = '''
+        query {
+            answers {
+                edges { node { text postAuthor { username } question { text } } }
+            }
+        }
+        '''
+        self.assertConstantQueries(query, 'answers', 2)
+
+    def test_portal_tree(self):
+        query = '''
+        query {
+            portals {
+                edges { node {
+                    name
+                    owner { username }
+                    topics { edges { node {
+                        name
+                        articles {
+                            title
+                            postAuthor { username }
+                            questions { edges { node {
+                                text
+                                answers { edges { node {
+                                    text
+                                    postAuthor { username }
+                                } } }
+                            } } }
+                        }
+                    } } }
+                } }
+            }
+        }
+        '''
+        data = self.assertConstantQueries(query, 'portals', 6)
+        portal = data['portals']['edges'][0]['node']
+        topic = portal['topics']['edges'][0]['node']
+        question = topic['articles'][0]['questions']['edges'][0]['node']
+        self.assertEqual(question['answers']['edges'][0]['node']['text'], 'answer')
+
+
+class ColumnProjectionTestCase(GraphQLTestCase):
+    """
+    Textos grandes só devem ser lidos do banco quando selecionados.
+    """
+    def select_sql(self, query):
+        self.populate(1)
+        with CaptureQueriesContext(connection) as context:
+            self.execute(query)
+        return ' '.join(
+            q['sql'] for q in context.captured_queries if 'SELECT' in q['sql']
+        )
+
+    def test_news_body_deferred(self):
+        sql = self.select_sql('query { news { edges { node { title } } } }')
+        self.assertNotIn('"civil_cultural_news"."body"', sql)
+
+        sql = self.select_sql('query { news { edges { node { body } } } }')
+        self.assertIn('"civil_cultural_news"."body"', sql)
+
+    def test_nested_article_texts_deferred(self):
+        sql = self.select_sql(
+            'query { questions { edges { node { article { title } } } } }'
+        )
+        self.assertIn('"civil_cultural_article"."title"', sql)
+        self.assertNotIn('"civil_cultural_article"."body"', sql)
+        self.assertNotIn('"civil_cultural_article"."abstract"', sql)
+        self.assertNotIn('"civil_cultural_article"."references"', sql)
+
+
+class NewsFilterTestCase(GraphQLTestCase):
+    """
+    Filtros de texto das notícias são resolvidos pelo banco de dados.
+    """
+    def setUp(self):
+        super().setUp()
+        self.populate(1)
+        portal = Portal.objects.get()
+        self.other = get_user_model().objects.create(username='other')
+        News.objects.create(
+            title='Magic news', body='About a black mage',
+            author=self.user, portal_reference=portal
+        )
+        News.objects.create(
+            title='Weather', body='A mage predicts magic rain',
+            author=self.other, portal_reference=portal
+        )
+
+    def titles(self, arguments):
+        data = self.execute(
+            'query { news(%s) { edges { node { title } } } }' % arguments
+        )
+        return sorted(edge['node']['title'] for edge in data['news']['edges'])
+
+    def test_title_and_body_without_duplicates(self):
+        titles = self.titles('titleContains: "MAGIC", bodyContains: "mage"')
+        self.assertEqual(titles, ['Magic news', 'Weather'])
+
+    def test_author_with_text(self):
+        titles = self.titles(
+            'author: %s, bodyContains: "magic"' % self.other.id
+        )
+        self.assertEqual(titles, ['Weather'])
+
+    def test_paginated_in_sql(self):
+        with self.assertNumQueries(2):
+            data = self.execute(
+                'query { news(bodyContains: "magic", first: 1) '
+                '{ edges { node { title } } } }'
+            )
+        self.assertEqual(len(data['news']['edges']), 1)
+
+
+class SearchTestCase(GraphQLTestCase):
+    """
+    Busca textual sobre Notícias e Artigos.
+    """
+    def setUp(self):
+        super().setUp()
+        self.populate(2)
+        self.portal, self.other_portal = Portal.objects.order_by('id')
+        article = Article.objects.filter(published_topic__topic_portal=self.portal).get()
+        article.tags.add(Tag.objects.create(reference='dragons'))
+        News.objects.create(
+            title='Dragon sighted', body='A dragon flew over the dragon mountain',
+            author=self.user, portal_reference=self.portal
+        )
+        News.objects.create(
+            title='Harvest', body='Farmers fear the dragon',
+            author=self.user, portal_reference=self.other_portal
+        )
+
+    def search(self, arguments):
+        data = self.execute(
+            'query { search(%s) { edges { node { score post {'
+            ' ... on NewsType { title } ... on ArticleType { title } } } } } }'
+            % arguments
+        )
+        return [edge['node'] for edge in data['search']['edges']]
+
+    def test_ranking(self):
+        hits = self.search('query: "dragon"')
+        self.assertEqual(
+            [hit['post']['title'] for hit in hits], ['Dragon sighted', 'Harvest']
+        )
+        self.assertGreater(hits[0]['score'], hits[1]['score'])
+
+    def test_tags_and_portal(self):
+        portal_id = to_global_id('PortalType', self.portal.id)
+        hits = self.search('query: "dragons", portal: "%s"' % portal_id)
+        self.assertEqual([hit['post']['title'] for hit in hits], ['article-0'])
+
+        hits = self.search('query: "harvest", portal: "%s"' % portal_id)
+        self.assertEqual(hits, [])
+
+    def test_invalid_portal(self):
+        for portal_id in ('bogus', to_global_id('PortalType', 'x'),
+                          to_global_id('TopicType', self.portal.id)):
+            response = self.post(
+                'query { search(query: "dragon", portal: "%s") { edges { cursor } } }'
+                % portal_id
+            )
+            self.assertEqual(
+                response['errors'][0]['message'],
+                'Invalid ID: The given ID is not a Portal ID!'
+            )
+
+    def test_pagination(self):
+        query = (
+            'query { search(query: "dragon", first: 1%s) { pageInfo { '
+            'hasNextPage endCursor } edges { node { post { '
+            '... on NewsType { title } ... on ArticleType { title } } } } } }'
+        )
+        titles = []
+        after = ''
+        while True:
+            page = self.execute(query % after)['search']
+            titles += [edge['node']['post']['title'] for edge in page['edges']]
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = ', after: "%s"' % page['pageInfo']['endCursor']
+
+        hits = self.search('query: "dragon"')
+        self.assertEqual(titles, [hit['post']['title'] for hit in hits])
+        self.assertEqual(len(titles), 2)
+
+
+class SearchIndexUpdateTestCase(GraphQLTestMixin, TransactionTestCase):
+    """
+    O índice de busca acompanha as alterações do banco de dados.
+    """
+    def test_incremental_update(self):
+        self.populate(1)
+        self.assertEqual(search('wizard'), [])
+
+        news = News.objects.create(
+            title='Wizard', body='The wizard arrived',
+            author=self.user, portal_reference=Portal.objects.get()
+        )
+        self.assertEqual([hit.pk for hit in search('wizard')], [news.pk])
+
+        # outro processo enxerga as alterações através do arquivo
+        index = SearchIndex.load(settings.SEARCH_INDEX_PATH)
+        self.assertEqual(len(index.search('wizard')), 1)
+
+        news.delete()
+        self.assertEqual(search('wizard'), [])
+
+    def test_changes_during_first_build_are_kept(self):
+        self.populate(1)
+        news = News.objects.create(
+            title='Wizard', body='The wizard arrived',
+            author=self.user, portal_reference=Portal.objects.get()
+        )
+        build = SearchIndex.build
+        writers = []
+
+        def slow_build():
+            # o banco foi lido antes de a notícia ser gravada
+            index = build()
+            index.remove(document_key(news))
+            writer = threading.Thread(target=index_document, args=(news,))
+            writer.start()
+            writer.join(0.2)
+            # a gravação espera o snapshot em vez de ser descartada
+            self.assertTrue(writer.is_alive())
+            writers.append(writer)
+            return index
+
+        with mock.patch.object(SearchIndex, 'build', slow_build):
+            search('wizard')
+        writers[0].join()
+        self.assertEqual([hit.pk for hit in search('wizard')], [news.pk])
+
+    def test_compaction(self):
+        self.populate(1)
+        search('wizard')
+        path = settings.SEARCH_INDEX_PATH
+        snapshot = os.stat(path).st_mtime_ns
+
+        # as alterações só acrescentam registros ao log
+        news = News.objects.create(
+            title='Wizard', body='The wizard arrived',
+            author=self.user, portal_reference=Portal.objects.get()
+        )
+        news.title = 'Wizard again'
+        news.save()
+        self.assertEqual(os.stat(path).st_mtime_ns, snapshot)
+        self.assertGreater(os.path.getsize(path + '.log'), 0)
+
+        self.assertTrue(compact())
+        self.assertEqual(os.path.getsize(path + '.log'), 0)
+        self.assertEqual(len(SearchIndex.load(path).search('again')), 1)
+        self.assertEqual([hit.pk for hit in search('wizard')], [news.pk])
+
+        # o worker aplica ao seu índice somente os registros novos
+        news.delete()
+        self.assertEqual(search('wizard'), [])
+        self.assertEqual(len(SearchIndex.load(path).search('wizard')), 0)
+
+
+class KeysetPaginationTestCase(GraphQLTestCase):
+    """
+    Conexões paginadas por cursores de chave.
+    """
+    def setUp(self):
+        super().setUp()
+        self.populate(5)
+
+    def page(self, arguments):
+        data = self.execute(
+            'query { news(%s) { pageInfo { hasNextPage hasPreviousPage '
+            'startCursor endCursor } edges { cursor node { id } } } }' % arguments
+        )
+        return data['news']
+
+    def test_forward_and_backward(self):
+        expected = [
+            to_global_id('NewsType', pk)
+            for pk in News.objects.values_list('pk', flat=True)
+        ]
+        self.assertEqual(len(expected), 5)
+
+        first = self.page('first: 2')
+        self.assertTrue(first['pageInfo']['hasNextPage'])
+        second = self.page('first: 3, after: "%s"' % first['pageInfo']['endCursor'])
+        self.assertFalse(second['pageInfo']['hasNextPage'])
+        self.assertTrue(second['pageInfo']['hasPreviousPage'])
+        ids = [edge['node']['id'] for edge in first['edges'] + second['edges']]
+        self.assertEqual(ids, expected)
+
+        previous = self.page(
+            'last: 2, before: "%s"' % second['pageInfo']['endCursor']
+        )
+        self.assertTrue(previous['pageInfo']['hasPreviousPage'])
+        self.assertEqual(
+            [edge['node']['id'] for edge in previous['edges']], expected[2:4]
+        )
+
+    def test_stable_under_inserts(self):
+        first = self.page('first: 2')
+        # uma notícia mais recente não desloca a página seguinte
+        News.objects.create(
+            title='late', body='late', author=self.user,
+            portal_reference=Portal.objects.first()
+        )
+        second = self.page('first: 2, after: "%s"' % first['pageInfo']['endCursor'])
+        expected = News.objects.values_list('pk', flat=True)[3:5]
+        self.assertEqual(
+            [edge['node']['id'] for edge in second['edges']],
+            [to_global_id('NewsType', pk) for pk in expected]
+        )
+
+    def test_prefetched_connection_uses_same_cursors(self):
+        portal = Portal.objects.first()
+        for title in ('a', 'b', 'c'):
+            News.objects.create(
+                title=title, body=title, author=self.user, portal_reference=portal
+            )
+        query = (
+            'query { portals { edges { node { news(first: 2%s) { pageInfo '
+            '{ endCursor } edges { node { title } } } } } } }'
+        )
+        data = self.execute(query % '')
+        news = data['portals']['edges'][0]['node']['news']
+        self.assertEqual(
+            [edge['node']['title'] for edge in news['edges']], ['c', 'b']
+        )
+
+        data = self.execute(query % ', after: "%s"' % news['pageInfo']['endCursor'])
+        news = data['portals']['edges'][0]['node']['news']
+        self.assertEqual(
+            [edge['node']['title'] for edge in news['edges']], ['a', 'news']
+        )
+
+    def test_nested_pages_are_bounded(self):
+        portals = list(Portal.objects.all()[:2])
+        members = [
+            get_user_model().objects.create(username='member-%s' % i)
+            for i in range(5)
+        ]
+        # o primeiro membro participa dos dois portais
+        portals[0].users.add(*members)
+        portals[1].users.add(members[0], self.user)
+
+        query = (
+            'query { portals(first: 2) { edges { node { name members(%s) '
+            '{ pageInfo { hasNextPage hasPreviousPage } edges { node '
+            '{ username } } } } } } }'
+        )
+        with CaptureQueriesContext(connection) as context:
+            data = self.execute(query % 'first: 2')
+        sql = ' '.join(q['sql'] for q in context.captured_queries)
+        self.assertEqual(len(context.captured_queries), 3)
+        self.assertIn('"page_row" <= 3', sql)
+        self.assertNotIn('"auth_user"."password"', sql)
+
+        first, second = [
+            edge['node']['members'] for edge in data['portals']['edges']
+        ]
+        self.assertEqual(
+            [edge['node']['username'] for edge in first['edges']],
+            ['member-4', 'member-3']
+        )
+        self.assertTrue(first['pageInfo']['hasNextPage'])
+        self.assertEqual(
+            [edge['node']['username'] for edge in second['edges']],
+            ['member-0', 'mage']
+        )
+        self.assertFalse(second['pageInfo']['hasNextPage'])
+
+        data = self.execute(query % 'last: 1')
+        first = data['portals']['edges'][0]['node']['members']
+        self.assertEqual(
+            [edge['node']['username'] for edge in first['edges']],
+            ['member-0']
+        )
+        self.assertTrue(first['pageInfo']['hasPreviousPage'])
+
+    def test_max_page_size(self):
+        content = self.post('query { news(first: 1000) { edges { cursor } } }')
+        self.assertIn('exceeds the `first` limit', content['errors'][0]['message'])
+
+
+class VoteTestCase(GraphQLTestCase):
+    """
+    Cada usuário tem um voto por publicação e os totais são atualizados no
+    banco, sem perder votos simultâneos.
+    """
+    def setUp(self):
+        super().setUp()
+        self.populate(1)
+        self.news = News.objects.get()
+
+    def vote(self, post, direction, user=None):
+        return self.post(
+            'mutation { vote(input: {postId: "%s", direction: %s}) { '
+            'direction post { ... on NewsType { proVotes consVotes } '
+            '... on AnswerType { proVotes consVotes } } } }' % (post, direction),
+            user
+        )
+
+    def test_vote_mutation(self):
+        news_id = to_global_id('NewsType', self.news.pk)
+        for direction, expected in (
+                ('UP', {'proVotes': 1, 'consVotes': 0}),
+                ('UP', {'proVotes': 1, 'consVotes': 0}),
+                ('DOWN', {'proVotes': 0, 'consVotes': 1}),
+                ('NONE', {'proVotes': 0, 'consVotes': 0})):
+            content = self.vote(news_id, direction)
+            self.assertNotIn('errors', content)
+            self.assertEqual(content['data']['vote']['direction'], direction)
+            self.assertEqual(content['data']['vote']['post'], expected)
+        self.assertFalse(Vote.objects.exists())
+
+        answer_id = to_global_id('AnswerType', Answer.objects.get().pk)
+        other = get_user_model().objects.create(username='other')
+        self.vote(answer_id, 'UP')
+        content = self.vote(answer_id, 'DOWN', other)
+        self.assertEqual(
+            content['data']['vote']['post'], {'proVotes': 1, 'consVotes': 1}
+        )
+
+    def test_invalid_post(self):
+        content = self.vote(to_global_id('TagType', 1), 'UP')
+        self.assertIn('not a post ID', content['errors'][0]['message'])
+
+        content = self.vote(to_global_id('NewsType', 0), 'UP')
+        self.assertIn('does not exist', content['errors'][0]['message'])
+
+    def test_stale_instances_do_not_lose_votes(self):
+        # cada voto parte da publicação lida antes dos demais votos
+        users = [
+            get_user_model().objects.create(username='voter-%s' % i)
+            for i in range(5)
+        ]
+        instances = [News.objects.get(pk=self.news.pk) for _ in users]
+        for user, news in zip(users, instances):
+            self.assertTrue(cast_vote(user, news, Vote.UP))
+        self.assertFalse(cast_vote(users[0], instances[0], Vote.UP))
+        cast_vote(users[1], instances[1], Vote.DOWN)
+
+        self.news.refresh_from_db()
+        self.assertEqual((self.news.pro_votes, self.news.cons_votes), (4, 1))
+        self.assertEqual(Vote.objects.count(), 5)
+
+    def test_other_integrity_errors_are_not_retried(self):
+        with mock.patch.object(
+                Vote.objects, 'create', side_effect=IntegrityError) as create:
+            with self.assertRaises(IntegrityError):
+                cast_vote(self.user, self.news, Vote.UP)
+        self.assertEqual(create.call_count, 1)
+
+    def test_vote_inserted_before_locking(self):
+        # travar um voto inexistente trava o intervalo do índice, e dois
+        # primeiros votos simultâneos terminariam em deadlock
+        for direction in (Vote.UP, Vote.DOWN):
+            with CaptureQueriesContext(connection) as context:
+                self.assertTrue(cast_vote(self.user, self.news, direction))
+            statements = [
+                q['sql'].split()[0] for q in context.captured_queries
+                if '"civil_cultural_vote"' in q['sql']
+            ]
+            self.assertEqual(statements[0], 'INSERT')
+
+        self.assertEqual(statements, ['INSERT', 'SELECT', 'UPDATE'])
+        self.assertEqual(Vote.objects.get().direction, Vote.DOWN)
+        self.news.refresh_from_db()
+        self.assertEqual((self.news.pro_votes, self.news.cons_votes), (0, 1))
+
+    def test_edits_keep_votes(self):
+        news = News.objects.get(pk=self.news.pk)
+        cast_vote(self.user, self.news, Vote.UP)
+        # a notícia lida antes do voto é editada depois dele
+        news.title = 'edited'
+        save_content(news)
+        news.refresh_from_db()
+        self.assertEqual((news.title, news.pro_votes), ('edited', 1))
+
+    def test_votes_removed_with_post(self):
+        cast_vote(self.user, self.news, Vote.UP)
+        cast_vote(self.user, Answer.objects.get(), Vote.UP)
+        self.news.delete()
+        self.assertEqual(
+            list(Vote.objects.values_list('post_type', flat=True)), ['answer']
+        )
+
+
+class RankingTestCase(GraphQLTestCase):
+    """
+    Notícias e Artigos são ordenados por pontuações gravadas e indexadas,
+    atualizadas a cada voto.
+    """
+    def setUp(self):
+        super().setUp()
+        self.populate(1)
+        self.portal = Portal.objects.get()
+        now = datetime.now(timezone.utc)
+        # notícia antiga muito votada, recente com poucos votos e nova
+        self.news = {}
+        for title, age, votes in (('old', 72, 50), ('recent', 2, 3), ('new', 0, 0)):
+            news = News.objects.create(
+                title=title, body=title, author=self.user,
+                portal_reference=self.portal
+            )
+            news.publication_date = now - timedelta(hours=age)
+            news.save()
+            for i in range(votes):
+                voter = get_user_model().objects.create(username='%s-%s' % (title, i))
+                cast_vote(voter, news, Vote.UP)
+            self.news[title] = news
+        News.objects.filter(title='news').delete()
+
+    def titles(self, order_by, arguments=''):
+        data = self.execute(
+            'query { news(orderBy: %s%s) { edges { node { title } } } '
+            'portals { edges { node { news(orderBy: %s%s) { edges { node '
+            '{ title } } } } } } }' % (order_by, arguments, order_by, arguments)
+        )
+        titles = [edge['node']['title'] for edge in data['news']['edges']]
+        portal_news = data['portals']['edges'][0]['node']['news']['edges']
+        self.assertEqual(titles, [edge['node']['title'] for edge in portal_news])
+        return titles
+
+    def test_hot_score(self):
+        published = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.assertAlmostEqual(
+            hot_score(10, published),
+            hot_score(1, published + timedelta(seconds=HOT_DECAY))
+        )
+        self.assertLess(hot_score(-5, published), hot_score(0, published))
+        self.assertEqual(
+            hot_score(0, published.date()), hot_score(0, published)
+        )
+
+    def test_upvote_never_lowers_hot_score(self):
+        article = Article.objects.create(
+            title='fresh', abstract='fresh', body='fresh',
+            post_author=self.user, published_topic=Topic.objects.get()
+        )
+        news = News.objects.create(
+            title='fresh', body='fresh', author=self.user,
+            portal_reference=self.portal
+        )
+        for post in (article, news):
+            created = type(post).objects.get(pk=post.pk).hot_score
+            for i in range(3):
+                voter = get_user_model().objects.create(
+                    username='%s-fresh-%s' % (post._meta.model_name, i)
+                )
+                cast_vote(voter, post, Vote.UP)
+                voted = type(post).objects.get(pk=post.pk).hot_score
+                self.assertGreaterEqual(voted, created)
+                created = voted
+
+    def test_orderings(self):
+        self.assertEqual(self.titles('NEW'), ['new', 'recent', 'old'])
+        self.assertEqual(self.titles('TOP'), ['old', 'recent', 'new'])
+        self.assertEqual(self.titles('HOT'), ['recent', 'new', 'old'])
+        self.assertEqual(self.titles('HOT', ', first: 1'), ['recent'])
+
+        # os votos alteram a posição sem recalcular as demais publicações
+        voter = get_user_model().objects.create(username='voter')
+        cast_vote(voter, self.news['old'], Vote.DOWN)
+        for i in range(40):
+            voter = get_user_model().objects.create(username='fan-%s' % i)
+            cast_vote(voter, self.news['new'], Vote.UP)
+        self.assertEqual(self.titles('HOT'), ['new', 'recent', 'old'])
+
+        old = News.objects.get(title='old')
+        self.assertEqual((old.score, old.cons_votes), (49, 1))
+
+    def test_ranked_pages(self):
+        data = self.execute(
+            'query { news(orderBy: HOT, first: 2) { pageInfo { endCursor } } }'
+        )
+        cursor = data['news']['pageInfo']['endCursor']
+
+        with CaptureQueriesContext(connection) as queries:
+            data = self.execute(
+                'query { news(orderBy: HOT, first: 2, after: "%s") '
+                '{ edges { node { title } } } }' % cursor
+            )
+        self.assertEqual(
+            [edge['node']['title'] for edge in data['news']['edges']], ['old']
+        )
+        self.assertIn('"hot_score" DESC', queries[-1]['sql'])
+
+    def test_articles(self):
+        article = Article.objects.get()
+        cast_vote(self.user, article, Vote.DOWN)
+        self.assertEqual(Article.objects.get().score, -1)
+        data = self.execute(
+            'query { articles(orderBy: TOP) { edges { node { title score } } } }'
+        )
+        self.assertEqual(
+            data['articles']['edges'][0]['node'],
+            {'title': article.title, 'score': -1}
+        )
+
+
+class CounterTestCase(GraphQLTestCase):
+    """
+    Os contadores agregados acompanham as criações, remoções e entradas
+    e saídas de membros, e podem ser reconciliados com as contagens reais.
+    """
+    def counts(self):
+        portal = Portal.objects.get()
+        return (
+            portal.members_count, portal.topics_count, portal.news_count,
+            Topic.objects.get().articles_count,
+            Article.objects.get().questions_count,
+            Question.objects.get().answers_count,
+        )
+
+    def test_mutations(self):
+        data = self.execute(
+            'mutation { createPortal(input: {name: "guild"}) '
+            '{ portal { id membersCount } } }'
+        )
+        portal = data['createPortal']['portal']
+        self.assertEqual(portal['membersCount'], 1)
+
+        other = get_user_model().objects.create(username='other')
+        data = self.execute(
+            'mutation { joinPortal(input: {portalId: "%s"}) '
+            '{ portal { membersCount } } }' % portal['id'], other
+        )
+        self.assertEqual(data['joinPortal']['portal']['membersCount'], 2)
+        self.execute(
+            'mutation { leavePortal(input: {portalId: "%s"}) '
+            '{ portal { membersCount } } }' % portal['id']
+        )
+        self.assertEqual(Portal.objects.get().members_count, 1)
+
+        # entradas e saídas pelo lado do usuário
+        self.user.portal_set.add(Portal.objects.get())
+        self.assertEqual(Portal.objects.get().members_count, 2)
+        other.portal_set.clear()
+        self.assertEqual(Portal.objects.get().members_count, 1)
+
+    def test_children(self):
+        self.populate(1)
+        self.assertEqual(self.counts(), (0, 1, 1, 1, 1, 1))
+
+        question = Question.objects.get()
+        Answer.objects.create(text='another', author=self.user, question=question)
+        self.assertEqual(Question.objects.get().answers_count, 2)
+
+        data = self.execute(
+            'query { articles { edges { node { questionsCount questions { '
+            'edges { node { answersCount } } } } } } }'
+        )
+        article = data['articles']['edges'][0]['node']
+        self.assertEqual(article['questionsCount'], 1)
+        self.assertEqual(article['questions']['edges'][0]['node']['answersCount'], 2)
+
+        question.delete()
+        News.objects.get().delete()
+        self.assertEqual(Portal.objects.get().news_count, 0)
+        self.assertEqual(Article.objects.get().questions_count, 0)
+
+    def test_edits_keep_counters(self):
+        self.populate(1)
+        topic = Topic.objects.get()
+        Article.objects.create(
+            title='second', abstract='second', body='second',
+            post_author=self.user, published_topic=topic
+        )
+        # o tópico lido antes da criação do artigo é editado depois dela
+        topic.description = 'edited'
+        save_content(topic)
+        topic.refresh_from_db()
+        self.assertEqual((topic.description, topic.articles_count), ('edited', 2))
+
+    def test_reconcile(self):
+        self.populate(1)
+        Portal.objects.update(news_count=7, members_count=3)
+        Question.objects.update(answers_count=-1)
+        Answer.objects.bulk_create([
+            Answer(text='bulk', author=self.user, question=Question.objects.get())
+        ])
+
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertEqual(self.counts(), (0, 1, 1, 1, 1, 2))
+        self.assertFalse(any(reconcile().values()))
+
+
+class MembershipTestCase(GraphQLTestCase):
+    """
+    A participação nos portais é verificada por consultas no índice da
+    tabela de membros, sem carregar os membros do portal.
+    """
+    def test_is_member_is_batched(self):
+        self.populate(4)
+        for portal in Portal.objects.all()[:2]:
+            portal.users.add(self.user)
+
+        with CaptureQueriesContext(connection) as context:
+            data = self.execute(
+                'query { portals { edges { node { name isMember } } } }'
+            )
+        members = {
+            edge['node']['name']: edge['node']['isMember']
+            for edge in data['portals']['edges']
+        }
+        self.assertEqual(sorted(members.values()), [False, False, True, True])
+        self.assertEqual(
+            len([q for q in context.captured_queries if 'portal_users' in q['sql']]),
+            1
+        )
+
+    def test_join_and_leave(self):
+        self.populate(1)
+        portal_id = to_global_id('PortalType', Portal.objects.get().pk)
+        join = (
+            'mutation { joinPortal(input: {portalId: "%s"}) '
+            '{ portal { isMember } } }' % portal_id
+        )
+        leave = (
+            'mutation { leavePortal(input: {portalId: "%s"}) '
+            '{ portal { isMember } } }' % portal_id
+        )
+
+        self.assertTrue(self.execute(join)['joinPortal']['portal']['isMember'])
+        self.assertIn('already a member', self.post(join)['errors'][0]['message'])
+        self.assertFalse(self.execute(leave)['leavePortal']['portal']['isMember'])
+        self.assertIn('not a member', self.post(leave)['errors'][0]['message'])
+
+
+class EntityCacheTestCase(GraphQLTestCase):
+    """
+    Portais, Tópicos, Regras, Tags e usuários resolvidos pelos loaders
+    (chaves estrangeiras fora do JOIN do planejador, como as das
+    publicações encontradas pela busca) passam pelo cache de objetos, que
+    é invalidado pelas alterações.
+    """
+    query = (
+        'query { search(query: "news") { edges { node { post { '
+        '... on NewsType { portal { name membersCount } } } } } } }'
+    )
+
+    def portal_queries(self, query):
+        with CaptureQueriesContext(connection) as context:
+            data = self.execute(query)
+        queries = [
+            q for q in context.captured_queries
+            if 'FROM "civil_cultural_portal"' in q['sql']
+        ]
+        return data, len(queries)
+
+    def portals(self, data):
+        # notícias removidas continuam no índice até o commit
+        return [
+            edge['node']['post']['portal'] for edge in data['search']['edges']
+            if edge['node']['post']
+        ]
+
+    def names(self, data):
+        return sorted(portal['name'] for portal in self.portals(data))
+
+    def test_reads_through_cache(self):
+        self.populate(3)
+        data, queries = self.portal_queries(self.query)
+        self.assertEqual(self.names(data), ['portal-0', 'portal-1', 'portal-2'])
+        self.assertEqual(queries, 1)
+
+        local_hits = get_entity_cache().stats()['local_hits']
+        data, queries = self.portal_queries(self.query)
+        self.assertEqual(self.names(data), ['portal-0', 'portal-1', 'portal-2'])
+        self.assertEqual(queries, 0)
+        self.assertEqual(get_entity_cache().stats()['local_hits'], local_hits + 3)
+
+    def test_invalidation(self):
+        self.populate(2)
+        self.execute(self.query)
+
+        portal = Portal.objects.get(name='portal-0')
+        portal.name = 'renamed'
+        portal.save()
+        Portal.objects.get(name='portal-1').users.add(self.user)
+
+        data, queries = self.portal_queries(self.query)
+        self.assertEqual(self.names(data), ['portal-1', 'renamed'])
+        self.assertEqual(queries, 1)
+        members = {
+            portal['name']: portal['membersCount'] for portal in self.portals(data)
+        }
+        self.assertEqual(members, {'renamed': 0, 'portal-1': 1})
+
+        Portal.objects.get(name='renamed').delete()
+        data = self.execute(self.query)
+        self.assertEqual(self.names(data), ['portal-1'])
+
+    def test_shared_level(self):
+        self.populate(1)
+        portal = Portal.objects.get()
+        # dois workers com o mesmo cache compartilhado
+        first = get_entity_cache()
+        second = EntityCache(first.cache, 10, 0, 60)
+        first.get_many(Portal, [portal.pk])
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(second.get_many(Portal, [portal.pk])[portal.pk].name, 'portal-0')
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(second.stats()['shared_hits'], 1)
+
+        portal.name = 'renamed'
+        portal.save()
+        self.assertEqual(second.get_many(Portal, [portal.pk])[portal.pk].name, 'renamed')
+        self.assertEqual(second.get_many(Portal, [portal.pk + 1]), {})
+
+    def test_local_level_checks_shared_versions(self):
+        self.populate(1)
+        portal = Portal.objects.get()
+        # dois workers com validade local longa
+        first = EntityCache(get_entity_cache().cache, 10, 60, 60)
+        second = EntityCache(first.cache, 10, 60, 60)
+        first.get_many(Portal, [portal.pk])
+
+        # o segundo worker altera o portal
+        Portal.objects.filter(pk=portal.pk).update(name='renamed')
+        second.invalidate(Portal, portal.pk)
+
+        self.assertEqual(
+            first.get_many(Portal, [portal.pk])[portal.pk].name, 'renamed'
+        )
+        self.assertEqual(first.stats()['local_hits'], 0)
+        self.assertEqual(first.stats()['misses'], 2)
+
+    def test_password_hash_is_not_cached(self):
+        self.user.set_password('dragon')
+        self.user.save()
+        cache = get_entity_cache()
+        user = cache.get_many(get_user_model(), [self.user.pk])[self.user.pk]
+        self.assertEqual(user.username, 'mage')
+
+        keys = cache._entry_keys(
+            get_user_model()._meta.label_lower, [self.user.pk]
+        )
+        values = cache.cache.get(keys[self.user.pk])
+        self.assertIn('mage', values)
+        self.assertNotIn(self.user.password, values)
+        self.assertEqual(user.get_deferred_fields(), {
+            'password', 'last_login', 'is_superuser'
+        })
+
+    def test_stats(self):
+        cache = EntityCache(get_entity_cache().cache, 10, 60, 60)
+        self.populate(1)
+        pk = Portal.objects.get().pk
+        cache.get_many(Portal, [pk])
+        cache.get_many(Portal, [pk])
+        self.assertEqual(cache.stats(), {
+            'local_hits': 1, 'shared_hits': 0, 'misses': 1,
+            'invalidations': 0, 'local_size': 1, 'hit_ratio': 0.5
+        })
+
+        data = self.execute(
+            'query { entityCacheStats { localHits misses hitRatio } }'
+        )
+        stats = get_entity_cache().stats()
+        self.assertEqual(data['entityCacheStats'], {
+            'localHits': stats['local_hits'],
+            'misses': stats['misses'],
+            'hitRatio': stats['hit_ratio'],
+        })
+
+
+class ResponseCacheTestCase(GraphQLTestCase):
+    """
+    Com o cache de respostas ativado, consultas repetidas não são
+    executadas novamente até que uma alteração descarte as respostas que
+    leram os models alterados.
+    """
+    portals = 'query { portals { edges { node { name topicsCount } } } }'
+    tags = 'query { tags { edges { node { reference } } } }'
+
+    def setUp(self):
+        super().setUp()
+        response_settings = self.settings(GRAPHQL_RESPONSE_CACHE=True)
+        response_settings.enable()
+        self.addCleanup(response_settings.disable)
+        # as respostas guardadas por outros testes podem ter as mesmas tags
+        caches[settings.GRAPHQL_RESPONSE_CACHE_ALIAS].clear()
+
+    def table_queries(self, query, table, user=None):
+        with CaptureQueriesContext(connection) as context:
+            data = self.execute(query, user)
+        queries = [
+            q for q in context.captured_queries
+            if 'FROM "civil_cultural_%s"' % table in q['sql']
+        ]
+        return data, len(queries)
+
+    def test_repeated_query(self):
+        self.populate(2)
+        data, queries = self.table_queries(self.portals, 'portal')
+        self.assertTrue(queries)
+
+        # a mesma consulta com outra formatação
+        cached, queries = self.table_queries(
+            'query {\n  portals { edges { node { name  topicsCount } } }  # front page\n}',
+            'portal'
+        )
+        self.assertEqual(queries, 0)
+        self.assertEqual(cached, data)
+
+    def test_mutation_evicts_affected_tags(self):
+        self.populate(1)
+        Tag.objects.create(reference='mage')
+        self.execute(self.portals)
+        self.execute(self.tags)
+
+        portal_id = to_global_id('PortalType', Portal.objects.get().pk)
+        self.execute(
+            'mutation { createTopic(input: {name: "spells", scope: "magic", '
+            'portal: "%s"}) { topic { name } } }' % portal_id
+        )
+
+        data, queries = self.table_queries(self.portals, 'portal')
+        self.assertTrue(queries)
+        self.assertEqual(data['portals']['edges'][0]['node']['topicsCount'], 2)
+        data, queries = self.table_queries(self.tags, 'tag')
+        self.assertEqual(queries, 0)
+
+    def test_viewer_scope(self):
+        self.populate(2)
+        Portal.objects.get(name='portal-0').users.add(self.user)
+        other = get_user_model().objects.create(username='other')
+        query = 'query { portals { edges { node { name isMember } } } }'
+
+        def members(user):
+            data = self.execute(query, user)
+            return {
+                edge['node']['name']: edge['node']['isMember']
+                for edge in data['portals']['edges']
+            }
+
+        self.assertEqual(members(self.user), {'portal-0': True, 'portal-1': False})
+        self.assertEqual(members(other), {'portal-0': False, 'portal-1': False})
+        _, queries = self.table_queries(query, 'portal', self.user)
+        self.assertEqual(queries, 0)
+
+    def test_errors_and_metrics_are_not_cached(self):
+        from django.contrib.auth.models import AnonymousUser
+        from graphql import parse
+        from server.schema import schema
+
+        self.populate(1)
+        self.assertIn('errors', self.post(self.portals, AnonymousUser()))
+        key = response_key(parse(self.portals), None, None, 'Not logged in!')
+        self.assertIsNone(caches[settings.GRAPHQL_RESPONSE_CACHE_ALIAS].get(key))
+
+        tags, viewer, cacheable = analyze(schema, parse(self.portals))
+        self.assertEqual(tags, {'civil_cultural.portal'})
+        self.assertTrue(cacheable)
+        _, _, cacheable = analyze(
+            schema, parse('query { entityCacheStats { misses } }')
+        )
+        self.assertFalse(cacheable)
+
+    def test_disabled(self):
+        self.populate(1)
+        with self.settings(GRAPHQL_RESPONSE_CACHE=False):
+            self.execute(self.portals)
+            _, queries = self.table_queries(self.portals, 'portal')
+        self.assertTrue(queries)
@@ -0,0 +1,45 @@
+"""
+Versões guardadas no cache compartilhado, usadas pelo cache de objetos
+(civil_cultural.cache) e pelo cache de respostas
+(civil_cultural.responses).
+
+Uma entrada em cache guarda, na chave ou junto do valor, as versões que
+estavam em vigor quando foi lida. Invalidar troca a versão em vez de
+apagar as entradas: uma entrada gravada por um worker que leu os dados
+antes da alteração fica na versão antiga, que não é mais usada.
+"""
+import uuid
+
+from django.db import transaction
+
+
+def get_versions(cache, keys):
+    """
+    Versões atuais. Versões ausentes são criadas.
+
+    param cache: <django.core.cache.backends.base.BaseCache>
+    param keys: <list> chaves das versões
+    rtype: <dict> chave -> versão
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            # outro worker pode ter criado a versão ao mesmo tempo
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return versions
+
+
+def change_version(cache, key):
+    """
+    Troca uma versão. A troca é repetida após o commit, pois outros
+    workers podem ter lido os dados anteriores, e gravado as entradas na
+    versão nova, enquanto a transação estava aberta.
+
+    param cache: <django.core.cache.backends.base.BaseCache>
+    param key: <str> chave da versão
+    """
+    cache.set(key, uuid.uuid4().hex, None)
+    transaction.on_commit(lambda: cache.set(key, uuid.uuid4().hex, None))
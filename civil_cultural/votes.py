@@ -0,0 +1,122 @@
+"""
+Votos das publicações.
+
+Cada usuário tem no máximo um voto por publicação, registrado na tabela
+Vote. Os totais pro_votes e cons_votes da publicação são alterados com
+expressões F() (UPDATE ... SET pro_votes = pro_votes + 1) na mesma
+transação do registro: votos simultâneos nunca se sobrescrevem, como
+aconteceria lendo a publicação, somando e salvando com save().
+
+O registro do voto é gravado antes dos totais, então a linha da
+publicação, disputada por todos os votantes, fica travada somente entre o
+UPDATE dos totais e o commit.
+
+O voto é inserido antes de qualquer leitura: um SELECT ... FOR UPDATE de
+um voto que ainda não existe trava o intervalo do índice (gap lock no
+InnoDB), e dois primeiros votos simultâneos que travam o mesmo intervalo
+e depois inserem nele terminam em deadlock. Se o voto já existe, a
+inserção falha pela restrição de unicidade e só então a linha, que agora
+existe, é travada e alterada.
+
+Pelo mesmo motivo, as mutations de edição gravam as publicações com
+save_content, que não grava os campos alterados por UPDATEs com F().
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.dispatch import Signal
+
+from civil_cultural.models import (Answer, Article, News, Question,
+                                   SimilarSuggestion, Vote)
+
+
+VOTABLE_MODELS = {
+    model._meta.model_name: model
+    for model in (Article, News, Question, Answer, SimilarSuggestion)
+}
+
+COUNTERS = {
+    Vote.UP: 'pro_votes',
+    Vote.DOWN: 'cons_votes',
+}
+
+# campos alterados somente por UPDATEs com F(): os totais dos votos, as
+# pontuações calculadas a partir deles (ver civil_cultural.ranking) e os
+# contadores agregados (ver civil_cultural.counters)
+CONCURRENT_FIELDS = {
+    'pro_votes', 'cons_votes', 'score', 'hot_score', 'members_count',
+    'topics_count', 'news_count', 'articles_count', 'questions_count',
+    'answers_count',
+}
+
+# Enviado depois que os totais de uma publicação mudam. Os totais são
+# alterados por UPDATE, sem save(), então o post_save não é enviado.
+post_voted = Signal(providing_args=['instance'])
+
+
+def cast_vote(user, post, direction):
+    """
+    Registra o voto do usuário em uma publicação, substituindo o voto
+    anterior, e atualiza os totais da publicação.
+
+    param user: <User>
+    param post: <Article>, <News>, <Question>, <Answer> ou <SimilarSuggestion>
+    param direction: <int> Vote.UP, Vote.DOWN ou None para remover o voto
+    rtype: <bool> se o voto do usuário mudou
+    """
+    post_type = post._meta.model_name
+    if post_type not in VOTABLE_MODELS:
+        raise Exception('This post cannot be voted.')
+
+    votes = Vote.objects.filter(user=user, post_type=post_type, post_id=post.pk)
+    locked = votes.select_for_update().values_list('direction', flat=True)
+    with transaction.atomic():
+        if direction is None:
+            # nada é inserido, então só um voto existente é travado
+            previous = locked.first()
+        else:
+            try:
+                with transaction.atomic():
+                    Vote.objects.create(
+                        user=user,
+                        post_type=post_type,
+                        post_id=post.pk,
+                        direction=direction
+                    )
+                previous = None
+            except IntegrityError:
+                # o usuário já votou: a linha existe e pode ser travada.
+                # Os demais erros (ex.: usuário removido) são repassados
+                previous = locked.first()
+                if previous is None:
+                    raise
+
+        if previous == direction:
+            return False
+        if direction is None:
+            votes.delete()
+        elif previous is not None:
+            votes.update(direction=direction)
+
+        counters = {}
+        if previous is not None:
+            counters[COUNTERS[previous]] = F(COUNTERS[previous]) - 1
+        if direction is not None:
+            counters[COUNTERS[direction]] = F(COUNTERS[direction]) + 1
+        type(post).objects.filter(pk=post.pk).update(**counters)
+
+        post.refresh_from_db(fields=['pro_votes', 'cons_votes'])
+        post_voted.send(sender=type(post), instance=post)
+    return True
+
+
+def save_content(instance):
+    """
+    Salva um objeto já gravado sem os campos de CONCURRENT_FIELDS, que
+    teriam os valores lidos antes de votos e contagens simultâneos.
+
+    param instance: <django.db.models.Model>
+    """
+    instance.save(update_fields=[
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in CONCURRENT_FIELDS
+    ])
@@ -0,0 +1,44 @@
+'''
+Travas entre processos sobre arquivos auxiliares, usadas pelos índices e
+filtros gravados em disco e compartilhados pelos workers: o índice de
+busca, os índices do chatbot e o filtro de revogação de tokens.
+'''
+import fcntl
+import os
+
+
+class FileLock:
+    '''
+    Trava entre processos sobre um arquivo auxiliar ao lado de `path`.
+    O diretório do arquivo é criado caso ainda não exista.
+
+    param path: <str>
+    param suffix: <str> extensão do arquivo auxiliar; travas com extensões
+                  diferentes são independentes
+    param shared: <bool> trava compartilhada, que só exclui as travas
+                  exclusivas
+    param blocking: <bool> com False, a trava não espera e `acquired`
+                    indica se ela foi obtida
+    '''
+    def __init__(self, path, suffix='.lock', shared=False, blocking=True):
+        self.path = path + suffix
+        self.operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            self.operation |= fcntl.LOCK_NB
+        self.acquired = False
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.file = open(self.path, 'a')
+        try:
+            fcntl.flock(self.file, self.operation)
+            self.acquired = True
+        except BlockingIOError:
+            pass
+        return self
+
+    def __exit__(self, *args):
+        if self.acquired:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.acquired = False
+        self.file.close()
@@ -1,20 +1,20 @@
 import graphene
 import graphql_jwt
 
-# import chatbot.schema as chatbot
+import chatbot.schema as chatbot
 import users.schema as users
 import civil_cultural.schema as civil_cultural
 
 queries = (
     graphene.ObjectType,
-    # chatbot.Query,
+    chatbot.Query,
     users.Query,
     civil_cultural.Query,
 )
 
 mutations = (
     graphene.ObjectType,
-    # chatbot.Mutation,
+    chatbot.Mutation,
     users.Mutation,
     civil_cultural.Mutation,
 )
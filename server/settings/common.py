@@ -37,7 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'graphene_django',
-    # 'chatbot',
+    'chatbot',
     'black_list',
     'civil_cultural',
     'corsheaders',
@@ -135,6 +135,68 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Arquivo onde o índice de busca de Notícias e Artigos é persistido
+SEARCH_INDEX_PATH = os.path.join(BASE_DIR, 'search_index.pickle')
+
+# Tamanho do log de alterações do índice de busca a partir do qual ele é
+# incorporado ao arquivo acima
+SEARCH_INDEX_LOG_SIZE = 8 * 1024 * 1024
+
+# Bloom filter de tokens revogados, mapeado em memória por todos os workers.
+# Com o valor None toda verificação de revogação consulta o banco.
+TOKEN_BLACKLIST_FILTER_PATH = os.path.join(BASE_DIR, 'token_blacklist.bloom')
+TOKEN_BLACKLIST_FILTER_BITS = 2 ** 23
+
+# Índice do chatbot (vocabulário, pesos IDF e matriz TF-IDF), gerado pelo
+# comando build_chatbot_index e mapeado em memória pelos workers
+CHATBOT_INDEX_PATH = os.path.join(BASE_DIR, 'chatbot_index')
+
+# Dados do NLTK usados pelo chatbot, baixados pelo build_chatbot_index
+CHATBOT_NLTK_DATA = os.path.join(BASE_DIR, 'nltk_data')
+
+# Processos usados pelo build_chatbot_index para tokenizar o corpus
+CHATBOT_PREPROCESS_WORKERS = os.cpu_count() or 1
+
+# Processos dedicados à inferência do chatbot, perguntas pendentes aceitas
+# e tempo máximo de resposta em segundos (somente com processos). Com 0 as
+# perguntas são respondidas na própria requisição: em máquinas com poucos
+# núcleos os processos extras pioram a latência das demais requisições
+# (ver benchmark_chatbot load), então o pool só deve ser ativado em
+# servidores com núcleos livres para ele.
+CHATBOT_POOL_WORKERS = 0
+CHATBOT_POOL_MAX_PENDING = 16
+CHATBOT_TIMEOUT = 5
+
+# Carrega o chatbot em segundo plano quando o worker inicia (server.wsgi);
+# com False ele é carregado na primeira pergunta
+CHATBOT_WARM_UP = True
+
+# Respostas do chatbot guardadas por worker e validade em segundos
+CHATBOT_CACHE_SIZE = 1024
+CHATBOT_CACHE_TTL = 300
+
+# Cache compartilhado pelos workers. O LocMemCache é local a cada processo;
+# em produção o cache deve apontar para um memcached ou Redis.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache de Portais, Tópicos, Regras, Tags e usuários (civil_cultural.cache):
+# alias do nível compartilhado, objetos guardados por worker e validade em
+# segundos das entradas de cada worker e das compartilhadas
+ENTITY_CACHE_ALIAS = 'default'
+ENTITY_CACHE_LOCAL_SIZE = 10000
+ENTITY_CACHE_LOCAL_TTL = 5
+ENTITY_CACHE_TTL = 600
+
+# Cache de respostas inteiras das consultas GraphQL (civil_cultural.responses),
+# desativado por padrão: alias do cache e validade das respostas em segundos
+GRAPHQL_RESPONSE_CACHE = False
+GRAPHQL_RESPONSE_CACHE_ALIAS = 'default'
+GRAPHQL_RESPONSE_CACHE_TTL = 60
+
 GRAPHENE = {
     'SCHEMA': 'server.schema.schema',
 }
@@ -0,0 +1,37 @@
+"""
+Views do servidor.
+
+By: BeelzeBruno <brunolcarli@gmail.com>
+"""
+from django.conf import settings
+from graphene_django.views import GraphQLView
+
+from civil_cultural.loaders import Loaders
+from civil_cultural.responses import execute_cached
+
+
+class CivilGraphQLView(GraphQLView):
+    """
+    GraphQLView que disponibiliza, no contexto de cada requisição,
+    os DataLoaders usados pelos resolvers de chaves estrangeiras.
+    Com a setting GRAPHQL_RESPONSE_CACHE as consultas passam pelo cache
+    de respostas (ver civil_cultural.responses).
+    """
+    def get_context(self, request):
+        request.loaders = Loaders()
+        return request
+
+    def execute_graphql_request(self, request, data, query, variables,
+                                operation_name, show_graphiql=False):
+        execute = super().execute_graphql_request
+        if not settings.GRAPHQL_RESPONSE_CACHE or not query:
+            return execute(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+
+        return execute_cached(
+            self.schema, request, query, variables, operation_name,
+            lambda: execute(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+        )
@@ -12,8 +12,9 @@ By Beelzebruno <brunolcarli@gmail.com>
 import graphene
 from graphene_django import DjangoObjectType
 from django.contrib.auth import get_user_model
-from users.utils import is_adult, access_required
+from users.utils import is_adult, access_required, reset_access
 from black_list.models import TokenBlackList
+from civil_cultural.fields import QuerySetConnectionField
 
 
 class UserType(DjangoObjectType):
@@ -36,7 +37,7 @@ class Query(object):
     Consultas GraphQL delimitando-se ao escopo
     de usuários.
     """
-    users = graphene.relay.ConnectionField(UserConnection)
+    users = QuerySetConnectionField(UserConnection)
 
     @access_required
     def resolve_users(self, info, **kwargs):
@@ -97,8 +98,8 @@ class LogOut(graphene.relay.ClientIDMutation):
         meta_info = info.context.META
         user_token = meta_info.get('HTTP_AUTHORIZATION')
 
-        revoke = TokenBlackList.objects.create(token=user_token)
-        revoke.save()
+        TokenBlackList.objects.revoke(user_token)
+        reset_access(info.context)
 
         return LogOut("Bye Bye")
 
@@ -23,6 +23,37 @@ def is_adult(birth_date):
         return True
     return False
 
+def get_access_error(context):
+    '''
+    Verifica se o usuário da requisição pode acessar o sistema.
+    A verificação é feita uma única vez por requisição e o resultado fica
+    guardado no contexto, de modo que todos os resolvers da consulta
+    compartilham a mesma consulta à black list.
+
+    param context: <HttpRequest>
+    return: <str> mensagem de erro, ou None se o acesso for permitido
+    '''
+    if not hasattr(context, '_access_error'):
+        user_token = context.META.get('HTTP_AUTHORIZATION')
+        if user_token and TokenBlackList.objects.is_revoked(user_token):
+            context._access_error = 'Session Expired, please log in again!'
+        elif context.user.is_anonymous:
+            context._access_error = 'Not logged in!'
+        else:
+            context._access_error = None
+
+    return context._access_error
+
+
+def reset_access(context):
+    '''
+    Descarta a verificação de acesso guardada no contexto, forçando uma
+    nova verificação (ex.: após o token ser revogado).
+    '''
+    if hasattr(context, '_access_error'):
+        del context._access_error
+
+
 # A principio so funciona se o token vier na forma:
 # "Authorization": "JWT token""
 # TODO implementar uma alterantiva para receber Bearer token
@@ -32,14 +63,9 @@ def access_required(function):
     '''
     @wraps(function)
     def decorated(*args, **kwargs):
-        user_token = args[1].context.META.get('HTTP_AUTHORIZATION')
-        is_black_listed = TokenBlackList.objects.filter(token=user_token)
-        if is_black_listed:
-            raise Exception('Session Expired, please log in again!')
-
-        user = args[1].context.user
-        if user.is_anonymous:
-            raise Exception('Not logged in!')
+        error = get_access_error(args[1].context)
+        if error:
+            raise Exception(error)
 
         return function(*args, **kwargs)
     return decorated